@@ -0,0 +1,294 @@
+
+# *** NL2XLOG version ***
+
+# Compact binary orecs, an alternative to JSON (OFORMAT 'binary').
+# Access:  ACCESS (b'A', time_utc, status, body_bytes_sent, flags,
+#          IPv4 remote_addr), then strings: _el, _id, _si, _sl,
+#          http_referer, http_user_agent, [remote_addr if not IPv4,]
+#          remote_user, request, time_local.
+# Error:   ERROR (b'E', time_utc), then strings: _el, _id, _si, _sl,
+#          status, stuff, time_local.
+# A string is a length byte and that many UTF-8 bytes; the length
+#   byte is SNONE for None, or SLONG and a 4-byte length for long ones.
+# An orec that won't fit (eg, a non-integer time_utc) stays JSON; a
+#   record starting with b'{' is JSON.
+# Records are length-prefixed (RLEN) in files: OFWriter 'length'
+#   framing, backfill spools; OXLOG frames already are.
+# decode() gives back the dict json.loads() gives for the JSON orec.
+#
+# Dictionary coding (per connection or file, in send order):
+#   DictCoder rewrites an access orec's http_referer, http_user_agent
+#   and (non-IPv4) remote_addr: a string's first appearance becomes
+#   SDEF, a 2-byte id and the string, and a repeat just SREF and the
+#   id.  Ids are recycled least recently used first, and a SDEF says
+#   which.  A DICTRESET record starts a stream (eg, an OFILE session).
+#   DictDecoder.expand() gives back the plain orec, for decode().
+
+import json, socket, struct, collections
+from l_misc import tblineno
+
+RLEN = struct.Struct('!I')              # Record length (files).
+ACCESS = struct.Struct('!cqHqB4s')
+ERROR = struct.Struct('!cq')
+F_IPV4 = 0x01                           # ACCESS flags: remote_addr is packed.
+SNONE, SLONG = 0xfe, 0xff               # String length byte: None, long,
+SDEF, SREF = 0xfc, 0xfd                 #   dictionary coded: define id, use id.
+DICTID = struct.Struct('!BH')           # SDEF or SREF, id.
+DICTRESET = b'D'                        # Record: a new dictionary follows.
+DICTN = 4096                            # Dictionary ids (at most 65536).
+DICTMIN = 4                             # Shorter strings are not coded.
+
+
+def _s(v):
+    if v is None:
+        return b'\xfe'
+    b = v.encode('utf-8', 'surrogatepass')
+    if len(b) < SDEF:
+        return bytes((len(b),)) + b
+    return b'\xff' + RLEN.pack(len(b)) + b
+
+def _ints(*z):
+    return all(type(v) is int for v in z)
+
+def _fits(time_utc, status, body_bytes_sent):
+    return (_ints(time_utc, status, body_bytes_sent) and
+            0 <= status < 65536 and 0 <= body_bytes_sent < 2**63 and -2**63 <= time_utc < 2**63)
+
+def _ip4(remote_addr):
+    # (flags, packed IPv4) for ACCESS.
+    try:
+        z = socket.inet_aton(remote_addr)
+        if socket.inet_ntoa(z) == remote_addr:
+            return F_IPV4, z
+    except (OSError, TypeError):
+        pass
+    return 0, b'\0\0\0\0'
+
+def encodeAccess(el, srcid, subid, sl, body_bytes_sent, http_referer, http_user_agent,
+                 remote_addr, remote_user, request, status, time_local, time_utc):
+    """Binary access orec, or None if it won't fit (use JSON)."""
+    if not _fits(time_utc, status, body_bytes_sent):
+        return None
+    flags, ip = _ip4(remote_addr)
+    return b''.join((
+        ACCESS.pack(b'A', time_utc, status, body_bytes_sent, flags, ip),
+        _s(el), _s(srcid), _s(subid), _s(sl), _s(http_referer), _s(http_user_agent),
+        b'' if flags & F_IPV4 else _s(remote_addr),
+        _s(remote_user), _s(request), _s(time_local)))
+
+def encodeError(el, srcid, subid, sl, status, stuff, time_local, time_utc):
+    """Binary error orec, or None if it won't fit (use JSON)."""
+    if not (_ints(time_utc) and -2**63 <= time_utc < 2**63):
+        return None
+    return b''.join((
+        ERROR.pack(b'E', time_utc),
+        _s(el), _s(srcid), _s(subid), _s(sl), _s(status), _s(stuff), _s(time_local)))
+
+# Batches (nlmon.genBatch): as above, down columns, with the batch's
+# repeated strings (and addresses) encoded once.
+
+def encodeAccesses(el, srcid, subid, sl, body_bytes_sent, http_referer, http_user_agent,
+                   remote_addr, remote_user, request, status, time_local, time_utc):
+    """encodeAccess() of each row of the columns.  A list, None where JSON is needed."""
+    sc, ipc = {}, {}
+    def S(v):
+        z = sc[v] = _s(v)
+        return z
+    def IP(v):
+        z = ipc[v] = _ip4(v)
+        return z
+    head = _s(el) + _s(srcid) + _s(subid) + _s(sl)
+    pack = ACCESS.pack
+    z = []
+    for bb, rf, ua, ra, ru, rq, st, tl, tu in zip(body_bytes_sent, http_referer, http_user_agent,
+                            remote_addr, remote_user, request, status, time_local, time_utc):
+        if not _fits(tu, st, bb):
+            z.append(None)
+            continue
+        flags, ip = ipc.get(ra) or IP(ra)
+        z.append(b''.join((
+            pack(b'A', tu, st, bb, flags, ip), head, 
+            sc.get(rf) or S(rf), sc.get(ua) or S(ua),
+            b'' if flags else (sc.get(ra) or S(ra)),
+            sc.get(ru) or S(ru), _s(rq), sc.get(tl) or S(tl))))
+    return z
+
+def encodeErrors(el, srcid, subid, sl, status, stuff, time_local, time_utc):
+    """encodeError() of each row of the columns.  A list, None where JSON is needed."""
+    sc = {}
+    def S(v):
+        z = sc[v] = _s(v)
+        return z
+    head = _s(el) + _s(srcid) + _s(subid) + _s(sl)
+    pack = ERROR.pack
+    z = []
+    for st, sf, tl, tu in zip(status, stuff, time_local, time_utc):
+        if not (type(tu) is int and -2**63 <= tu < 2**63):
+            z.append(None)
+            continue
+        z.append(b''.join((pack(b'E', tu), head, sc.get(st) or S(st), _s(sf), sc.get(tl) or S(tl))))
+    return z
+
+
+def _strings(rec, x, n):
+    # n strings from rec[x:].  Returns (list, next x).
+    z = []
+    for _ in range(n):
+        k = rec[x]
+        x += 1
+        if k == SNONE:
+            z.append(None)
+            continue
+        if k == SLONG:
+            k = RLEN.unpack_from(rec, x)[0]
+            x += RLEN.size
+        z.append(bytes(rec[x:x+k]).decode('utf-8', 'surrogatepass'))
+        x += k
+    return z, x
+
+def _tsBD(ts):
+    # As nlmon.tsBDstr.
+    return ('%15.4f' % ts).replace('.0000', '.    ')
+
+def decode(rec):
+    """The orec's dict, as json.loads() of its JSON would give."""
+    try:
+        kind = rec[:1]
+        if kind == b'{':
+            return json.loads(bytes(rec).decode('utf-8'))
+        if kind == b'A':
+            _, time_utc, status, body_bytes_sent, flags, ip = ACCESS.unpack_from(rec)
+            n = 9 if flags & F_IPV4 else 10
+            z, x = _strings(rec, ACCESS.size, n)
+            if flags & F_IPV4:
+                z.insert(6, socket.inet_ntoa(ip))
+            el, srcid, subid, sl, http_referer, http_user_agent, remote_addr, remote_user, request, time_local = z
+            return {'_el': el, '_id': srcid, '_ip': None, '_si': subid, '_sl': sl, '_ts': _tsBD(time_utc),
+                    'ae': 'a', 'body_bytes_sent': body_bytes_sent, 'http_referer': http_referer,
+                    'http_user_agent': http_user_agent, 'remote_addr': remote_addr,
+                    'remote_user': remote_user, 'request': request, 'status': status,
+                    'time_local': time_local, 'time_utc': time_utc}
+        if kind == b'E':
+            _, time_utc = ERROR.unpack_from(rec)
+            z, x = _strings(rec, ERROR.size, 7)
+            el, srcid, subid, sl, status, stuff, time_local = z
+            return {'_el': el, '_id': srcid, '_ip': None, '_si': subid, '_sl': sl, '_ts': _tsBD(time_utc),
+                    'ae': 'e', 'status': status, 'stuff': stuff,
+                    'time_local': time_local, 'time_utc': time_utc}
+        raise ValueError('unknown record kind: %s' % repr(kind))
+    except Exception as E:
+        errmsg = 'binrec.decode: %s @ %s' % (E, tblineno())
+        raise ValueError(errmsg)
+
+def _skip(rec, x, n):
+    # End of the n (plain) strings from rec[x:].
+    for _ in range(n):
+        k = rec[x]
+        if k == SNONE:
+            x += 1
+        elif k == SLONG:
+            x += 1 + RLEN.size + RLEN.unpack_from(rec, x + 1)[0]
+        else:
+            x += 1 + k
+    return x
+
+def _coded(rec):
+    # Access orec's (prefix end, # coded strings), or None.
+    if rec[:1] != b'A':
+        return None
+    flags = ACCESS.unpack_from(rec)[4]
+    return _skip(rec, ACCESS.size, 4), 2 if flags & F_IPV4 else 3
+
+
+class DictCoder():
+
+    def __init__(self, capacity=DICTN):
+        self.capacity = min(capacity, 65536)
+        self.ids = collections.OrderedDict()    # String (as encoded) -> id, LRU first.
+        self.nrefs = 0                  # Strings sent as ids.
+
+    def reset(self):
+        """Forget the dictionary.  Returns the DICTRESET record to send."""
+        self.ids.clear()
+        return DICTRESET
+
+    def code(self, rec):
+        """rec (bytes), dictionary coded if it's a binary access orec."""
+        z = _coded(rec)
+        if z is None:
+            return rec
+        x, n = z
+        z = [rec[:x]]
+        for _ in range(n):
+            y = _skip(rec, x, 1)
+            z.append(self._code(rec[x:y]))
+            x = y
+        z.append(rec[x:])
+        return b''.join(z)
+
+    def _code(self, s):
+        if len(s) <= DICTMIN or s[0] == SNONE:
+            return s
+        ids = self.ids
+        k = ids.get(s)
+        if k is not None:
+            ids.move_to_end(s)
+            self.nrefs += 1
+            return DICTID.pack(SREF, k)
+        if len(ids) < self.capacity:
+            k = len(ids)
+        else:
+            k = ids.popitem(last=False)[1]
+        ids[s] = k
+        return DICTID.pack(SDEF, k) + s
+
+
+class DictDecoder():
+
+    def __init__(self):
+        self.strs = {}                  # Id -> string (as encoded).
+
+    def expand(self, rec):
+        """rec as a plain orec, or None if it was a DICTRESET."""
+        try:
+            if rec[:1] == DICTRESET:
+                self.strs = {}
+                return None
+            z = _coded(rec)
+            if z is None:
+                return rec
+            x, n = z
+            z = [rec[:x]]
+            for _ in range(n):
+                k = rec[x]
+                if k == SREF:
+                    z.append(self.strs[DICTID.unpack_from(rec, x)[1]])
+                    x += DICTID.size
+                    continue
+                if k == SDEF:
+                    i = DICTID.unpack_from(rec, x)[1]
+                    x += DICTID.size
+                    y = _skip(rec, x, 1)
+                    self.strs[i] = bytes(rec[x:y])
+                else:
+                    y = _skip(rec, x, 1)
+                z.append(rec[x:y])
+                x = y
+            z.append(rec[x:])
+            return b''.join(z)
+        except Exception as E:
+            errmsg = 'DictDecoder.expand: %s @ %s' % (E, tblineno())
+            raise ValueError(errmsg)
+
+
+def readRecords(f):
+    """Yield the length-prefixed records of binary file f."""
+    while True:
+        z = f.read(RLEN.size)
+        if len(z) < RLEN.size:
+            return                      # EOF (or a torn length).
+        n = RLEN.unpack(z)[0]
+        z = f.read(n)
+        if len(z) < n:
+            return                      # Torn last record.
+        yield z
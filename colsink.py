@@ -0,0 +1,249 @@
+
+# *** NL2XLOG version ***
+
+# Hourly columnar export of access records, for analytics (COLPATH).
+# Rows are buffered per UTC hour of time_utc, in array columns:
+#   time_utc         int64
+#   status           uint16
+#   body_bytes_sent  int64
+#   ipv4             uint32   remote_addr, 0 if not IPv4.
+#   request          int32    Ids into the part's dictionaries,
+#   user_agent       int32      -1 for None.
+#   referer          int32
+# An hour is written as a part folder, '<YYYYmmddHH>-<seqn>', of one
+#   .npy per column (np.load(..., mmap_mode='r') maps them), and per
+#   dictionary <col>.off.npy (int64 offsets, n+1) and <col>.str.npy
+#   (uint8, the UTF-8 strings end to end).
+# manifest.json lists the parts (hour, rows, time_utc range), and is
+#   replaced only after a part is complete, so readers see whole parts.
+#   Part seqns come from the part folders there, so a part renamed
+#   but not yet in the manifest (a crash) is never overwritten.
+# Hours are written when idle (no new rows for 'idle' seconds, by tick()),
+#   at 'maxrows', and at close().  Past 'maxbuffered' rows in all, the
+#   oldest hour is written (backfill: many hours, in time order).
+#   Buffered rows are lost if the process dies: this is an analytics
+#   copy, not the record.
+# Values that won't fit their columns (as binrec._fits) are stored as 
+#   sentinels, status BADSTATUS and body_bytes_sent BADBYTES; a row 
+#   whose time_utc won't is skipped.  Both are counted (nbad).
+# numpy is optional; only this sink needs it.
+
+import os, json, time, array, socket, struct, shutil
+from l_misc import tblineno
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MANIFEST = 'manifest.json'
+MAXROWS = 1048576               # Rows per part, at most.
+MAXBUFFERED = 2 * MAXROWS       # Rows buffered, all hours.
+IDLE = 300                      # Seconds without rows before an hour is written.
+COLUMNS = (                     # (name, array typecode, numpy dtype)
+    ('time_utc',        'q', 'int64'),
+    ('status',          'H', 'uint16'),
+    ('body_bytes_sent', 'q', 'int64'),
+    ('ipv4',            'I', 'uint32'),
+    ('request',         'i', 'int32'),
+    ('user_agent',      'i', 'int32'),
+    ('referer',         'i', 'int32'))
+DICTS = ('request', 'user_agent', 'referer')
+BADSTATUS = 0                   # Sentinels for values that won't fit.
+BADBYTES = -1
+_IP = struct.Struct('!I')
+
+
+def available():
+    """Is numpy there?"""
+    return numpy is not None
+
+def _fits(v, lo, hi):
+    return type(v) is int and lo <= v < hi
+
+def ipv4(remote_addr):
+    """remote_addr as a uint32, 0 if it's not a dotted quad."""
+    try:
+        z = socket.inet_aton(remote_addr)
+        if socket.inet_ntoa(z) == remote_addr:
+            return _IP.unpack(z)[0]
+    except (OSError, TypeError):
+        pass
+    return 0
+
+
+class _Hour():
+    """An hour's buffered rows, and its dictionaries."""
+
+    def __init__(self, hk):
+        self.hk = hk                        # time_utc // 3600.
+        self.hour = time.strftime('%Y%m%d%H', time.gmtime(hk * 3600))
+        self.cols = {name: array.array(tc) for name, tc, _ in COLUMNS}
+        self.dicts = {name: {} for name in DICTS}
+        self.n = 0                          # Rows at the last tick(),
+        self.t = time.monotonic()           #   and when it last grew.
+
+    def __len__(self):
+        return len(self.cols['time_utc'])
+
+
+class ColumnarSink():
+
+    def __init__(self, dpath, maxrows=MAXROWS, idle=IDLE, maxbuffered=MAXBUFFERED):
+        if numpy is None:
+            raise RuntimeError('ColumnarSink: numpy is not available')
+        try:
+            self.dpath = dpath
+            self.maxrows = maxrows
+            self.idle = idle
+            self.maxbuffered = maxbuffered
+            self.hours = {}                 # time_utc // 3600 -> _Hour.
+            self.last = None                # The last add's _Hour.
+            self.nbuffered = 0              # Rows in self.hours.
+            self.nrows = 0                  # Rows written.
+            self.nparts = 0                 # Parts written.
+            self.nbad = 0                   # Rows with values that won't fit.
+            os.makedirs(dpath, exist_ok=True)
+            self.manifest = loadManifest(dpath)
+        except Exception as E:
+            errmsg = 'ColumnarSink: %s: %s @ %s' % (dpath, E, tblineno())
+            raise RuntimeError(errmsg)
+
+    def add(self, time_utc, status, body_bytes_sent, remote_addr, request, http_user_agent, http_referer):
+        """Buffer an access record's row."""
+        if not (_fits(time_utc, -2**63, 2**63) and _fits(status, 0, 65536) and 
+                _fits(body_bytes_sent, 0, 2**63)):
+            self.nbad += 1
+            if not _fits(time_utc, -2**63, 2**63):
+                return
+            if not _fits(status, 0, 65536):
+                status = BADSTATUS
+            if not _fits(body_bytes_sent, 0, 2**63):
+                body_bytes_sent = BADBYTES
+        h = self.last
+        if h is None or h.hk != time_utc // 3600:
+            hk = time_utc // 3600
+            h = self.hours.get(hk)
+            if h is None:
+                h = self.hours[hk] = _Hour(hk)
+            self.last = h
+        c, d = h.cols, h.dicts
+        c['time_utc'].append(time_utc)
+        c['status'].append(status)
+        c['body_bytes_sent'].append(body_bytes_sent)
+        c['ipv4'].append(ipv4(remote_addr))
+        for name, v in (('request', request), ('user_agent', http_user_agent), ('referer', http_referer)):
+            if v is None:
+                c[name].append(-1)
+                continue
+            x = d[name].get(v)
+            if x is None:
+                x = d[name][v] = len(d[name])
+            c[name].append(x)
+        self.nbuffered += 1
+        if len(c['time_utc']) >= self.maxrows:
+            self._write(h)
+        elif self.nbuffered >= self.maxbuffered:
+            self._write(self.hours[min(self.hours)])
+
+    def addOrec(self, d):
+        """Buffer a decoded orec's row (binrec.decode()), if it's an access record."""
+        if d.get('ae') != 'a':
+            return
+        self.add(d['time_utc'], d['status'], d['body_bytes_sent'], d['remote_addr'],
+                 d['request'], d['http_user_agent'], d['http_referer'])
+
+    def tick(self):
+        """Write the hours that have gone idle."""
+        t = time.monotonic()
+        for h in list(self.hours.values()):
+            n = len(h)
+            if n != h.n:
+                h.n, h.t = n, t             # Grew since the last tick.
+            elif t - h.t >= self.idle:
+                self._write(h)
+
+    def flush(self):
+        """Write all buffered hours."""
+        for h in list(self.hours.values()):
+            self._write(h)
+
+    def close(self):
+        self.flush()
+
+    def _write(self, h):
+        # h as a new part, then the manifest.
+        del self.hours[h.hk]
+        self.nbuffered -= len(h)
+        if self.last is h:
+            self.last = None
+        if not len(h):
+            return
+        try:
+            part = '%s-%04d' % (h.hour, self._seqn(h.hour))
+            ppath = os.path.join(self.dpath, part)
+            tpath = ppath + '.tmp'
+            shutil.rmtree(tpath, ignore_errors=True)
+            os.makedirs(tpath)
+            for name, _, dtype in COLUMNS:
+                numpy.save(os.path.join(tpath, name + '.npy'),
+                           numpy.frombuffer(h.cols[name], dtype=dtype))
+            for name in DICTS:
+                z = [s.encode('utf-8', 'surrogatepass') for s in h.dicts[name]]     # Insertion (id) order.
+                off = numpy.zeros(len(z) + 1, dtype='int64')
+                numpy.cumsum([len(s) for s in z], out=off[1:])
+                numpy.save(os.path.join(tpath, name + '.off.npy'), off)
+                numpy.save(os.path.join(tpath, name + '.str.npy'),
+                           numpy.frombuffer(b''.join(z), dtype='uint8'))
+            os.rename(tpath, ppath)
+            t = h.cols['time_utc']
+            self.manifest['parts'].append({'part': part, 'hour': h.hour, 'rows': len(h),
+                                           'tmin': min(t), 'tmax': max(t)})
+            self._saveManifest()
+            self.nrows += len(h)
+            self.nparts += 1
+        except Exception as E:
+            errmsg = 'ColumnarSink._write: %s: %s @ %s' % (h.hour, E, tblineno())
+            raise RuntimeError(errmsg)
+
+    def _seqn(self, hour):
+        # Next part seqn for hour: past any part folder there.
+        seqn = 0
+        for fn in os.listdir(self.dpath):
+            z = fn.split('-')
+            if len(z) == 2 and z[0] == hour and z[1].isdigit():
+                seqn = max(seqn, int(z[1]) + 1)
+        return seqn
+
+    def _saveManifest(self):
+        tpfn = os.path.join(self.dpath, MANIFEST + '.tmp')
+        with open(tpfn, 'w') as f:
+            json.dump(self.manifest, f, indent=1, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tpfn, os.path.join(self.dpath, MANIFEST))
+
+
+def loadManifest(dpath):
+    """dpath's manifest (a new one if none)."""
+    try:
+        with open(os.path.join(dpath, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'version': 1, 'columns': {name: dtype for name, _, dtype in COLUMNS},
+                'dicts': list(DICTS), 'parts': []}
+
+def loadPart(dpath, part, mmap_mode='r'):
+    """A part's columns (numpy arrays, memory-mapped by default), and
+    its dictionaries as lists (id -> str) under '<col>.dict'."""
+    if numpy is None:
+        raise RuntimeError('loadPart: numpy is not available')
+    ppath = os.path.join(dpath, part)
+    z = {}
+    for name, _, _ in COLUMNS:
+        z[name] = numpy.load(os.path.join(ppath, name + '.npy'), mmap_mode=mmap_mode)
+    for name in DICTS:
+        off = numpy.load(os.path.join(ppath, name + '.off.npy'))
+        b = numpy.load(os.path.join(ppath, name + '.str.npy')).tobytes()
+        z[name + '.dict'] = [b[off[x]:off[x+1]].decode('utf-8', 'surrogatepass') for x in range(len(off) - 1)]
+    return z
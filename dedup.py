@@ -0,0 +1,120 @@
+
+# *** NL2XLOG version ***
+
+# Sender-side suppression of resent records.
+# A record's key is a 64-bit hash of (ae, its byte offset in its file
+#   (uncompressed), the record).  The offset tells identical lines
+#   apart, and survives NGINX renaming a file or gzipping it.
+# DedupWindow remembers the last 'capacity' keys sent: a ring plus a
+#   set, so exact (no false positives, nothing wrongly dropped).
+# Keys are appended to a journal file, reloaded at start, and
+#   compacted when it holds twice the window.
+# The caller journals (flush()) only once the records are out of the
+#   process: a crash can then still resend, but never drop.
+
+import os, array, hashlib
+from l_misc import tblineno
+
+CAPACITY = 262144               # Keys remembered (8 bytes each, in the ring).
+
+
+class DedupWindow():
+
+    def __init__(self, pfn=None, capacity=CAPACITY):
+        self.pfn = pfn                  # Journal.  None: not persisted.
+        self.capacity = capacity
+        self.ring = array.array('Q', bytes(8 * capacity))     # 0: empty slot.
+        self.x = 0                      # Next slot.
+        self.keys = set()
+        self.pending = array.array('Q')     # Added, not yet journaled.
+        self.njournal = 0               # Keys in the journal.
+        self.ndropped = 0               # Duplicates seen.
+        self.fd = None
+        if pfn:
+            try:
+                self._load()
+                self.fd = os.open(pfn, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            except Exception as E:
+                errmsg = 'DedupWindow: %s: %s @ %s' % (pfn, E, tblineno())
+                raise RuntimeError(errmsg)
+
+    def _load(self):
+        try:
+            with open(self.pfn, 'rb') as f:
+                z = f.read()
+        except FileNotFoundError:
+            return
+        a = array.array('Q')
+        a.frombytes(z[:len(z) - len(z) % 8])     # Drop a torn last key.
+        self.njournal = len(a)
+        for k in a[-self.capacity:]:
+            self._add(k)
+
+    @staticmethod
+    def key(ae, offset, logrec):
+        """Key for logrec (str or bytes, line end ignored) at offset in an ae file."""
+        if type(logrec) is str:
+            logrec = logrec.encode('utf-8', 'surrogatepass')
+        h = hashlib.blake2b(b'%s %d ' % (ae.encode(), offset), digest_size=8)
+        h.update(logrec.rstrip(b'\r\n'))
+        return int.from_bytes(h.digest(), 'little') or 1
+
+    def seen(self, k):
+        """True (and counted) if k was sent already."""
+        if k in self.keys:
+            self.ndropped += 1
+            return True
+        return False
+
+    def _add(self, k):
+        z = self.ring[self.x]
+        if z:
+            self.keys.discard(z)
+        self.ring[self.x] = k
+        self.x = (self.x + 1) % self.capacity
+        self.keys.add(k)
+
+    def add(self, k):
+        """Remember k as sent.  Journaled at the next flush()."""
+        self._add(k)
+        self.pending.append(k)
+
+    def flush(self):
+        """Journal the keys added so far."""
+        if not self.pending:
+            return
+        if self.fd is None:
+            self.pending = array.array('Q')
+            return
+        try:
+            z = memoryview(self.pending.tobytes())
+            while z:
+                n = os.write(self.fd, z)
+                z = z[n:]
+            self.njournal += len(self.pending)
+            self.pending = array.array('Q')
+            if self.njournal >= 2 * self.capacity:
+                self._compact()
+        except Exception as E:
+            errmsg = 'DedupWindow.flush: %s @ %s' % (E, tblineno())
+            raise RuntimeError(errmsg)
+
+    def _compact(self):
+        # Rewrite the journal as just the window, oldest first.
+        a = self.ring[self.x:] + self.ring[:self.x]
+        a = array.array('Q', [k for k in a if k])
+        tpfn = self.pfn + '.tmp'
+        with open(tpfn, 'wb') as f:
+            a.tofile(f)
+        os.replace(tpfn, self.pfn)
+        os.close(self.fd)
+        self.fd = os.open(self.pfn, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self.njournal = len(a)
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            try:  os.close(self.fd)
+            except:  pass
+            self.fd = None
@@ -0,0 +1,161 @@
+
+# *** NL2XLOG version ***
+
+# Directory watching for watcherThread: wake up when the watched
+#   NGINX log folder changes instead of rescanning on a fixed beat.
+# Linux: inotify, via ctypes (no extra packages needed).
+# Elsewhere (or if inotify can't be set up): an adaptive poll of
+#   the folder's wanted entries, backing off while it's idle.
+# Either way, the names of the wanted entries that changed are kept
+#   for changes(), so a cycle need only look at those.
+
+import os, sys, time, struct, select
+import ctypes, ctypes.util
+from l_misc import tblineno
+
+# inotify event masks (from <sys/inotify.h>).
+IN_MODIFY     = 0x00000002
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO   = 0x00000080
+IN_CREATE     = 0x00000100
+IN_DELETE     = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED    = 0x00008000
+IN_MASK       = IN_MODIFY | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+IN_NONBLOCK   = os.O_NONBLOCK
+IN_CLOEXEC    = 0o2000000
+
+EVHDR = struct.Struct('iIII')   # wd, mask, cookie, len; then len bytes of name.
+
+SLICE = 1.0                     # Max seconds between stop checks.
+
+
+class DirWatcher():
+
+    def __init__(self, wpath, wanted=None, pollmin=0.25, pollmax=6, inotify=True):
+        self.wpath = wpath
+        self.wanted = wanted            # fn -> bool, eg nlmon.doFilename.  None: all.
+        self.pollmin = pollmin          # Adaptive poll interval bounds (seconds).
+        self.pollmax = max(pollmax, pollmin)
+        self.poll = pollmin
+        self.due = 0                    # Time of next poll.
+        self.fd = None
+        self.sig = None
+        self.changed = None             # Wanted names changed since changes().  None: unknown (all).
+        self.mode = 'poll'
+        if inotify and sys.platform.startswith('lin'):
+            try:
+                self._inotify()
+                self.mode = 'inotify'
+            except Exception:
+                self.close()            # POR: poll.
+        if self.fd is None:
+            self.sig = self._signature()
+
+    def _inotify(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1')
+        self.fd = fd
+        wd = libc.inotify_add_watch(fd, os.fsencode(self.wpath), IN_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_add_watch')
+
+    def close(self):
+        try:  os.close(self.fd)
+        except:  pass
+        self.fd = None
+
+    def changes(self):
+        """Wanted names changed (created, modified, renamed, deleted) since 
+        the last call, or None if that's unknown (the first call, lost
+        events): then anything may have."""
+        z, self.changed = self.changed, set()
+        return z
+
+    def _changed(self, names):
+        if self.changed is not None:
+            self.changed.update(names)
+
+    def _signature(self):
+        # What an adaptive poll compares: (name, inode, size, mtime) of wanted entries.
+        sig = []
+        try:
+            with os.scandir(self.wpath) as it:
+                for de in it:
+                    if self.wanted and not self.wanted(de.name):
+                        continue
+                    try:
+                        st = de.stat()
+                    except OSError:
+                        continue        # Renamed away.
+                    sig.append((de.name, st.st_ino, st.st_size, st.st_mtime_ns))
+        except OSError:
+            pass
+        sig.sort()
+        return sig
+
+    def _drain(self):
+        # Read all pending inotify events.  True if any concerns a wanted file.
+        changed = False
+        while True:
+            try:
+                buf = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return changed
+            if not buf:
+                return changed
+            x = 0
+            while x + EVHDR.size <= len(buf):
+                wd, mask, cookie, n = EVHDR.unpack_from(buf, x)
+                x += EVHDR.size
+                name = buf[x:x+n].rstrip(b'\0').decode(errors='replace')
+                x += n
+                if mask & IN_Q_OVERFLOW:
+                    self.changed = None         # Events lost.
+                    changed = True
+                elif mask & IN_IGNORED:
+                    # Watched folder went away: POR as a poller.
+                    self.close()
+                    self.mode = 'poll'
+                    self.sig = self._signature()
+                    self.changed = None
+                    return True
+                elif (not self.wanted) or self.wanted(name):
+                    self._changed((name, ))
+                    changed = True      # Skip the likes of nlmon.s3 & its journal.
+
+    def wait(self, timeout, stop=None):
+        """Wait up to timeout seconds for a change to WPATH.  True if changed."""
+        try:
+            t1 = time.time() + timeout
+            while True:
+                if stop and stop():
+                    return False
+                w = t1 - time.time()
+                if w <= 0:
+                    return False
+                # inotify.
+                if self.fd is not None:
+                    r, _, _ = select.select([self.fd], [], [], min(w, SLICE))
+                    if r and self._drain():
+                        return True
+                    continue
+                # Adaptive poll: back off while idle, snap back on a change.
+                z = self.due - time.time()
+                if z > 0:
+                    time.sleep(min(w, z, SLICE))
+                    continue
+                sig = self._signature()
+                if sig != self.sig:
+                    self._changed(z[0] for z in set(sig).symmetric_difference(self.sig))
+                    self.sig = sig
+                    self.poll = self.pollmin
+                    self.due = time.time() + self.poll
+                    return True
+                self.poll = min(2 * self.poll, self.pollmax)
+                self.due = time.time() + self.poll
+        except Exception as E:
+            errmsg = 'DirWatcher.wait: %s @ %s' % (E, tblineno())
+            raise RuntimeError(errmsg)
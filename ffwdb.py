@@ -7,18 +7,38 @@
 # Note: There's a similar, but different, same-named module for 
 #       xlog2db.
 
-import sqlite3, json
+import sqlite3, json, contextlib, threading
 from l_misc import tblineno
 
 # 160105: 'historical' -> 'static', added 'extra'
-FNS = ('inode', 'ae', 'modified', 'size', 'acquired', 'processed', 'static', 'filename', 'extra')   
+# Added 'uprocessed': uncompressed bytes processed (.gz checkpoints).
+# Added 'held': bytes read of a live file whose unterminated last line 
+#   was held back.  Until it grows past that, it's not unfinished.
+FNS = ('inode', 'ae', 'modified', 'size', 'acquired', 'processed', 'static', 'filename', 'extra', 'uprocessed',
+       'held')   
+UNFINISHED = '(processed < size) and (static or held is null or size > held)'
+
+
+# Journaling: WAL lets readers (status tools) work alongside the 
+#   watcher, and with synchronous=NORMAL a commit needs no fsync 
+#   (only checkpoints do).
+# Writes commit as they're made, except inside a cycle(), which 
+#   commits once at its end.  Reads don't commit.
+SYNCHRONOUS = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+RETRIES = 10                    # FFWTable: failed writes in a row before giving up.
 
 
 class FFWDB():
 
-    def __init__(self, ffwdbpfn):
+    def __init__(self, ffwdbpfn, wal=True, synchronous='NORMAL'):
         self.ffwdbpfn = ffwdbpfn
+        self.cycling = 0                # cycle() nesting depth.
+        if synchronous.upper() not in SYNCHRONOUS:
+            raise ValueError('FFWDB: bad synchronous: %s' % repr(synchronous))
         self.db = sqlite3.connect(self.ffwdbpfn)
+        if wal:
+            self.db.execute('pragma journal_mode=WAL')
+        self.db.execute('pragma synchronous=%s' % synchronous.upper())
         self.db.execute("""
             create table if not exists logfiles (
                 inode       integer,
@@ -29,12 +49,53 @@ class FFWDB():
                 processed	integer,
                 static  	integer,
                 filename    text,
-                extra       text)
+                extra       text,
+                uprocessed  integer,
+                held        integer)
         """)
+        # Older dbs lack later columns.
+        fns = [z[1] for z in self.db.execute('pragma table_info(logfiles)')]
+        for fn in ('uprocessed', 'held'):
+            if fn not in fns:
+                self.db.execute('alter table logfiles add column %s integer' % fn)
+                self.db.commit()
+        # Inodes are the key.  (Older dbs may hold duplicates: keep the latest.)
+        try:
+            self.db.execute('create unique index if not exists logfiles_inode on logfiles (inode)')
+        except sqlite3.IntegrityError:
+            self.db.execute('delete from logfiles where rowid not in '
+                            '(select max(rowid) from logfiles group by inode)')
+            self.db.execute('create unique index if not exists logfiles_inode on logfiles (inode)')
+        self.db.commit()
     
     def disconnect(self):
         try:  self.db.close()
         except:  pass
+
+    def _commit(self):
+        # Writes commit now, unless in a cycle().
+        if not self.cycling:
+            self.db.commit()
+
+    def sync(self):
+        """Commit now, unless in a cycle().  (As FFWTable.sync.)"""
+        self._commit()
+
+    @contextlib.contextmanager
+    def cycle(self):
+        """A watch cycle's writes as one transaction: committed at the end, rolled back on error."""
+        self.cycling += 1
+        try:
+            yield self
+        except:
+            self.cycling -= 1
+            if not self.cycling:
+                self.db.rollback()
+            raise
+        else:
+            self.cycling -= 1
+            if not self.cycling:
+                self.db.commit()
         
     def count(self, inode=None):
         try:
@@ -42,14 +103,12 @@ class FFWDB():
             if inode:
                 csr.execute('select count(*) from logfiles where inode=?', (inode, ))
             else:
-                csr.execute('select count(*) from logfiles')
+                csr.execute('select count(*) from logfiles where inode>0')
             try:  return csr.fetchone()[0]
             except:  return None
         except Exception as E:
             errmsg = 'FFWDB.count: %s @ %s' % (E, tblineno())
             raise RuntimeError(errmsg)
-        finally:
-            self.db.commit()
 
     def all(self):
         fis = []
@@ -65,8 +124,10 @@ class FFWDB():
         except Exception as E:
             errmsg = 'FFWDB.all: %s @ %s' % (E, tblineno())
             raise RuntimeError(errmsg)
-        finally:
-            self.db.commit()
+
+    def rows(self):
+        # inode -> row, of all().  (FFWTable's is its own.)
+        return {fi['inode']: fi for fi in self.all()}
         
     def select(self, inode):
         try:
@@ -82,8 +143,6 @@ class FFWDB():
         except Exception as E:
             errmsg = 'FFWDB.select: %s @ %s' % (E, tblineno())
             raise RuntimeError(errmsg)
-        finally:
-            self.db.commit()
         
     def inodes(self):
         try:
@@ -93,8 +152,6 @@ class FFWDB():
         except Exception as E:
             errmsg = 'FFWDB.inodes: %s @ %s' % (E, tblineno())
             raise RuntimeError(errmsg)
-        finally:
-            self.db.commit()
         
     '''???
     def filenames(self):
@@ -110,8 +167,6 @@ class FFWDB():
     def insert(self, fi):
         try:
             inode = fi['inode']
-            if self.count(inode):
-                raise ValueError('FFWDB.insert: %d already in db' % (inode))
             ks, qs, vs = [], [], []
             for k, v in fi.items():
                 ks.append(k)
@@ -119,19 +174,20 @@ class FFWDB():
                 vs.append(v)
             sql = 'insert into logfiles (%s) values (%s)' % (', '.join(ks), ', '.join(qs))
             csr = self.db.cursor()
-            csr.execute(sql, vs)
+            try:
+                csr.execute(sql, vs)
+            except sqlite3.IntegrityError:
+                raise ValueError('FFWDB.insert: %d already in db' % (inode))
         except Exception as E:
             errmsg = 'FFWDB.insert: %s @ %s' % (E, tblineno())
             raise RuntimeError(errmsg)
         finally:
-            self.db.commit()
-            return self.select(inode)
+            self._commit()
+        return self.select(inode)
         
     def update(self, fi):
         try:
             inode = fi['inode']
-            if not self.count(inode):
-                raise ValueError('FFWDB.update: %d not in db' % (inode))
             kvs, vs = '', []
             for k, v in fi.items():
                 if k == 'inode':
@@ -144,12 +200,14 @@ class FFWDB():
             sql = 'update logfiles set %s where inode=?' % kvs
             csr = self.db.cursor()
             csr.execute(sql, vs)
+            if not csr.rowcount:
+                raise ValueError('FFWDB.update: %d not in db' % (inode))
         except Exception as E:
             errmsg = 'FFWDB.update: %s @ %s' % (E, tblineno())
             raise RuntimeError(errmsg)
         finally:
-            self.db.commit()
-            return self.select(inode)
+            self._commit()
+        return self.select(inode)
         
     def delete(self, inode):
         try:
@@ -159,20 +217,92 @@ class FFWDB():
             errmsg = 'FFWDB.delete: %s @ %s' % (E, tblineno())
             raise RuntimeError(errmsg)
         finally:
-            self.db.commit()
+            self._commit()
+        
+    def upsert_many(self, fis):
+        # Bulk insert-or-update of (partial) fi dicts, keyed by inode.
+        # Returns the resulting rows, from one query.
+        if not fis:
+            return []
+        try:
+            csr = self.db.cursor()
+            # One executemany per set of columns.
+            groups = {}
+            for fi in fis:
+                ks = tuple(fi.keys())
+                for k in ks:
+                    if k not in FNS:
+                        raise ValueError('FFWDB.upsert_many: bad column: %s' % repr(k))
+                groups.setdefault(ks, []).append(tuple(fi.values()))
+            for ks, vss in groups.items():
+                sets = ', '.join(['%s=excluded.%s' % (k, k) for k in ks if k != 'inode'])
+                sql = 'insert into logfiles (%s) values (%s) on conflict (inode) do %s' % (
+                        ', '.join(ks), ', '.join(['?'] * len(ks)), 
+                        ('update set ' + sets) if sets else 'nothing')
+                csr.executemany(sql, vss)
+            return self.select_many([fi['inode'] for fi in fis])
+        except Exception as E:
+            errmsg = 'FFWDB.upsert_many: %s @ %s' % (E, tblineno())
+            raise RuntimeError(errmsg)
+        finally:
+            self._commit()
+
+    def delete_many(self, inodes):
+        if not inodes:
+            return
+        try:
+            csr = self.db.cursor()
+            csr.executemany('delete from logfiles where inode=?', [(z, ) for z in inodes])
+        except Exception as E:
+            errmsg = 'FFWDB.delete_many: %s @ %s' % (E, tblineno())
+            raise RuntimeError(errmsg)
+        finally:
+            self._commit()
+
+    def select_many(self, inodes):
+        # Rows for inodes, in one query.
+        fis = []
+        if not inodes:
+            return fis
+        try:
+            self.db.row_factory = sqlite3.Row
+            csr = self.db.cursor()
+            csr.execute('select * from logfiles where inode in (select value from json_each(?))', 
+                        (json.dumps(list(inodes)), ))
+            for z in csr:
+                fi = {}
+                fi.update(z)
+                fis.append(fi)
+            return fis
+        except Exception as E:
+            errmsg = 'FFWDB.select_many: %s @ %s' % (E, tblineno())
+            raise RuntimeError(errmsg)
+
+    def checkpoint(self, inode, processed, uprocessed=None, held=None):
+        # Progress on a file: one statement, one commit.
+        try:
+            csr = self.db.cursor()
+            sets, vs = 'processed=?', [processed]
+            if uprocessed is not None:
+                sets, vs = sets + ', uprocessed=?', vs + [uprocessed]
+            if held is not None:
+                sets, vs = sets + ', held=?', vs + [held]
+            csr.execute('update logfiles set %s where inode=?' % sets, vs + [inode])
+        except Exception as E:
+            errmsg = 'FFWDB.checkpoint: %s @ %s' % (E, tblineno())
+            raise RuntimeError(errmsg)
+        finally:
+            self._commit()
         
     def oldest(self, unfinished=True):
         try:
             self.db.row_factory = sqlite3.Row
             csr = self.db.cursor()
             if unfinished:
-                csr.execute('select * from logfiles where (processed < size) order by modified asc limit 1')
+                csr.execute('select * from logfiles where %s order by modified asc limit 1' % UNFINISHED)
             else:
                 csr.execute('select * from logfiles order by modified desc limit 1')
             z = csr.fetchone()
-            if not z:
-                return None
-            z = csr.fetchone()
             if not z:
                 return None
             fi = {}
@@ -181,8 +311,25 @@ class FFWDB():
         except Exception as E:
             errmsg = 'FFWDB.oldest: %s @ %s' % (E, tblineno())
             raise RuntimeError(errmsg)
-        finally:
-            self.db.commit()
+
+    def unfinished(self, static=False):
+        # All unfinished files (optionally static ones only), oldest first.
+        fis = []
+        try:
+            self.db.row_factory = sqlite3.Row
+            csr = self.db.cursor()
+            if static:
+                csr.execute('select * from logfiles where %s and static order by modified asc' % UNFINISHED)
+            else:
+                csr.execute('select * from logfiles where %s order by modified asc' % UNFINISHED)
+            for z in csr:
+                fi = {}
+                fi.update(z)
+                fis.append(fi)
+            return fis
+        except Exception as E:
+            errmsg = 'FFWDB.unfinished: %s @ %s' % (E, tblineno())
+            raise RuntimeError(errmsg)
 
     def acquired(self, inodes, ts):
         # A bulk 'acquired' timestamp update bcs updates are slow.
@@ -190,16 +337,13 @@ class FFWDB():
             return
         try:
             csr = self.db.cursor()
-            if len(inodes) == 1:
-                sql = 'update logfiles set acquired=? where inode=%d' % (inodes[0])
-            else:
-                sql = 'update logfiles set acquired=? where inode in %s' % (str(inodes))
-            csr.execute(sql, (ts, ))
+            csr.execute('update logfiles set acquired=? where inode in (select value from json_each(?))', 
+                        (ts, json.dumps(list(inodes))))
         except Exception as E:
             errmsg = 'FFWDB.acquired: %s @ %s' % (E, tblineno())
             raise RuntimeError(errmsg)
         finally:
-            self.db.commit()
+            self._commit()
         
     def extra(self, extra=None):
         try:
@@ -231,4 +375,266 @@ class FFWDB():
             errmsg = 'FFWDB.extra: %s @ %s' % (E, tblineno())
             raise RuntimeError(errmsg)
         finally:
-            self.db.commit()
+            self._commit()
+
+
+# In-memory, authoritative copy of logfiles for the watcher thread.
+# Loaded once; reads never touch the db.  Changes are persisted by a
+#   write-behind thread (with its own connection), coalesced per inode
+#   (whole rows, as of the flush) and written every `delay` seconds 
+#   in one transaction, so the watcher never waits on disk.
+#   A failed write is rolled back and its changes requeued for the 
+#   next; after 'retries' failures in a row the writer gives up, and
+#   the watcher's next FFWTable call raises.
+# Unfinished rows' inodes are kept as a set (todo), so oldest() and
+#   unfinished() look only at those.
+# Same methods as FFWDB, as far as nlmon uses them.
+
+class FFWTable():
+
+    def __init__(self, ffwdbpfn, wal=True, synchronous='NORMAL', delay=1.0, retries=RETRIES):
+        self.ffwdbpfn = ffwdbpfn
+        self.wal, self.synchronous = wal, synchronous
+        self.delay = delay
+        self.retries = retries
+        self.nerrors = 0                # Failed writes, retried.
+        self.lasterror = None
+        self.lock = threading.RLock()
+        self.dirty = set()              # Inodes to write (or delete, if gone).
+        self.acq = None                 # Latest (inodes, ts) for acquired().
+        self.ed = None                  # Extra dict to write.
+        self.error = None               # Writer's last exception, once it's given up.
+        self.stop = False
+        self.wake = threading.Event()
+        self.synced = threading.Condition()
+        self.asked = self.done = 0      # sync() requests, and those the writer has written.
+        self.cycling = 0                # cycle() nesting depth.
+        db = FFWDB(ffwdbpfn, wal=wal, synchronous=synchronous)
+        try:
+            self.fis = db.rows()
+            self.xd = db.extra()
+        finally:
+            db.disconnect()
+        self.todo = {z for z, fi in self.fis.items() if self._unfinished(fi)}     # Unfinished inodes.
+        self.writer = threading.Thread(target=self._writer, daemon=True)
+        self.writer.start()
+
+    # Write-behind.
+
+    def _writer(self):
+        db = None
+        try:
+            db = FFWDB(self.ffwdbpfn, wal=self.wal, synchronous=self.synchronous)
+            fails = 0
+            while True:
+                self.wake.wait(self.delay)
+                self.wake.clear()
+                stop = self.stop
+                with self.synced:
+                    asked = self.asked
+                try:
+                    self._flush(db)
+                    fails = 0
+                except Exception as E:
+                    # Requeued: try again (stopping or not).
+                    self.nerrors += 1
+                    self.lasterror = E
+                    fails += 1
+                    if fails > self.retries:
+                        raise
+                    continue
+                with self.synced:
+                    self.done = asked
+                    self.synced.notify_all()
+                if stop:
+                    return
+        except Exception as E:
+            self.error = E
+        finally:
+            with self.synced:
+                self.synced.notify_all()
+            if db:
+                db.disconnect()
+
+    def _flush(self, db):
+        with self.lock:
+            dirty, self.dirty = self.dirty, set()
+            acq, self.acq = self.acq, None
+            ed, self.ed = self.ed, None
+            ups = [dict(self.fis[z]) for z in dirty if z in self.fis]
+            dels = [z for z in dirty if z not in self.fis]
+        if not (ups or dels or acq or ed is not None):
+            return
+        try:
+            with db.cycle():
+                db.delete_many(dels)
+                db.upsert_many(ups)
+                if acq:
+                    db.acquired(*acq)
+                if ed is not None:
+                    db.extra(ed)
+        except:
+            # Rolled back: the next flush writes them (rows as of then).
+            with self.lock:
+                self.dirty |= dirty
+                if self.acq is None:
+                    self.acq = acq
+                if self.ed is None:
+                    self.ed = ed
+            raise
+
+    def _check(self):
+        if self.error:
+            errmsg = 'FFWTable: writer: %s' % self.error
+            raise RuntimeError(errmsg)
+
+    def _touch(self, inode):
+        self._check()
+        self.dirty.add(inode)
+        fi = self.fis.get(inode)
+        if fi is not None and self._unfinished(fi):
+            self.todo.add(inode)
+        else:
+            self.todo.discard(inode)
+
+    def sync(self):
+        """Wait until everything changed so far is written, unless in a cycle().
+        The writer does it, so commits stay in order on one connection."""
+        self._check()
+        if self.cycling:
+            return
+        with self.synced:
+            self.asked += 1
+            asked = self.asked
+            self.wake.set()
+            while self.done < asked and self.error is None and self.writer.is_alive():
+                self.synced.wait(self.delay)
+        self._check()
+        if self.done < asked:
+            raise RuntimeError('FFWTable.sync: writer stopped')
+
+    def disconnect(self):
+        self.stop = True
+        self.wake.set()
+        self.writer.join()
+        self._check()
+
+    @contextlib.contextmanager
+    def cycle(self):
+        # A cycle's changes go out together: hold the writer off till the end.
+        with self.lock:
+            self.cycling += 1
+            try:
+                yield self
+            finally:
+                self.cycling -= 1
+        self._check()
+
+    # Reads.
+
+    def count(self, inode=None):
+        if inode:
+            return 1 if inode in self.fis else 0
+        return len(self.fis)
+
+    def all(self):
+        return [dict(fi) for fi in self.fis.values()]
+
+    def rows(self):
+        """inode -> row: the table itself, not a copy.  Read only."""
+        return self.fis
+
+    def select(self, inode):
+        fi = self.fis.get(inode)
+        return dict(fi) if fi else None
+
+    def select_many(self, inodes):
+        return [dict(self.fis[z]) for z in inodes if z in self.fis]
+
+    def inodes(self):
+        return list(self.fis.keys())
+
+    def _unfinished(self, fi):
+        # As UNFINISHED.
+        return (fi['processed'] is not None and fi['size'] is not None and fi['processed'] < fi['size'] and
+                (fi.get('static') or fi.get('held') is None or fi['size'] > fi['held']))
+
+    def oldest(self, unfinished=True):
+        if unfinished:
+            fis = [self.fis[z] for z in self.todo]
+            fi = min(fis, key=lambda z: z['modified'] or 0, default=None)
+        else:
+            fi = max(self.fis.values(), key=lambda z: z['modified'] or 0, default=None)
+        return dict(fi) if fi else None
+
+    def unfinished(self, static=False):
+        fis = [dict(self.fis[z]) for z in self.todo 
+               if self.fis[z]['static'] or not static]
+        fis.sort(key=lambda z: z['modified'] or 0)
+        return fis
+
+    # Writes.
+
+    def insert(self, fi):
+        with self.lock:
+            if fi['inode'] in self.fis:
+                raise RuntimeError('FFWTable.insert: %d already in db' % (fi['inode']))
+            return self.upsert_many([fi])[0]
+
+    def update(self, fi):
+        with self.lock:
+            if fi['inode'] not in self.fis:
+                raise RuntimeError('FFWTable.update: %d not in db' % (fi['inode']))
+            return self.upsert_many([fi])[0]
+
+    def upsert_many(self, fis):
+        with self.lock:
+            for fi in fis:
+                inode = fi['inode']
+                row = self.fis.get(inode)
+                if row is None:
+                    row = self.fis[inode] = dict.fromkeys(FNS)
+                row.update(fi)
+                self._touch(inode)
+            return [dict(self.fis[fi['inode']]) for fi in fis]
+
+    def delete(self, inode):
+        self.delete_many([inode])
+
+    def delete_many(self, inodes):
+        with self.lock:
+            for inode in inodes:
+                self.fis.pop(inode, None)
+                self._touch(inode)
+
+    def checkpoint(self, inode, processed, uprocessed=None, held=None):
+        with self.lock:
+            fi = self.fis.get(inode)
+            if fi is None:
+                return
+            fi['processed'] = processed
+            if uprocessed is not None:
+                fi['uprocessed'] = uprocessed
+            if held is not None:
+                fi['held'] = held
+            self._touch(inode)
+
+    def acquired(self, inodes, ts):
+        if not (inodes and ts):
+            return
+        with self.lock:
+            self._check()
+            for inode in inodes:
+                fi = self.fis.get(inode)
+                if fi is not None:
+                    fi['acquired'] = ts
+            self.acq = (list(inodes), ts)
+
+    def extra(self, extra=None):
+        if extra is None:
+            return dict(self.xd)
+        with self.lock:
+            self._check()
+            self.xd = dict(extra)
+            self.ed = dict(extra)
+            return dict(self.xd)
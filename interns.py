@@ -0,0 +1,44 @@
+
+# *** NL2XLOG version ***
+
+# Bounded interning of repeated strings on the orec generation path.
+# InternTable maps a raw field (fresh from each logrec's split) to
+#   one shared, cooked (eg, nlmon._S) object, so a few hundred user
+#   agents cost a few hundred strings, and a repeat skips the cooking.
+# Least recently used entries are evicted past 'capacity'.
+
+import collections
+
+CAPACITY = 4096                 # Entries, per table.
+_MISS = object()
+
+
+class InternTable():
+
+    def __init__(self, capacity=CAPACITY, cook=None):
+        self.capacity = capacity
+        self.cook = cook                # raw -> value.  None: the raw string itself.
+        self.d = collections.OrderedDict()
+        self.nhits = self.nmisses = 0
+
+    def get(self, raw):
+        """The shared value for raw."""
+        d = self.d
+        v = d.get(raw, _MISS)
+        if v is not _MISS:
+            d.move_to_end(raw)
+            self.nhits += 1
+            return v
+        self.nmisses += 1
+        v = self.cook(raw) if self.cook else raw
+        if self.capacity > 0:
+            d[raw] = v
+            if len(d) > self.capacity:
+                d.popitem(last=False)
+        return v
+
+    def clear(self):
+        self.d.clear()
+
+    def __len__(self):
+        return len(self.d)
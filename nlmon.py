@@ -97,11 +97,15 @@ import shutil
 import collections
 import pickle
 import copy
+import array
 import json
 import configparser
 import threading
 import re
 import gzip
+import glob
+import tempfile
+import multiprocessing
 import pytz
 
 ###import docopt
@@ -162,8 +166,23 @@ NLCODING = 'utf-8'          # Just a guess, for now, that nginx uses UTF-8 for i
 ENCODING = 'utf-8'          # Start a utf-8 chain, whether to file or xlog.
 ERRORS = 'strict'
 OXLOGTS = 0                 # Time of last Tx to xlog.
-TXRATE = 0                  # Max number of transmissions per sec.
-                            # Transformed to 1 / TXRATE after INI read.
+TXRATE = 0                  # Max orecs/sec to OXLOG (token bucket).  0: unthrottled.
+TXBYTES = 0                 # Max bytes/sec to OXLOG.  0: unthrottled.
+TXBURST = 1.0               # Bursts of up to this many seconds' worth of TXRATE/TXBYTES.
+OFRATE = 0                  # As TXRATE and TXBYTES, for OFILE.
+OFBYTES = 0
+BATCHBYTES = 65536          # OXLOG frame flush thresholds: bytes,
+BATCHCOUNT = 500            #   orecs,
+BATCHAGE = 0.5              #   and age (seconds).
+BATCHQUEUE = 8              # OXLOG frames awaiting its sender thread (high-water mark).
+TXCOMPRESS = None           # OXLOG frame compression: None, 'batch' or 'stream'.
+TXLEVEL = 6                 #   zlib level.
+TCPNODELAY = True           # OXLOG socket options.
+SNDBUF = None               #   None: OS default.
+OFBLOCK = 1048576           # OFILE write block size (bytes).
+OFINTERVAL = 1.0            # OFILE max block age (seconds).
+OFDURABLE = 'flush'         # OFILE durability: 'none', 'flush' or 'fsync'.
+OFFSYNCMB = 64              # OFILE 'fsync': also fsync every this many MB.
 AEL, ASL = '0', '?'         # !MAGIC!  ACCESS EL and SL (error and sub levels).
 EEL, ESL = '0', '?'         # !MAGIC!  ERROR  ... 
                             # *EL = 0: unset
@@ -184,11 +203,22 @@ _sw = l_screen_writer.ScreenWriter()
 TEST = False                # Hunting short-logrec bug.
 TESTONLY = False            # Hunting short-logrec bug.
 ONECHECK = False		    # Once around watcher_thread loop.
+EXPORT = True               # False -> watch and track files in FFWDB only, no export.
 TIMINGS = False             # Timing in watcher_thread loop.
 TRACINGS = False            # Extra details
 
 HEARTBEAT = True            # Emit ae='h' heartbeat records (OFILE and OXLOG).
+OFORMAT = 'json'            # Orec format: 'json' or 'binary' (binrec).
 WAIT4OXLOG = True           # Wait for OXLOG to empty (static files only).
+WAIT4SECS = 180             #   Give up after this many seconds.
+CKPTLINES = 100000          # Checkpoint 'processed' mid-file every this many lines,
+CKPTBYTES = 64 * 1048576    #   or bytes,
+CKPTSECS = 30               #   or seconds.
+BACKFILL = 0                # Nonzero -> process pool size for parallel backfill of static files.
+SPOOLD = None               # Backfill spool folder.  None -> system temp.
+BFCONTEXT = 'spawn' if sys.platform.startswith('win') else 'forkserver'
+                            # Backfill pool start method: not 'fork', the parent has threads.
+BFPARENT = None             # In a backfill worker: the parent's pid (spool names).
 
 # Extra debugging? (To simple logger, for now.)
 DEBUG = False
@@ -230,14 +260,65 @@ from l_xlogtxrx import XLogTxRx
 
 #
 # As sqlite3 database stores info about log files in watched directory: nlmon.s3:
-#   Table logfiles: ('inode', 'ae', 'modified', 'size', 'acquired', 'processed', 'static', 'filename', 'extra')
+#   Table logfiles: ('inode', 'ae', 'modified', 'size', 'acquired', 'processed', 'static', 'filename', 'extra', 'uprocessed', 'held')
 # Module ffwdb does the db work.
 # Note: sqlite3 db must be opened in watcherThread.
+# With DBMEM, watcherThread works on an in-memory copy (ffwdb.FFWTable)
+#   that a write-behind thread persists.  Checkpoints are written 
+#   through (FFWDB.sync()), so a crash resends at most a batch.
 # 
 
 FFWDBPFN = FFWDB = None
+DBWAL = True                # FFWDB in WAL mode.
+DBSYNC = 'NORMAL'           # FFWDB synchronous level: 'OFF', 'NORMAL', 'FULL' or 'EXTRA'.
+DBMEM = True                # FFWDB is an in-memory ffwdb.FFWTable with write-behind.
+DBDELAY = 1.0               # FFWTable write-behind interval (seconds).
 import ffwdb
 
+#
+# WPATH change detection for watcherThread.
+# Module dirwatch uses inotify where it can, else an adaptive poll.
+#
+
+DIRWATCH = None             # dirwatch.DirWatcher on WPATH.
+INOTIFY = True              # False -> adaptive poll only.
+CYCLEMIN = 0.5              # Min seconds between watch cycles (debounces bursts of appends).
+RESYNC = 60                 # Max seconds between watch cycles when WPATH is idle, and
+                            #   between full scans (else only DIRWATCH's changed names).
+INODE2FN = {}               # inode -> filename, as of the last WPATH scan (getFIs, changedFIs),
+FN2INODE = {}               #   and back.
+import dirwatch
+
+# OXLOG: batched, framed transmission to an xlog server.
+import xlogtx
+TXPRIO = xlogtx.LIVE        # Priority of what's being emitted: BULK for static files.
+# Token bucket limits per sink.
+import ratelimit
+# OFILE: buffered, group-committed flat file.
+import ofwriter
+# Compact binary orecs (OFORMAT 'binary').
+import binrec
+# Block-oriented logfile readers.
+GZINDEX = 4 * 1048576       # .gz access point spacing (uncompressed bytes).  0 -> no index.
+MMAP = True                 # Static uncompressed files via readers.MmapLineReader.
+PREFETCH = {}               # (inode, uprocessed) -> reader started ahead of exportFile.
+import readers
+# Sender-side suppression of resent records.
+DEDUP = None                # dedup.DedupWindow, if DEDUPN.
+DEDUPN = 0                  # Nonzero -> remember this many sent records, to drop resends.
+import dedup
+# Hourly columnar export of access records (analytics; needs numpy).
+COLSINK = None              # colsink.ColumnarSink, if COLPATH.
+COLPATH = None              # Nonzero -> export access records' columns to this folder.
+import colsink
+# Interning of repeated access fields; dictionary coded binary orecs.
+INTERNN = 4096              # Intern table size (user agents, referers, remote_addrs).  0 -> none.
+TXDICT = 0                  # Nonzero -> dictionary code binary orecs per connection/file, with this many ids.
+import interns
+# Batch export (parseBatch, genBatch, emitBatch).
+BATCH = 2048                # Logrecs per recbatch.RecordBatch.
+import recbatch
+
 ####################################################################################################
 
 SQUAWKED = False            # To stop exception message cascades.
@@ -264,15 +345,72 @@ def _S(s):
         s = None
     return s
 
+# Raw field -> one shared, _S'd value.  By makeInterns (INTERNN is an arg).
+UAS = REFERERS = ADDRS = None
+
+def makeInterns():
+    global UAS, REFERERS, ADDRS
+    UAS = interns.InternTable(INTERNN, _S)
+    REFERERS = interns.InternTable(INTERNN, _S)
+    ADDRS = interns.InternTable(INTERNN)
+
 _LOCTZ = pytz.timezone('America/Vancouver')
 
+_MONTHS = {'Jan':  1, 'Feb':  2, 'Mar':  3, 'Apr':  4, 'May':  5, 'Jun':  6,
+           'Jul':  7, 'Aug':  8, 'Sep':  9, 'Oct': 10, 'Nov': 11, 'Dec': 12}
+
+# Fixed width CLF timestamps, as nginx writes them.
+_CLFARE = re.compile(r'\[(\d\d)/([A-Z][a-z][a-z])/(\d{4}):(\d\d):(\d\d):(\d\d) ([-+])(\d\d)(\d\d)\]')
+_CLFERE = re.compile(r'(\d{4})/(\d\d)/(\d\d) (\d\d):(\d\d):(\d\d)')
+
+_LOCOFFS = {}               # (Y, m, d, H) -> _LOCTZ UTC offset (seconds).
+_CLFLAST = {}               # ae -> (locstr, utcut) of the last conversion.
+
+def _LOClocalize(locnaive):
+    # Ambiguous (fall back) and non-existent (spring forward) local 
+    # times are taken as standard time rather than raising.
+    try:
+        return _LOCTZ.localize(locnaive, is_dst=None)
+    except (pytz.exceptions.AmbiguousTimeError, pytz.exceptions.NonExistentTimeError):
+        return _LOCTZ.localize(locnaive, is_dst=False)
+
+def _LOCoffset(Y, m, d, H):
+    # _LOCTZ's UTC offset for a local hour.  (Its DST changes are on the hour.)
+    k = (Y, m, d, H)
+    off = _LOCOFFS.get(k)
+    if off is None:
+        if len(_LOCOFFS) > 10000:       # !MAGIC!  Over a year of hours.
+            _LOCOFFS.clear()
+        off = int(_LOClocalize(datetime.datetime(Y, m, d, H)).utcoffset().total_seconds())
+        _LOCOFFS[k] = off
+    return off
+
 # Common Log Format local time str to utc unix-time.
 # Depends on whether access or error log.
+# Runs of records from the same second (the norm) are memoized.
 def CLFlocstr2utcut(ae, locstr):
+    last = _CLFLAST.get(ae)
+    if last and last[0] == locstr:
+        return last[1]
+    utcut = _CLFlocstr2utcut(ae, locstr)
+    _CLFLAST[ae] = (locstr, utcut)
+    return utcut
+
+def _CLFlocstr2utcut(ae, locstr):
     # CLF local time to utc.
     # ae==a: [03/Apr/2015:16:56:14 -0700]
     # ae==e: 2015/07/05 23:02:54
     if ae == 'a':
+        # Fast path: fixed width, month table, explicit offset.
+        m = _CLFARE.fullmatch(locstr)
+        if m and m.group(2) in _MONTHS:
+            d, b, Y, H, M, S, sign, oh, om = m.groups()
+            t = (int(Y), _MONTHS[b], int(d), int(H), int(M), int(S))
+            datetime.datetime(*t)                           # Validates, as strptime would.
+            off = 3600 * int(oh) + 60 * int(om)
+            if sign == '-':
+                off = -off
+            return calendar.timegm(t) - off
         locstr = locstr[1:-1]
         locdt = datetime.datetime.strptime(locstr, '%d/%b/%Y:%H:%M:%S %z')
         utcdt = locdt.astimezone(pytz.utc)
@@ -280,8 +418,14 @@ def CLFlocstr2utcut(ae, locstr):
         pass
     elif ae == 'e':
         locstr = locstr.strip()
+        # Fast path: fixed width, offset cached per local hour.
+        m = _CLFERE.fullmatch(locstr)
+        if m:
+            t = tuple(int(z) for z in m.groups())
+            datetime.datetime(*t)                           # Validates, as strptime would.
+            return calendar.timegm(t) - _LOCoffset(*t[:4])
         locnaive = datetime.datetime.strptime(locstr, '%Y/%m/%d %H:%M:%S')
-        locdt = _LOCTZ.localize(locnaive, is_dst=None)
+        locdt = _LOClocalize(locnaive)
         utcdt = locdt.astimezone(pytz.utc)
         utcut = calendar.timegm(utcdt.timetuple())
         pass
@@ -291,9 +435,15 @@ def CLFlocstr2utcut(ae, locstr):
     #$#z = z#$#
     return utcut
 
+_TSBDLAST = (float('nan'), None)     # Last (ts, tsBDstr(ts)).  (nan never matches.)
 def tsBDstr(ts):
     # Format timestamp with blank decimal digits.  Decimal point is retained to aid downstream pattern matching.
-    return ('%15.4f' % ts).replace('.0000', '.    ')
+    global _TSBDLAST
+    if _TSBDLAST[0] == ts:
+        return _TSBDLAST[1]
+    z = ('%15.4f' % ts).replace('.0000', '.    ')
+    _TSBDLAST = (ts, z)
+    return z
 
 # Pad IP address to 3 character segments.
 def ip15(ip, zeros=True):
@@ -383,15 +533,76 @@ E6 = '2015/07/08 10:18:54 [error] 24152#0: *11229 open() "/var/www/184.69.80.202
 #6 = '2015/07/08 10:18:54 [error] 24152#0: *11229 open() "/var/www/184.69.80.202/ROADS/cgi-bin/search.pl" failed (2: No such file or directory), client: 31.184.194.114, server: 184.69.80.202, request: "GET /ROADS/cgi-bin/search.pl HTTP/1.1", host: "184.69.80.202"'
 E7 = '{"_el": "0", "_id": "TEST", "_ip": null, "_si": "test", "_sl": "_", "_ts": "1436375934.    ", "ae": "e", "status": "[error]", "stuff": "24152#0:\\t*11229\\topen()\\t\\"/var/www/184.69.80.202/ROADS/cgi-bin/search.pl\\"\\tfailed\\t(2:\\tNo\\tsuch\\tfile\\tor\\tdirectory),\\tclient:\\t31.184.194.114,\\tserver:\\t184.69.80.202,\\trequest:\\t\\"GET /ROADS/cgi-bin/search.pl HTTP/1.1\\",\\thost:\\t\\"184.69.80.202\\"", "time_local": "2015/07/08 10:18:54", "time_utc": 1436375934}'
 
+#
+# Fast path for ACCESS logrecs in the standard combined format:
+#   7 unquoted words and 3 quoted chunks, single blank separated.
+# The match groups are exactly the 10 chunks that the split-and-
+# recombine in parseLogrec would produce (quotes kept), so anything
+# needing its blank or quirk handling must not match:
+#   a quoted chunk can't start with a blank or a lone ',' (the 
+#   recombine would close it early), and the caller rules out '  ', 
+#   ' " " ' and the HTTP/1.0" quirk.
+#
+_W = r'([^ "]\S*)'
+_Q = r'("(?!, )(?:[^" ][^"]*)?")'
+_ACCESSRE = re.compile(' '.join((_W, _W, _W, _W, _W, _Q, _W, _W, _Q, _Q)))
+
+def _fastAccessChunks(logrec):
+    """Chunks for a plain combined format logrec, else None."""
+    if '  ' in logrec or ' " " ' in logrec or 'http/1.0"' in logrec:
+        return None
+    x = logrec.find('HTTP/1.0"')
+    if x != -1 and logrec[x-1] != ' ':
+        return None
+    m = _ACCESSRE.fullmatch(logrec)
+    if not m:
+        return None
+    return list(m.groups())
+
+#
+# Templated orec JSON.
+# Gives the same str as json.dumps(logdict, ensure_ascii=True, sort_keys=True)
+# for ACCESS and ERROR logdicts, but with the (sorted) keys laid out in
+# advance, so no logdict, no key sort, and no encoder for plain values.
+#
+
+_JESC = re.compile(r'[^ !#-\[\]-~]')        # Chars json.dumps would escape (ensure_ascii).
+
+def _J(v):
+    """JSON for one orec value."""
+    if v is None:
+        return 'null'
+    if type(v) is str:
+        if not _JESC.search(v):
+            return '"' + v + '"'                # Fast path: printable ASCII, no '"' or '\\'.
+    elif type(v) is int:
+        return str(v)
+    return json.dumps(v, ensure_ascii=True)
+
+_ACCESSJSON = ('{"_el": %s, "_id": %s, "_ip": null, "_si": %s, "_sl": %s, "_ts": %s, "ae": %s, '
+               '"body_bytes_sent": %s, "http_referer": %s, "http_user_agent": %s, '
+               '"remote_addr": %s, "remote_user": %s, "request": %s, "status": %s, '
+               '"time_local": %s, "time_utc": %s}')
+
+_ERRORJSON = ('{"_el": %s, "_id": %s, "_ip": null, "_si": %s, "_sl": %s, "_ts": %s, "ae": %s, '
+              '"status": %s, "stuff": %s, "time_local": %s, "time_utc": %s}')
+
 #
 # parseLogrec   
 #               
 def parseLogrec(ae, logrec):
     """Parse logrec into chunks."""
-    me = 'parseLogrec(%s, %s)' % (repr(ae), repr(logrec))
+    me = 'parseLogrec'
     rc, rm, chunks = -1, '???', None
     try:
 
+        # Fast path?
+        if ae == 'a':
+            chunks = _fastAccessChunks(logrec)
+            if chunks:
+                rc, rm = 0, 'OK'
+                return rc, rm, chunks
+
         # Blanks and quoted blanks.
         z = logrec
         if '  ' in logrec:
@@ -464,6 +675,7 @@ def parseLogrec(ae, logrec):
 
     except Exception as E:
         ###---rc, rm, chunks = 1, errmsg, None
+        me = 'parseLogrec(%s, %s)' % (repr(ae), repr(logrec))
         errmsg = '%s: %s @ %s' % (me, E, _m.tblineno())
         DOSQUAWK(errmsg)
         raise
@@ -473,6 +685,28 @@ def parseLogrec(ae, logrec):
         ###---return rc, rm, chunks
         1/1
 
+#
+# accessFields
+#
+def accessFields(chunks, ae):
+    """ACCESS fields from 10 chunks, in recbatch.ACCESS order."""
+    (remote_addr, ignored, remote_user, 
+        a, b, request, status, 
+        body_bytes_sent, http_referer, http_user_agent) = chunks
+    if request in ('', '""', '"_"'):
+        request = None
+    time_local = a + ' ' + b                    # '[03/Aug/2015:12:53:06' + ' ' + '-0700]'
+    if remote_user == '-':
+        remote_user = None
+
+    time_utc = CLFlocstr2utcut(ae, time_local)  # 1438631586                # '1438631586.    '
+    status = int(status)
+    body_bytes_sent = int(body_bytes_sent)
+    http_referer, http_user_agent = REFERERS.get(http_referer), UAS.get(http_user_agent)
+    remote_addr = ADDRS.get(remote_addr)
+    return (remote_addr, remote_user, request, time_local, time_utc, 
+            status, body_bytes_sent, http_referer, http_user_agent)
+
 #
 # genACCESSorec
 #
@@ -487,56 +721,40 @@ def genACCESSorec(chunks, ae, el, sl, srcid, subid, decorated=False):
             rc, rm = 1, errmsg
             return rc, rm, orec, vrec
 
-        (remote_addr, ignored, remote_user, 
-            a, b, request, status, 
-            body_bytes_sent, http_referer, http_user_agent) = chunks
-        if request in ('', '""', '"_"'):
-            request = None
-        time_local = a + ' ' + b                    # '[03/Aug/2015:12:53:06' + ' ' + '-0700]'
-        if remote_user == '-':
-            remote_user = None
-
-        time_utc = CLFlocstr2utcut(ae, time_local)  # 1438631586                # '1438631586.    '
-        time_utc_iso = _dt.ut2iso(time_utc)         # '2015-08-03 19:53:06'
-        status = int(status)
-        body_bytes_sent = int(body_bytes_sent)
-        remote_addr     = remote_addr
-        ignored         = ignored
-        remote_user     = remote_user
-        time_local      = time_local
-        time_utc        = time_utc
-        time_utc_iso    = time_utc_iso
-        status          = status
-        request         = request
-        body_bytes_sent = body_bytes_sent
-        http_referer    = http_referer
-        http_user_agent = http_user_agent
-        logdict = {
-            '_ip'             : None,               # Will be filled in by logging server.
-            '_ts'             : tsBDstr(time_utc),  # '1234567890.    ' format.
-            '_id'             : srcid,
-            '_si'             : subid,
-            '_el'             : el,                 # Raw, base error_level.
-            '_sl'             : sl,                 # Raw, base sub_level.
-            'ae'              : ae,                 # Access or Error.
-            'remote_addr'     : remote_addr,
-            'remote_user'     : remote_user,
-            'time_local'      : time_local,
-            'time_utc'        : time_utc,
-            'status'          : status,
-            'request'         : _S(request),
-            'body_bytes_sent' : body_bytes_sent,
-            'http_referer'    : _S(http_referer), 
-            'http_user_agent' : _S(http_user_agent)
-        }
+        (remote_addr, remote_user, request, time_local, time_utc, 
+            status, body_bytes_sent, http_referer, http_user_agent) = accessFields(chunks, ae)
+        _ts = tsBDstr(time_utc)                     # '1234567890.    ' format.
+
+        # Columnar copy?
+        if COLSINK:
+            COLSINK.add(time_utc, status, body_bytes_sent, remote_addr, 
+                        _S(request), http_user_agent, http_referer)
 
+        # Binary?  (JSON if it won't fit.)
         rc, rm = 0, 'OK'        
-        ldj = json.dumps(logdict, ensure_ascii=True, sort_keys=True)
-        if decorated:
-            # Prepend a copy of the timetamp (for sorting).
-            orec = '%s|%s|%s' % (logdict['_ts'], ae, ldj)  
-        else:
-            orec = ldj
+        orec = None
+        if OFORMAT == 'binary':
+            orec = binrec.encodeAccess(el, srcid, subid, sl, 
+                        body_bytes_sent, http_referer, http_user_agent,
+                        remote_addr, remote_user, _S(request), status, 
+                        time_local, time_utc)
+
+        # Fields, as _ACCESSJSON (sorted) wants them.
+        #   '_ip'             : None                # Will be filled in by logging server.
+        #   '_el'             : el                  # Raw, base error_level.
+        #   '_sl'             : sl                  # Raw, base sub_level.
+        #   'ae'              : ae                  # Access or Error.
+        if orec is None:
+            ldj = _ACCESSJSON % (
+                _J(el), _J(srcid), _J(subid), _J(sl), _J(_ts), _J(ae),
+                _J(body_bytes_sent), _J(http_referer), _J(http_user_agent),
+                _J(remote_addr), _J(remote_user), _J(_S(request)), _J(status),
+                _J(time_local), _J(time_utc))
+            if decorated:
+                # Prepend a copy of the timetamp (for sorting).
+                orec = '%s|%s|%s' % (_ts, ae, ldj)  
+            else:
+                orec = ldj
 
         if TXTLEN > 0:
             vrec = ('%s|%s|%s|%s|%s' % (ip15(remote_addr), str(el), str(sl), ae, str(request)))[:TXTLEN]
@@ -553,6 +771,40 @@ def genACCESSorec(chunks, ae, el, sl, srcid, subid, decorated=False):
         ###---return rc, rm, orec, vrec
         1/1
 
+#
+# errorFields
+#
+def errorFields(chunks, ae):
+    """ERROR fields from chunks (consumed), in recbatch.ERROR order."""
+    time_local = chunks.pop(0) + ' ' + chunks.pop(0)
+    time_utc = CLFlocstr2utcut(ae, time_local)
+
+    status = chunks.pop(0)
+    if status not in ('[warn]', '[error]'):  
+        errmsg = 'unexpected status: ' + repr(status)
+        pass        # POR
+
+    if status == '[warn]':
+        pass
+
+    # The remaining chunks are inconsistently formatted "stuff".
+    stuff = '\t'.join(chunks)
+
+    # But try to find "remote_addr", "request", "server".
+    remote_addr, request, server = '999.999.999.999', '', ''
+    z = copy.copy(chunks)
+    while z:
+        y = z.pop(0)
+        if y == 'client:':
+            remote_addr = z.pop(0).rstrip(',')
+            continue
+        if y == 'server:':
+            server = z.pop(0).rstrip(',')
+            continue
+        if y == 'request:':
+            request = z.pop(0).rstrip(',')
+    return time_local, time_utc, status, stuff, remote_addr, request, server
+
 #
 # genERRORorec
 #
@@ -562,60 +814,28 @@ def genERRORorec(chunks, ae, el, sl, srcid, subid, decorated=False):
     rc, rm, orec, vrec = -1, '???', None, None
     try:
 
-        time_local = chunks.pop(0) + ' ' + chunks.pop(0)
-        time_utc = CLFlocstr2utcut(ae, time_local)
-        time_utc_iso = _dt.ut2iso(time_utc)
-
-        status = chunks.pop(0)
-        if status not in ('[warn]', '[error]'):  
-            errmsg = 'unexpected status: ' + repr(status)
-            pass        # POR
-
-        if status == '[warn]':
-            pass
-
-        # The remaining chunks are inconsistently formatted "stuff".
-        stuff = '\t'.join(chunks)
-
-        # But try to find "remote_addr", "request", "server".
-        remote_addr, request, server = '999.999.999.999', '', ''
-        z = copy.copy(chunks)
-        while z:
-            y = z.pop(0)
-            if y == 'client:':
-                remote_addr = z.pop(0).rstrip(',')
-                continue
-            if y == 'server:':
-                server = z.pop(0).rstrip(',')
-                continue
-            if y == 'request:':
-                request = z.pop(0).rstrip(',')
-        remote_addr, request, server = remote_addr, request, server
-        if not request:
-            chunks = chunks
-
-        # Skeleton ERROR logdict.
-        logdict = {
-            '_ip'             : None,               # Will be filled in by logging server.
-            '_ts'             : tsBDstr(time_utc),  # '1234567890.    ' format.
-            '_id'             : srcid,
-            '_si'             : subid,
-            '_el'             : el,                 # Raw, base error_level.
-            '_sl'             : sl,                 # Raw, base sub_level.
-            'ae'              : ae,                 # Access or Error.
-            'time_local'      : time_local,
-            'time_utc'        : time_utc,
-            'status'          : status,             # In ('[warn]', '[error]').
-            'stuff'           : stuff               # Inconsistently formatted stuff. 
-        }
+        (time_local, time_utc, status, stuff, 
+            remote_addr, request, server) = errorFields(chunks, ae)
 
+        # ERROR fields, as _ERRORJSON (sorted) wants them.
+        #   '_ip'             : None                # Will be filled in by logging server.
+        #   '_ts'             : _ts                 # '1234567890.    ' format.
+        #   'status'          : status              # In ('[warn]', '[error]').
+        #   'stuff'           : stuff               # Inconsistently formatted stuff. 
+        _ts = tsBDstr(time_utc)
         rc, rm = 0, 'OK'        
-        ldj = json.dumps(logdict, ensure_ascii=True, sort_keys=True)
-        if decorated:
-            # Prepend a copy of the timetamp (for sorting).
-            orec = '%s|%s|%s' % (logdict['_ts'], ae, ldj)  
-        else:
-            orec = ldj
+        orec = None
+        if OFORMAT == 'binary':
+            orec = binrec.encodeError(el, srcid, subid, sl, status, stuff, time_local, time_utc)
+        if orec is None:
+            ldj = _ERRORJSON % (
+                _J(el), _J(srcid), _J(subid), _J(sl), _J(_ts), _J(ae),
+                _J(status), _J(stuff), _J(time_local), _J(time_utc))
+            if decorated:
+                # Prepend a copy of the timetamp (for sorting).
+                orec = '%s|%s|%s' % (_ts, ae, ldj)  
+            else:
+                orec = ldj
 
         if TXTLEN > 0:
             vrec = ('%s|%s|%s|%s|%s %s' % 
@@ -645,92 +865,220 @@ def shutDown():
     except:  pass
     try:  OFILE.close()
     except:  pass
+    try:  COLSINK.close()
+    except:  pass
 
 #
 # inode2filename
 #
-def inode2filename(inode):
-    for filename in os.listdir(WPATH):
-        fi = getFI(filename)
-        if fi['inode'] == inode:
-            return filename
+def inode2filename(inode, stale=None):
+    """Current filename for inode, from the per cycle INODE2FN index.
+    Rescans WPATH (dirent inodes only, no stats) on a miss or if the
+    index still has the stale name (eg, rolled since the last scan)."""
+    fn = INODE2FN.get(inode)
+    if fn is None or fn == stale:
+        indexWPATH()
+        fn = INODE2FN.get(inode)
+    return fn
 
 #
-# exportLogrec
+# indexWPATH
 #
-def exportLogrec(ae, logrec):
-    """Export a raw log record: parse, gen a/e orec, output to xlog/file."""
-    me = 'exportLogrec(%s, %s)' % (repr(ae), repr(logrec))
-    try:
+def indexWPATH():
+    """Rebuild INODE2FN (and FN2INODE) from the dirents of WPATH."""
+    global INODE2FN, FN2INODE
+    with os.scandir(WPATH) as it:
+        FN2INODE = {de.name: de.inode() for de in it if doFilename(de.name)}
+    INODE2FN = {v: k for k, v in FN2INODE.items()}
 
-        # logrec?
-        try:  logrec = logrec.strip()
-        except:  pass
-        if not logrec:
-            return
-            
-        # Parse logrec.
-        rc, rm, chunks = parseLogrec(ae, logrec)
+#
+# dedupFlush
+#
+def dedupFlush():
+    """Journal DEDUP's keys once the sinks have put out all that was emitted.
+    Called per batch, and at checkpoints (when the sinks are drained)."""
+    if DEDUP and not (OXLOG and OXLOG.pending()) and not (OFILE and OFILE.pending()):
+        DEDUP.flush()
+
+####################################################################################################
+#
+# Batch export: recbatch.RecordBatch through parseBatch, genBatch and 
+# emitBatch, each stage a whole batch per call.  The orecs are those
+# parseLogrec and genACCESSorec/genERRORorec make, in the same order.
+#
+
+#
+# parseBatch
+#
+def parseBatch(b):
+    """Parse b's logrecs into its field columns.  Unparseable ones are logged and dropped."""
+    me = 'parseBatch'
+    ae = b.ae
+    fields = accessFields if ae == 'a' else errorFields
+    rows, logrecs, offsets = [], [], array.array('q')
+    for logrec, offset in zip(b.logrecs, b.offsets):
+        try:  z = logrec.strip()
+        except:  z = logrec
+        if not z:
+            continue
+        rc, rm, chunks = parseLogrec(ae, z)
+        if rc == 0 and ae == 'a' and len(chunks) != 10:
+            rc, rm = 1, 'expecting 10 fields but got %d from: %s' % (len(chunks), repr('|'.join(chunks)))
         if rc != 0:
             _m.beep(1)
-            try:    z = '|'.join(chunks)
-            except: z = ''
-            errmsg = '%s: parse_logrec: %d:, %s, %s' % (me, rc, rm, z)
+            try:    y = '|'.join(chunks)
+            except: y = ''
+            errmsg = '%s(%s, %s): %d:, %s, %s' % (me, repr(ae), repr(z), rc, rm, y)
             _sl.error(errmsg)
-            return
-
-        # ACCESS log?
-        if   ae == 'a':
-            rc, rm, orec, vrec = genACCESSorec(chunks, 'a', AEL, 'a', SRCID, SUBID)
-            if rc != 0:
-                _m.beep(1)
-                try:    z = '|'.join(chunks)
-                except: z = ''
-                errmsg = '%s: gen_access_orec: %d:, %s, %s' % (me, rc, rm, z)
-                _sl.error(errmsg)
-                return
-            
-        # ERROR log?
-        elif ae == 'e':
-            rc, rm, orec, vrec = genERRORorec(chunks, 'e', EEL, 'e', SRCID, SUBID)
-            if rc != 0:
-                _m.beep(1)
-                try:    z = '|'.join(chunks)
-                except: z = ''
-                errmsg = '%s: parse_gen_error_orec: %d:, %s, %s' % (me, rc, rm, z)
-                _sl.error(errmsg)
-                return
+            continue
+        rows.append(fields(chunks, ae))
+        logrecs.append(z)
+        offsets.append(offset)
+    b.logrecs, b.offsets = logrecs, offsets
+    b.setRows(rows)
 
+#
+# genBatch
+#
+def genBatch(b):
+    """Gen b's orecs (and vrecs, if TXTLEN) from its field columns."""
+    me = 'genBatch'
+    try:
+        ae, J, S, ts = b.ae, _J, _S, tsBDstr
+        el = AEL if ae == 'a' else EEL
+        binary = (OFORMAT == 'binary')
+        # Per batch constants, and JSON of the batch's repeated values.
+        jel, jid, jsi, jsl, jae = J(el), J(SRCID), J(SUBID), J(ae), J(ae)
+        jc = {}
+        def JC(v):
+            z = jc[v] = J(v)
+            return z
+        if ae == 'a':
+            requests = [S(request) for request in b.request]
+            if COLSINK:
+                for row in zip(b.time_utc, b.status, b.body_bytes_sent, b.remote_addr, 
+                               requests, b.http_user_agent, b.http_referer):
+                    COLSINK.add(*row)
+            # Binary?  (JSON where it won't fit.)
+            if binary:
+                orecs = binrec.encodeAccesses(el, SRCID, SUBID, ae,
+                            b.body_bytes_sent, b.http_referer, b.http_user_agent,
+                            b.remote_addr, b.remote_user, requests, b.status, 
+                            b.time_local, b.time_utc)
+            else:
+                orecs = [None] * len(requests)
+            tmpl = _ACCESSJSON
+            for x, (orec, remote_addr, remote_user, request, time_local, time_utc, status, 
+                    body_bytes_sent, http_referer, http_user_agent) in enumerate(zip(
+                        orecs, b.remote_addr, b.remote_user, requests, b.time_local, b.time_utc, 
+                        b.status, b.body_bytes_sent, b.http_referer, b.http_user_agent)):
+                if orec is None:
+                    orecs[x] = tmpl % (jel, jid, jsi, jsl, J(ts(time_utc)), jae,
+                                   str(body_bytes_sent), 
+                                   jc.get(http_referer) or JC(http_referer), 
+                                   jc.get(http_user_agent) or JC(http_user_agent),
+                                   jc.get(remote_addr) or JC(remote_addr), J(remote_user), J(request), str(status),
+                                   jc.get(time_local) or JC(time_local), str(time_utc))
+            if TXTLEN > 0:
+                b.vrecs = [('%s|%s|%s|%s|%s' % (ip15(remote_addr), str(el), ae, ae, str(request)))[:TXTLEN]
+                           for remote_addr, request in zip(b.remote_addr, b.request)]
         else:
-            raise ValueError('export: bad _ae: ' + repr(ae))
+            if binary:
+                orecs = binrec.encodeErrors(el, SRCID, SUBID, ae, 
+                            b.status, b.stuff, b.time_local, b.time_utc)
+            else:
+                orecs = [None] * len(b.time_utc)
+            tmpl = _ERRORJSON
+            for x, (orec, time_local, time_utc, status, stuff) in enumerate(zip(
+                        orecs, b.time_local, b.time_utc, b.status, b.stuff)):
+                if orec is None:
+                    orecs[x] = tmpl % (jel, jid, jsi, jsl, J(ts(time_utc)), jae,
+                                   jc.get(status) or JC(status), J(stuff), 
+                                   jc.get(time_local) or JC(time_local), str(time_utc))
+            if TXTLEN > 0:
+                b.vrecs = [('%s|%s|%s|%s|%s %s' % (ip15(remote_addr), str(el), ae, ae, server, request))[:TXTLEN]
+                           for remote_addr, request, server in zip(b.remote_addr, b.request, b.server)]
+        b.orecs = orecs
+    except Exception as E:
+        errmsg = '%s: %s @ %s' % (me, E, _m.tblineno())
+        DOSQUAWK(errmsg)
+        raise
 
-        # TCP/IP?
-        if OXLOG:
-            try:
-                rc = OXLOG.send(orec.encode(encoding=ENCODING, errors=ERRORS))
-            except Exception as E:
-                errmsg = '%s: oxlog: %s' % (me, E)
-                DOSQUAWK(errmsg)
-                raise
+#
+# emitBatch
+#
+def emitBatch(b):
+    """Output b's orecs to xlog/file, and vrecs to screen."""
+    emitOrecs(b.orecs, b.vrecs)
 
-        # Flatfile?
-        if OFILE:
-            try:
-                OFILE.write(orec + '\n')    # Opened with encoding=ENCODING, errors=ERRORS.
-            except Exception as E:
-                errmsg = '%s: ofile: %s' % (me, E)
-                DOSQUAWK(errmsg)
-                raise
+#
+# emitOrecs
+#
+def emitOrecs(orecs, vrecs=None):
+    """Output a list of orecs (str or encoded) to xlog/file, and vrecs to screen."""
+    me = 'emitOrecs'
 
-        # Screen?
-        if TXTLEN > 0:
-            pass
+    # TCP/IP?
+    if OXLOG:
+        try:
+            OXLOG.sendMany([orec.encode(encoding=ENCODING, errors=ERRORS) if type(orec) is str else orec 
+                            for orec in orecs], TXPRIO)
+        except Exception as E:
+            errmsg = '%s: oxlog: %s' % (me, E)
+            DOSQUAWK(errmsg)
+            raise
+
+    # Flatfile?
+    if OFILE:
+        try:
+            OFILE.writeMany(orecs)
+        except Exception as E:
+            errmsg = '%s: ofile: %s' % (me, E)
+            DOSQUAWK(errmsg)
+            raise
+
+    # Screen?
+    if vrecs and TXTLEN > 0:
+        for vrec in vrecs:
             _sl.extra(vrec)
 
+#
+# exportBatch
+#
+def exportBatch(b):
+    """Export a RecordBatch: drop resends (DEDUP), parse, gen, emit.
+    Returns the # of logrecs it had, and clears it for the next batch."""
+    me = 'exportBatch'
+    n = len(b)
+    if not n:
+        return 0
+    try:
+        keys = None
+        if DEDUP:
+            keys, logrecs, offsets = [], [], array.array('q')
+            for logrec, offset in zip(b.logrecs, b.offsets):
+                if offset >= 0:
+                    k = DEDUP.key(b.ae, offset, logrec)
+                    if DEDUP.seen(k):
+                        continue        # Resent.
+                    keys.append(k)
+                logrecs.append(logrec)
+                offsets.append(offset)
+            b.logrecs, b.offsets = logrecs, offsets
+        parseBatch(b)
+        genBatch(b)
+        emitBatch(b)
+        if keys:
+            for k in keys:
+                DEDUP.add(k)
+            dedupFlush()
+        return n
     except Exception as E:
         errmsg = '%s: %s @ %s' % (me, E, _m.tblineno())
         DOSQUAWK(errmsg)
         raise
+    finally:
+        b.clear()
 
 def testS2E(ae, s2e):
     if not (TEST and ae and s2e):
@@ -779,12 +1127,49 @@ def testS2E(ae, s2e):
         ###---return (ne == 0)
         1/1
 
+#
+# checkpoint: commit the sinks, then record progress in FFWDB.
+#
+def checkpoint(fi, fprocessed, uprocessed=None, held=None):
+    """Make output so far durable, then checkpoint 'processed' (and 'uprocessed', 'held')."""
+    me = 'checkpoint'
+    if OXLOG:
+        try:
+            OXLOG.drain()
+        except Exception as E:
+            errmsg = '%s: oxlog drain: %s' % (me, E)
+            DOSQUAWK(errmsg)
+            raise
+    if OFILE:
+        try:
+            OFILE.commit()
+        except Exception as E:
+            errmsg = '%s: ofile commit: %s' % (me, E)
+            DOSQUAWK(errmsg)
+            raise
+    dedupFlush()
+    if TESTONLY:
+        return
+    fi['processed'] = fprocessed
+    if uprocessed is not None:
+        fi['uprocessed'] = uprocessed
+    if held is not None:
+        fi['held'] = held
+    FFWDB.checkpoint(fi['inode'], fprocessed, uprocessed, held)
+    FFWDB.sync()                # Written through, even with DBMEM's write-behind.
+    if DEBUG:
+        _sl.debug('%s  >> db processed: %d  %s' %(_dt.ut2iso(_dt.locut()), fprocessed, uprocessed))
+
+def ckptDue(n, nb, t0):
+    """Is a mid-file checkpoint due after n lines, nb bytes, since t0?  (Asked per batch.)"""
+    return n >= CKPTLINES or nb >= CKPTBYTES or (time.time() - t0) >= CKPTSECS
+
 #
 # Export a file, either history (whole file) or live (incremental).
 #
-def exportFile(fi):
-    """Export a file (from info dict)."""
-    global FWTSTOP
+def exportFile(fi, nextfi=None):
+    """Export a file (from info dict).  nextfi: the one to prefetch after it."""
+    global FWTSTOP, TXPRIO
     ae = fi['ae']
     fn = fi['filename']
     me = 'exportFile(%d  %s  %s)' % (fi['inode'], ae, fn)
@@ -797,8 +1182,13 @@ def exportFile(fi):
         # A flag to indicate that processing happened.
         processed2db = False        
 
+        # Live files' orecs go ahead of history's.
+        TXPRIO = xlogtx.BULK if fi['static'] else xlogtx.LIVE
+
         # How many bytes of file is to be exported?
         fprocessed = fi['processed']
+        uprocessed = None
+        held = None
         fsize = fi['size']
         if fprocessed >= fsize:
             return
@@ -808,43 +1198,120 @@ def exportFile(fi):
         if not os.path.isfile(pfn):
             return                      # Skip and do it later.
 
-        # .gz files are always treated as static, and 
-        # the whole file is read. (No seek!)
+        # .gz files are always treated as static.
+        # Inflating is done on another thread (readers.GzBlockReader), 
+        # a line block at a time.
+        # Mid-file checkpoints record uncompressed bytes done 
+        # ('uprocessed'), and a resumed read skips that much.
+        # With GZINDEX (and libz), readers.GzIndexReader keeps an 
+        # index of access points (gzIndexPfn), and a resumed read 
+        # starts at the last one before 'uprocessed', not at byte 0.
         if pfn.endswith('.gz'):          
-            with gzip.open(pfn, 'r') as f:      # Can't decode on the fly.
-                for x, logrec in enumerate(f):
+            uskip = fi.get('uprocessed') or 0
+            f = PREFETCH.pop((fi['inode'], uskip), None) or openGz(fi)
+            uprocessed = f.start
+            if uskip:
+                _sl.info('skipping {:,d} uncompressed bytes ({:,d} by index)'.format(uskip, f.start))
+            processed2db = True
+            ckn, cku, ckt = 0, uprocessed, time.time()
+            b = recbatch.RecordBatch(ae, BATCH)
+            upos = uprocessed                           # Read to.  uprocessed: exported to.
+            with f:                                     # Can't decode on the fly.
+                x = 0
+                for block in f.blocks():
+                    if FWTSTOP:
+                        break
+                    for logrec in readers.blockLines(block):
+                        if FWTSTOP:
+                            break
+                        n = len(logrec) + 1
+                        if upos < uskip:
+                            upos += n
+                            uprocessed = upos
+                            continue
+                        logrec = logrec.decode(encoding=ENCODING, errors=ERRORS)
+                        # Dots?
+                        if DOTDIV and not (x % DOTDIV):
+                            _sw.iw('.')
+                        x += 1
+                        #
+                        full = b.add(logrec, upos)
+                        upos += n
+                        if full:
+                            ckn += exportBatch(b)
+                            uprocessed = upos
+                            if ckptDue(ckn, uprocessed - cku, ckt):
+                                checkpoint(fi, fprocessed, uprocessed)
+                                ckn, cku, ckt = 0, uprocessed, time.time()
+                exportBatch(b)
+                uprocessed = upos
+            if not FWTSTOP:
+                fprocessed = fsize
+            return
+
+        # Uncompressed files are read as bytes, with an initial
+        # seek from the SOF to the end of the last complete line
+        # exported. The file is read to its end, even if this goes
+        # beyond the size given, which will happen if NGINX appends 
+        # to this file while we're processing it. 'processed' is 
+        # advanced by exactly what's exported, so nothing is resent.
+        # A live file's unterminated last line (NGINX is mid-write)
+        # is held back until it's been completed.  How far it was read
+        # is checkpointed as 'held': until the file grows past that, 
+        # it's not unfinished, and FFWDB.oldest() moves on to others.
+        # Static files are mmap'd (readers.MmapLineReader), and
+        # decoded a block of lines at a time.
+        if fi['static'] and MMAP:
+            with readers.MmapLineReader(pfn, fprocessed) as f:
+                if fprocessed > 0:
+                    _sl.info('skipping {:,d} bytes'.format(fprocessed))
+                processed2db = True
+                ckn, ckb, ckt = 0, fprocessed, time.time()
+                b = recbatch.RecordBatch(ae, BATCH)
+                fpos = fprocessed                       # Read to.  fprocessed: exported to.
+                for x, (logrec, end) in enumerate(f.lines(ENCODING, ERRORS)):
                     if FWTSTOP:
                         break
-                    logrec = logrec.decode(encoding=ENCODING, errors=ERRORS)
-                    # Dots?
-                    if DOTDIV and not (x % DOTDIV):
+                    if not (x % 1000):
                         _sw.iw('.')
-                    #
-                    exportLogrec(ae, logrec)
-            fprocessed = fsize
-            processed2db = True
+                    full = b.add(logrec, fpos)
+                    fpos = end
+                    if full:
+                        ckn += exportBatch(b)
+                        fprocessed = fpos
+                        if ckptDue(ckn, fprocessed - ckb, ckt):
+                            checkpoint(fi, fprocessed)
+                            ckn, ckb, ckt = 0, fprocessed, time.time()
+                exportBatch(b)
+                fprocessed = fpos
             return
 
-        # Uncompressed files are read as text, with an initial
-        # seek from the SOF. The file is read to its end, even
-        # if this goes beyond the size given, which will 
-        # happen if NGINX appends to this file while we're 
-        # processing it. This will result in the appendage 
-        # being reprocessed next time around, but this is 
-        # harmless bcs logrec processing is able to handle (skip)
-        # duplicates.
-        with open(pfn, 'r', encoding=ENCODING, errors=ERRORS) as f:
+        with open(pfn, 'rb') as f:
             if fprocessed > 0:
                 _sl.info('skipping {:,d} bytes'.format(fprocessed))
                 f.seek(fprocessed)
+            processed2db = True
+            ckn, ckb, ckt = 0, fprocessed, time.time()
+            b = recbatch.RecordBatch(ae, BATCH)
+            fpos = fprocessed                           # Read to.  fprocessed: exported to.
             for x, logrec in enumerate(f):
                 if FWTSTOP:
                     break
                 if not (x % 1000):
                     _sw.iw('.')
-                exportLogrec(ae, logrec)
-            fprocessed = fsize
-            processed2db = True
+                if not logrec.endswith(b'\n') and not fi['static']:
+                    held = fpos + len(logrec)
+                    break                   # Partial line: next time.
+                full = b.add(logrec.decode(encoding=ENCODING, errors=ERRORS), fpos)
+                fpos += len(logrec)
+                if full:
+                    ckn += exportBatch(b)
+                    fprocessed = fpos
+                    if ckptDue(ckn, fprocessed - ckb, ckt):
+                        checkpoint(fi, fprocessed)
+                        ckn, ckb, ckt = 0, fprocessed, time.time()
+            exportBatch(b)
+            fprocessed = fpos
             return
 
     except Exception as E:
@@ -855,37 +1322,116 @@ def exportFile(fi):
         # End dots.
         _sw.nl()
         # Close src file.
-        try:  f.close
+        try:  f.close()
         except:  pass
-        # Update 'processed'?
-        if processed2db and not TESTONLY:
-            fi['processed'] = fprocessed
-            z = {'inode': fi['inode'], 'processed': fprocessed}
-            FFWDB.update(z)
-            if DEBUG:
-                _sl.debug('%s  >> db processed: %d' %(_dt.ut2iso(_dt.locut()), fprocessed))
+        # A reader prefetched for another file (or offset) is of no use now.
+        closePrefetch()
+        # Start reading the next file while this one's output drains.
+        if nextfi and not FWTSTOP:
+            prefetch(nextfi)
+        # Commit sinks, then update 'processed'?
+        if processed2db:
+            checkpoint(fi, fprocessed, uprocessed, held)
         # Wait for OXLOG to flush?
         if fi['static'] and WAIT4OXLOG and OXLOG:
             action = 'WAIT4OXLOG'
-            nsw = 0
             try:
-                while len(OXLOG.txbacklog) > 1:
-                    _sw.iw('|')
-                    time.sleep(1)
-                    nsw += 1
-                    if nsw > 180:                        # !MAGIC!  Give up after three minutes.
-                        raise Exception('timeout')
-                _sw.nl()
+                if not OXLOG.drain(WAIT4SECS):
+                    raise Exception('timeout')
             except Exception as E:
                 errmsg = '%s: %s' % (action, E)
                 DOSQUAWK(errmsg)
                 raise
 
+#
+# openGz
+#
+def openGz(fi):
+    """A line block reader for a .gz file, from its 'uprocessed' (per GZINDEX)."""
+    pfn = os.path.normpath(WPATH + '/' + fi['filename'])
+    if GZINDEX and FFWDBPFN and readers.libz():
+        return readers.GzIndexReader(pfn, gzIndexPfn(fi['inode']), 
+                    skip=fi.get('uprocessed') or 0, spacing=GZINDEX)
+    return readers.GzBlockReader(pfn)
+
+#
+# prefetch
+#
+def prefetch(fi):
+    """Start inflating .gz fi ahead of its exportFile.  Only one is kept."""
+    me = 'prefetch'
+    try:
+        closePrefetch()
+        if not fi['filename'].endswith('.gz') or not doFilename(fi['filename']):
+            return
+        PREFETCH[(fi['inode'], fi.get('uprocessed') or 0)] = openGz(fi)
+    except Exception as E:
+        # No harm: exportFile will open it itself.
+        _sl.warning('%s: %s @ %s' % (me, E, _m.tblineno()))
+
+#
+# closePrefetch
+#
+def closePrefetch():
+    while PREFETCH:
+        PREFETCH.popitem()[1].close()
+
+#
+# gzIndexPfn
+#
+def gzIndexPfn(inode):
+    """Access point index file for a .gz file's inode (readers.GzIndexReader)."""
+    return '%s.%d.gzi' % (FFWDBPFN, inode)
+
+#
+# dropGzIndex
+#
+def dropGzIndex(inode):
+    try:  os.remove(gzIndexPfn(inode))
+    except FileNotFoundError:  pass
+
+#
+# moveFile
+#
+def moveFile(src, snk):
+    """os.rename if src and snk's folder are on one filesystem, else shutil.move."""
+    if os.stat(src).st_dev == os.stat(os.path.dirname(snk)).st_dev:
+        os.rename(src, snk)
+    else:
+        shutil.move(src, snk)
+
+#
+# doneSeqn
+#
+def doneSeqn():
+    """Next DONESD sequence number, from FFWDB's extra dict (no listing of DONESD)."""
+    n = FFWDB.extra().get('doneseq')
+    if n is None:
+        # First time: carry on from the old count of DONESD entries.
+        n = len(os.listdir(os.path.normpath(WPATH + '/' + DONESD)))
+    return n + 1
+
+#
+# doneSink
+#
+def doneSink(n, fn):
+    """(n, DONESD pfn) for fn, with the first sequence number prefix from n 
+    not already used (eg, a doneseq lost to a crash)."""
+    while True:
+        snk = os.path.normpath(WPATH + '/' + DONESD + '/' + '%06d-' % n + fn)
+        if not os.path.exists(snk):
+            return n, snk
+        n += 1
+
 #
 # doneWithFile
 #
 def doneWithFile(_ino, _fn):
-    """Move _fn to DONESD."""
+    """Move _fn to DONESD.
+    The move is first recorded in FFWDB's extra dict ('moving', made
+    durable before renaming), then the inode is deleted and 'moving'
+    cleared in one transaction.  recoverDone() settles a move that a
+    crash interrupted."""
     me = 'doneWithFile(%d, %s)' % (_ino, repr(_fn))
     _sl.info(me)
     moved = False   # Pessimistic.
@@ -893,18 +1439,17 @@ def doneWithFile(_ino, _fn):
         # Moving?
         if not DONESD:
             return
-        # Count files in sink path to make a seqn prefix for 
-        # the sink filename.
-        snk = os.path.normpath(WPATH + '/' + DONESD)
-        n = 0
-        for filename in os.listdir(snk):
-            n += 1
-        pfx = '%06d-' % (n+1)
+        # Sequence number prefix for the sink filename.
+        n, snk = doneSink(doneSeqn(), _fn)
+        ed = FFWDB.extra()
+        ed['doneseq'] = n
+        ed['moving'] = {'inode': _ino, 'snk': snk}
+        FFWDB.extra(ed)
+        FFWDB.sync()
         # First try at moving the file.
         src = os.path.normpath(WPATH + '/' + _fn)
-        snk = os.path.normpath(WPATH + '/' + DONESD + '/' + pfx + _fn)
         try:
-            shutil.move(src, snk)
+            moveFile(src, snk)
             moved = True
             return                  # Early exit!
         except Exception as E:
@@ -913,7 +1458,7 @@ def doneWithFile(_ino, _fn):
             _sl.warning(errmsg)
             pass                    # POR
         # Find current (rolled?) filename for _ino.
-        _fn = inode2filename(_ino)
+        _fn = inode2filename(_ino, stale=_fn)
         '''...
         _fn = None
         for filename in os.listdir(WPATH):
@@ -929,9 +1474,13 @@ def doneWithFile(_ino, _fn):
         _sl.warning(msg)
         # Second & final try at moving the file.
         src = os.path.normpath(WPATH + '/' + _fn)
-        snk = os.path.normpath(WPATH + '/' + DONESD + '/' + pfx + _fn)
+        n, snk = doneSink(n, _fn)
+        ed['doneseq'] = n
+        ed['moving']['snk'] = snk
+        FFWDB.extra(ed)
+        FFWDB.sync()
         try:
-            shutil.move(src, snk)
+            moveFile(src, snk)
             moved = True
         except Exception as E:
             errmsg = 'moving %s to %s failed: %s' % (_fn, DONESD, E)
@@ -943,8 +1492,183 @@ def doneWithFile(_ino, _fn):
         DOSQUAWK(errmsg)
         raise
     finally:
-        if moved:
-            FFWDB.delete(_ino)
+        if DONESD:
+            doneMoving(_ino if moved else None)
+
+#
+# doneMoving
+#
+def doneMoving(inode=None):
+    """Clear extra's 'moving' and, if moved, delete inode: one transaction."""
+    with FFWDB.cycle():
+        ed = FFWDB.extra()
+        if ed.pop('moving', None) is None and inode is None:
+            return
+        if inode is not None:
+            FFWDB.delete(inode)
+            dropGzIndex(inode)
+        FFWDB.extra(ed)
+
+#
+# recoverDone
+#
+def recoverDone():
+    """Settle a doneWithFile move interrupted by a crash (at watcherThread start)."""
+    me = 'recoverDone'
+    try:
+        mv = FFWDB.extra().get('moving')
+        if not mv:
+            return
+        ino, snk = mv['inode'], mv['snk']
+        indexWPATH()
+        if ino not in INODE2FN and os.path.exists(snk):
+            # Made it.
+            _sl.warning('%s: %d was moved to %s' % (me, ino, snk))
+            doneMoving(ino)
+            return
+        if ino in INODE2FN and os.path.exists(snk) and os.stat(snk).st_ino != ino:
+            # Partial (cross-filesystem) copy.
+            os.remove(snk)
+        _sl.warning('%s: %d was not moved' % (me, ino))
+        doneMoving()
+    except Exception as E:
+        errmsg = '%s: %s @ %s' % (me, E, _m.tblineno())
+        DOSQUAWK(errmsg)
+        raise
+
+#
+# Backfill: static files parsed in parallel by a process pool.
+# Each worker reads, parses and gens one whole file into a spool file
+# of orecs.  The parent emits the spools in file (modified) order, 
+# then checkpoints 'processed' and moves each file to DONESD as it
+# completes.  Workers don't touch FFWDB or the sinks.
+# Workers are started by BFCONTEXT (a fork of a parent with sender, 
+# ager and write-behind threads could inherit their held locks), so 
+# they get the parent's settings from _backfillInit, not by fork.
+#
+
+BFSETTINGS = ('WPATH', 'SPOOLD', 'ENCODING', 'ERRORS', 'OFORMAT', 'SRCID', 'SUBID', 
+              'AEL', 'EEL', 'TXTLEN', 'BATCH', 'INTERNN', 'FFWDBPFN', 'GZINDEX')
+
+def _backfillInit(settings):
+    """Pool worker initializer: the parent's settings, and no sinks."""
+    global COLSINK, DEDUP, OXLOG, OFILE
+    globals().update(settings)
+    COLSINK = DEDUP = OXLOG = OFILE = None
+    makeInterns()
+
+def _backfillWorker(fi):
+    """Pool worker: spool one static file's orecs.  Returns (fi, spool pfn, # orecs)."""
+    ae = fi['ae']
+    pfn = os.path.normpath(WPATH + '/' + fi['filename'])
+    pfx = 'nlmon-%d-%d-' % (BFPARENT, fi['inode'])
+    fd, spfn = tempfile.mkstemp(prefix=pfx, suffix='.spool', dir=SPOOLD)
+    with os.fdopen(fd, 'wb', buffering=1048576) as sf:
+        # .gz: from 'uprocessed' (as exportFile), inflated on another thread.  
+        # Uncompressed: from 'processed'.
+        if pfn.endswith('.gz'):
+            with openGz(fi) as f:
+                n = _spoolOrecs(ae, _gzLogrecs(f, fi.get('uprocessed') or 0), sf)
+        else:
+            with open(pfn, 'rb') as f:
+                if fi['processed'] > 0:
+                    f.seek(fi['processed'])
+                n = _spoolOrecs(ae, f, sf)
+    return fi, spfn, n
+
+def _gzLogrecs(f, uskip):
+    # f's lines, past the first uskip uncompressed bytes.
+    upos = f.start
+    for block in f.blocks():
+        for logrec in readers.blockLines(block):
+            if upos < uskip:
+                upos += len(logrec) + 1
+                continue
+            yield logrec
+
+def _spoolOrecs(ae, logrecs, sf):
+    n = 0
+    b = recbatch.RecordBatch(ae, BATCH)
+    for logrec in logrecs:
+        if b.add(logrec.decode(encoding=ENCODING, errors=ERRORS)):
+            n += _spoolBatch(b, sf)
+    n += _spoolBatch(b, sf)
+    return n
+
+def _spoolBatch(b, sf):
+    parseBatch(b)
+    genBatch(b)
+    z = []
+    for orec in b.orecs:
+        if type(orec) is str:
+            orec = orec.encode(encoding=ENCODING, errors=ERRORS)
+        z.append(binrec.RLEN.pack(len(orec)))       # Length prefixed: orecs may be binary.
+        z.append(orec)
+    sf.write(b''.join(z))
+    n = len(b.orecs)
+    b.clear()
+    return n
+
+#
+# backfillFiles
+#
+def backfillFiles():
+    """Export all unfinished static files, BACKFILL at a time.  Returns # files done."""
+    global TXPRIO
+    me = 'backfillFiles'
+    fis = [fi for fi in FFWDB.unfinished(static=True) 
+           if doFilename(fi['filename']) and 
+              os.path.isfile(os.path.normpath(WPATH + '/' + fi['filename']))]
+    if len(fis) < 2:
+        return 0                        # Nothing to overlap.
+    _sl.info('%s: %d files, %d workers' % (me, len(fis), min(BACKFILL, len(fis))))
+    TXPRIO = xlogtx.BULK
+    nf = 0
+    settings = {k: globals()[k] for k in BFSETTINGS}
+    settings['BFPARENT'] = os.getpid()
+    pool = multiprocessing.get_context(BFCONTEXT).Pool(min(BACKFILL, len(fis)), 
+                _backfillInit, (settings,))
+    try:
+        for fi, spfn, n in pool.imap(_backfillWorker, fis):
+            try:
+                if FWTSTOP:
+                    break
+                _sl.info('%s  %s  %d orecs' % (_dt.ut2iso(_dt.locut()), fi['filename'], n))
+                with open(spfn, 'rb', buffering=1048576) as sf:
+                    orecs = []
+                    for x, orec in enumerate(binrec.readRecords(sf)):
+                        if DOTDIV and not (x % DOTDIV):
+                            _sw.iw('.')
+                        orecs.append(orec)
+                        if COLSINK:
+                            COLSINK.addOrec(binrec.decode(orec))
+                        if len(orecs) >= BATCH:
+                            emitOrecs(orecs)
+                            orecs = []
+                    emitOrecs(orecs)
+                _sw.nl()
+                # Sinks first, then 'processed'.
+                checkpoint(fi, fi['size'])
+                nf += 1
+                if COLSINK:
+                    COLSINK.tick()
+                if DONESD:
+                    doneWithFile(fi['inode'], fi['filename'])
+            finally:
+                try:  os.remove(spfn)
+                except:  pass
+        return nf
+    except Exception as E:
+        errmsg = '%s: %s @ %s' % (me, E, _m.tblineno())
+        DOSQUAWK(errmsg)
+        raise
+    finally:
+        pool.terminate()
+        pool.join()
+        # Spools of results never consumed.
+        for spfn in glob.glob(os.path.join(SPOOLD or tempfile.gettempdir(), 'nlmon-%d-*.spool' % os.getpid())):
+            try:  os.remove(spfn)
+            except:  pass
 
 #
 # dumpFI
@@ -971,6 +1695,8 @@ def dumpFI(sl, fi, pfx=''):
         sl('{}    static: {}'.format(pfx, fi.get('static')))
         sl('{}  filename: {}'.format(pfx, fi.get('filename')))
         sl('{}     extra: {}'.format(pfx, fi.get('extra')))
+        sl('{}uprocessed: {}'.format(pfx, fi.get('uprocessed')))
+        sl('{}held: {}'.format(pfx, fi.get('held')))
     except Exception as E:
         errmsg = 'dumpFI: E: %s' % E
         DOSQUAWK(errmsg)
@@ -1048,6 +1774,30 @@ def diffFIs(fi0, fi1):
              (fi0['extra']     != fi1['extra']    ) )
     #        (fi0['acquired']  != fi1['acquired'] ) or \    # 'acquired' not part of comparison.
 
+#
+# dbChanges: The FFWDB update (if any) for a current file info dict.
+#
+def dbChanges(fi, db_fi):
+    """Return the partial fi dict that updates db_fi from fi, or None."""
+    #       'inode'
+    #       'ae'
+    #       'acquired'
+    #       'processed'
+    if db_fi['modified'] != fi['modified'] or \
+       db_fi['size']     != fi['size'] or \
+       db_fi['static']   != fi['static'] or \
+       db_fi['filename'] != fi['filename'] or \
+       db_fi['extra']    != fi['extra']:
+        z = {}
+        z['inode']    = fi['inode']
+        z['acquired'] = fi['acquired']
+        z['modified'] = fi['modified']
+        z['size']     = fi['size']
+        z['static']   = fi['static']
+        z['extra']    = fi['extra']
+        return z
+    return None
+
 #
 # updateDB: Add to or update FFWDB, given a file info dict.
 #
@@ -1074,19 +1824,9 @@ def updateDB(fi):
             #       'ae'
             #       'acquired'
             #       'processed'
-            if db_fi['modified'] != fi['modified'] or \
-               db_fi['size']     != fi['size'] or \
-               db_fi['static']   != fi['static'] or \
-               db_fi['filename'] != fi['filename'] or \
-               db_fi['extra']    != fi['extra']:
+            z = dbChanges(fi, db_fi)
+            if z:
                 fi0 = copy.copy(db_fi)
-                z = {}
-                z['inode']    = fi['inode']
-                z['acquired'] = fi['acquired']
-                z['modified'] = fi['modified']
-                z['size']     = fi['size']
-                z['static']   = fi['static']
-                z['extra']    = fi['extra']
                 db_fi = FFWDB.update(z)
                 fi1 = copy.copy(db_fi)
                 z = None
@@ -1114,26 +1854,44 @@ FWTSTOP = False     # To signal a thread stop.
 FWTSTOPPED = False  # To acknowledge a thread stop.
 def watcherThread():                                                # !WT! 
     """A thread to watch WPATH for files to process."""
-    global FFWDB, FWTRUNNING, FWTSTOP, FWTSTOPPED
+    global FFWDB, DIRWATCH, DEDUP, FWTRUNNING, FWTSTOP, FWTSTOPPED
     me = 'FWT'
     _sl.info(me + ' starts')
     try:
         FWTRUNNING = True
 
         # Connect to FlatFileWatchDataBase.
-        FFWDB = ffwdb.FFWDB(FFWDBPFN)
+        if DBMEM:
+            FFWDB = ffwdb.FFWTable(FFWDBPFN, wal=DBWAL, synchronous=DBSYNC, delay=DBDELAY)
+        else:
+            FFWDB = ffwdb.FFWDB(FFWDBPFN, wal=DBWAL, synchronous=DBSYNC)
         # Initialize extra dict.
         ed = FFWDB.extra()
         if not ed:
             ed = FFWDB.extra({'nfiles': 0})
+        recoverDone()
+        # Drop resent records?
+        if DEDUPN:
+            DEDUP = dedup.DedupWindow(FFWDBPFN + '.dedup', DEDUPN)
+        # Watch WPATH for changes.
+        DIRWATCH = dirwatch.DirWatcher(WPATH, wanted=doFilename, pollmax=INTERVAL, inotify=INOTIFY)
+        _sl.info('%s: dirwatch: %s' % (me, DIRWATCH.mode))
         uu = 0                                                  # Unix Utc.
+        uufull = 0                                              # Last full scan.
+        busy = True                                             # Last cycle found work?
         while not FWTSTOP:
            
-            # Wait out INTERVAL.
+            # Wait for a WPATH change, but no longer than INTERVAL 
+            # (busy) or RESYNC (idle), and no less than CYCLEMIN.
             z = time.time()
-            w = INTERVAL - (z - uu)
+            w = CYCLEMIN - (z - uu)
             if w > 0:
                 _sw.wait(w)
+            w = (INTERVAL if busy else RESYNC) - (time.time() - uu)
+            if w > 0:
+                DIRWATCH.wait(w, stop=lambda: FWTSTOP)
+            if FWTSTOP:
+                break
             uu = _dt.utcut()
             ul = _dt.locut(uu)
             uuts = '%15.4f' % uu                                # 15.4, unblanked fraction.
@@ -1182,44 +1940,33 @@ def watcherThread():                                                # !WT!
             ####!!!
 
             #
-            # Get current file FIs.
+            # Get current file FIs: all of them (a full scan), or just
+            # those DIRWATCH says changed, and the inodes gone since.
             #
             1/1
             t0 = time.perf_counter();
-            c_fis = getFIs(uu)
-            c_fis_in = {c_fi['inode'   ]: c_fi for c_fi in c_fis}
-            c_fis_fn = {c_fi['filename']: c_fi for c_fi in c_fis}
+            db_fis_in = FFWDB.rows()                            # inode -> row.  (DBMEM: no copy.)
+            changed = DIRWATCH.changes()
+            if changed is None or uu - uufull >= RESYNC:
+                uufull = uu
+                c_fis = getFIs(uu)
+                gone = db_fis_in.keys() - INODE2FN.keys()
+            else:
+                c_fis, gone = changedFIs(uu, changed)
             t1 = time.perf_counter();
             if TIMINGS:
                 _sl.warning('   getFIs: {:9,.1f} ms'.format((1000*(t1-t0))))
             if DEBUG:
                 _sl.debug('%s  ## %d cfiles found' % (_dt.ut2iso(_dt.locut()), len(c_fis)))
 
-            #
-            # Get database file FIs.
-            #
-            1/1
-            t0 = time.perf_counter();
-            db_fis = FFWDB.all()
-            db_fis_in = {db_fi['inode'   ]: db_fi for db_fi in db_fis}
-            db_fis_fn = {db_fi['filename']: db_fi for db_fi in db_fis}
-            t1 = time.perf_counter();
-            if TIMINGS:
-                _sl.warning('FFWDB.all: {:9,.1f} ms'.format((1000*(t1-t0))))
-            if DEBUG:
-                _sl.debug('%s  ## %d dbfiles found' % (_dt.ut2iso(_dt.locut()), len(db_fis)))
-
             if True:
 
                 #
                 # Compare current vs database by inode.
                 #
                 1/1
-                c_ins = set([c_fi['inode'] for c_fi in c_fis])
-                db_ins = set([db_fi['inode'] for db_fi in db_fis])
-                db_drops_ins = list(db_ins - c_ins)
-                db_adds_ins = list(c_ins - db_ins)
-                db_same_ins = list(c_ins & db_ins)
+                db_drops_ins = [din for din in gone if din in db_fis_in]
+                db_adds_ins = [c_fi['inode'] for c_fi in c_fis if c_fi['inode'] not in db_fis_in]
                 #
                 if db_drops_ins:
                     _sl.extra()
@@ -1232,15 +1979,15 @@ def watcherThread():                                                # !WT!
                 if db_adds_ins:
                     _sl.extra()
                     _sl.extra('inoded adds...')
-                    for ain in db_adds_ins:
-                        _sl.extra()
-                        c_fi = c_fis_in[ain]
-                        dumpFI(_sl.extra, c_fi, 'ia: ')
+                    for c_fi in c_fis:
+                        if c_fi['inode'] not in db_fis_in:
+                            _sl.extra()
+                            dumpFI(_sl.extra, c_fi, 'ia: ')
                 # Compare common inodes.
                 db_upds = []
-                for sin in db_same_ins:
-                    c_fi, db_fi = c_fis_in[sin], db_fis_in[sin]
-                    if diffFIs(c_fi, db_fi):
+                for c_fi in c_fis:
+                    db_fi = db_fis_in.get(c_fi['inode'])
+                    if db_fi and diffFIs(c_fi, db_fi):
                         db_upds.append((c_fi, db_fi))
                 if db_upds:
                     ###---_sl.extra()
@@ -1251,43 +1998,11 @@ def watcherThread():                                                # !WT!
                         sl('inode updated: {} @ {}'.format(c_fi['inode'], _dt.ut2iso(_dt.utc2loc(c_fi['modified']), ' ')))
                         deltaFIs(sl, db_fi, c_fi, 'd: ', 'c: ')
 
-                #
-                # Compare current vs database by filename.
-                #
-                1/1
-                c_fns = set([c_fi['filename'] for c_fi in c_fis])
-                db_fns = set([db_fi['filename'] for db_fi in db_fis])
-                db_drops_fns = list(db_fns - c_fns)
-                db_adds_fns = list(c_fns - db_fns)
-                db_same_fns = list(c_fns & db_fns)
-                if db_drops_fns:
-                    _sl.extra()
-                    _sl.extra('filenamed drops...')
-                    for dfn in db_drops_fns:
-                        db_fi = db_fis_fn[dfn]
-                        _sl.extra()
-                        dumpFI(_sl.extra, db_fi, 'fd: ')
-                if db_adds_fns:
-                    _sl.extra()
-                    _sl.extra('filenamed adds...')
-                    for afn in db_adds_fns:
-                        c_fi = c_fis_fn[afn]
-                        _sl.extra()
-                        dumpFI(_sl.extra, c_fi, 'fa: ')
-                # Compare common filenames.
-                z_upds = []
-                for sfn in db_same_fns:
-                    c_fi, db_fi = c_fis_fn[sfn], db_fis_fn[sfn]
-                    if diffFIs(c_fi, db_fi):
-                        z_upds.append((c_fi, db_fi))
-                if z_upds:
-                    ###---_sl.extra()
-                    ###---_sl.extra('filenamed updates...')
-                    for c_fi, db_fi in z_upds:
-                        sl = _sl.extra if c_fi['static'] and db_fi['static'] else _sl.warning
-                        sl()
-                        sl('fname updated: {} @ {}'.format(c_fi['filename'], _dt.ut2iso(_dt.utc2loc(c_fi['modified']), ' ')))
-                        deltaFIs(sl, db_fi, c_fi, 'd: ', 'c: ')
+                # Anything changed?  If not, idle until DIRWATCH says so.
+                # (db_upds has every file exported from: a scanned FI's 
+                # 'processed' is 0.  dbChanges ignores 'processed'.)
+                busy = bool(db_drops_ins or db_adds_ins or 
+                            any(dbChanges(c_fi, db_fi) for c_fi, db_fi in db_upds))
 
             if False:
                 # Number of files different than DB?
@@ -1357,44 +2072,62 @@ def watcherThread():                                                # !WT!
                 ed['nfiles'] = len(dbinodes)
                 ed = FFWDB.extra(ed)
      
-            if True:
+            # All of a cycle's FFWDB changes in one transaction.
+            with FFWDB.cycle():
 
-                # Update DB (NEW).
-                1/1
-                t0 = time.perf_counter();
-                inodes = tuple(c_fi['inode'] for c_fi in c_fis)
-                FFWDB.acquired(inodes, uu)
-                for c_fi, db_fi in db_upds:
-                    z = updateDB(c_fi)
-                    c_fi, z = c_fi, z
-                t1 = time.perf_counter();
-                if TIMINGS:
-                    _sl.warning('updateDBs: {:9,.1f} ms'.format((1000*(t1-t0))))
+                if True:
 
-            if True:
+                    # Update DB (NEW).
+                    1/1
+                    t0 = time.perf_counter();
+                    inodes = tuple(c_fi['inode'] for c_fi in c_fis)
+                    FFWDB.acquired(inodes, uu)
+                    # Adds and updates, in bulk.
+                    upserts = [c_fi for c_fi in c_fis if c_fi['inode'] not in db_fis_in]
+                    for c_fi, db_fi in db_upds:
+                        z = dbChanges(c_fi, db_fi)
+                        if z:
+                            upserts.append(z)
+                    z = FFWDB.upsert_many(upserts)
+                    if DEBUG:
+                        for db_fi in z:
+                            _sl.debug('%s  ~~ db upsert:' %(_dt.ut2iso(_dt.locut())))
+                            dumpFI(_sl.debug, db_fi, 'u: ')
+                    t1 = time.perf_counter();
+                    if TIMINGS:
+                        _sl.warning('updateDBs: {:9,.1f} ms'.format((1000*(t1-t0))))
 
-                # Adds to DB (NEW).
-                1/1
-                for ain in db_adds_ins:
-                    c_fi = c_fis_in[ain]
-                    FFWDB.insert(c_fi)
+                if True:
 
-                # Drops from DB (NEW).
-                1/1
-                for din in db_drops_ins:
-                    FFWDB.delete(din)
+                    # Drops from DB (NEW).
+                    1/1
+                    FFWDB.delete_many(db_drops_ins)
+                    for din in db_drops_ins:
+                        dropGzIndex(din)
 
-            if True:
+                if True:
 
-                # Update ed['nfiles'].
-                1/1
-                db_ins = FFWDB.inodes()
-                ed['nfiles'] = len(db_ins)
-                ed = FFWDB.extra(ed)
+                    # Update ed['nfiles'] (if it's changed).
+                    1/1
+                    ed = FFWDB.extra()          # Fresh: doneWithFile keeps 'doneseq' there too.
+                    if ed.get('nfiles') != FFWDB.count():
+                        ed['nfiles'] = FFWDB.count()
+                        ed = FFWDB.extra(ed)
 
-            ###!!!
-            continue
-            ###!!!
+            # Watch only?
+            if not EXPORT:
+                continue
+
+            # Backfill several static files at once?
+            if BACKFILL > 1:
+                t0 = time.perf_counter();
+                nf = backfillFiles()
+                t1 = time.perf_counter();
+                if nf:
+                    busy = True
+                    if TIMINGS:
+                        _sl.warning(' backfill: {:9,.1f} ms'.format((1000*(t1-t0))))
+                    continue
 
             # Find the oldest unfinished file in DB.
             t0 = time.perf_counter();
@@ -1407,8 +2140,15 @@ def watcherThread():                                                # !WT!
             if not doFilename(db_fi['filename']):
                 continue
 
-            # Export the file.
-            exportFile(db_fi)
+            # Export the file, and prefetch the next.
+            z = FFWDB.unfinished()
+            nextfi = z[1] if len(z) > 1 and z[0]['inode'] == db_fi['inode'] else None
+            z = db_fi['processed']
+            exportFile(db_fi, nextfi)
+            if db_fi['processed'] != z:
+                busy = True                                     # More may follow.
+            if COLSINK:
+                COLSINK.tick()
 
             # Move logfile to DONESD?
             if DONESD and db_fi['static'] and db_fi['processed'] >= db_fi['size']:
@@ -1435,7 +2175,30 @@ def watcherThread():                                                # !WT!
     finally:
         if FWTSTOP:
             FWTSTOPPED = True
+        try:  DIRWATCH.close()
+        except:  pass
+        closePrefetch()
+        z = limiterStats()
+        if z:
+            _sl.info('%s: %s' % (me, z))
+        if OXLOG and OXLOG.nraw:
+            _sl.info('{}: oxlog sent {:,d} bytes for {:,d} bytes of records'.format(me, OXLOG.nbytes, OXLOG.nraw))
+        if UAS:
+            _sl.info('{}: interned {:,d} of {:,d} user agents'.format(me, UAS.nhits, UAS.nhits + UAS.nmisses))
+        if DEDUP:
+            _sl.info('%s: dedup dropped %d' % (me, DEDUP.ndropped))
+            DEDUP.close()
+            DEDUP = None
+        if COLSINK:
+            try:
+                COLSINK.close()
+                _sl.info('{}: colsink wrote {:,d} rows in {:,d} parts ({:,d} with bad values)'.format(
+                            me, COLSINK.nrows, COLSINK.nparts, COLSINK.nbad))
+            except Exception as E:
+                _sl.error('%s: colsink: %s' % (me, E))
         FFWDB.disconnect()
+        if getattr(FFWDB, 'nerrors', 0):
+            _sl.warning('%s: ffwdb writes retried %d times, last: %s' % (me, FFWDB.nerrors, FFWDB.lasterror))
         _sl.info('%s exits. STOPPED: %s' % (me, str(FWTSTOPPED)))
         FWTRUNNING = False
         1/1
@@ -1443,8 +2206,8 @@ def watcherThread():                                                # !WT!
 #
 # getFI
 #
-def getFI(fn, ts=None):
-    """Return a FileInfo dict for fn."""
+def getFI(fn, ts=None, de=None):
+    """Return a FileInfo dict for fn.  de: fn's os.DirEntry, if scanned."""
     me = 'getFI(%s)' % repr(fn)
     fi = None
     try:
@@ -1454,9 +2217,11 @@ def getFI(fn, ts=None):
             ae = 'e'
         else:
             return fi
-        pfn = os.path.normpath(WPATH + '/' + fn)
         try:
-            st    = os.stat(pfn)
+            if de is None:
+                st = os.stat(os.path.normpath(WPATH + '/' + fn))
+            else:
+                st = de.stat()      # One stat, cached on de (none on Windows).
             inode = st.st_ino
             size  = st.st_size
             mtime = st.st_mtime
@@ -1529,15 +2294,21 @@ def nullFI():
 def getFIs(ts):
     """Return a list of FileInfo dicts of current files."""
     me = 'getFIS'
+    global INODE2FN, FN2INODE
     fis = []
     try:
-        for filename in os.listdir(WPATH):
-            if not doFilename(filename):
-                continue
-            fi = getFI(filename, ts)
-            if not fi:
-                continue
-            fis.append(fi)
+        i2fn = {}
+        with os.scandir(WPATH) as it:
+            for de in it:
+                if not doFilename(de.name):
+                    continue
+                fi = getFI(de.name, ts, de)
+                if not fi:
+                    continue
+                fis.append(fi)
+                i2fn[fi['inode']] = fi['filename']
+        INODE2FN = i2fn             # Refreshed by a full scan.
+        FN2INODE = {v: k for k, v in i2fn.items()}
         return fis
     except Exception as E:
         ###---fis = None              # ??? Zap all?
@@ -1548,12 +2319,133 @@ def getFIs(ts):
         ###---return fis
         1/1
 
+#
+# changedFIs
+#
+def changedFIs(ts, changed):
+    """FileInfo dicts of the changed files (names, from DIRWATCH), and 
+    the inodes no longer in WPATH.  Updates INODE2FN (and FN2INODE) 
+    for just those names, so a cycle costs what changed, not all files."""
+    me = 'changedFIs'
+    fis, gone = [], set()
+    try:
+        fns = [fn for fn in changed if doFilename(fn)]
+        for fn in fns:
+            inode = FN2INODE.pop(fn, None)
+            if inode is not None and INODE2FN.get(inode) == fn:
+                del INODE2FN[inode]
+                gone.add(inode)
+        for fn in fns:
+            fi = getFI(fn, ts)
+            if not fi:
+                continue                # Gone, or renamed (then it's in changed as well).
+            fis.append(fi)
+            INODE2FN[fi['inode']] = fn
+            FN2INODE[fn] = fi['inode']
+        gone.difference_update(INODE2FN)    # Renamed, not gone.
+        return fis, gone
+    except Exception as E:
+        errmsg = '%s: %s @ %s' % (me, E, _m.tblineno())
+        DOSQUAWK(errmsg)
+        raise
+
+#
+# makeLimiter
+#
+def makeLimiter(recrate, byterate):
+    """A ratelimit.RateLimiter with TXBURST, or None if unthrottled."""
+    recrate = recrate if recrate and recrate > 0 else 0
+    byterate = byterate if byterate and byterate > 0 else 0
+    if not (recrate or byterate):
+        return None
+    return ratelimit.RateLimiter(recrate, byterate, 
+                recrate * TXBURST or None, byterate * TXBURST or None)
+
+#
+# limiterStats
+#
+def limiterStats():
+    """'sink: tokens & throttling' of the sinks' limiters, for logging."""
+    z = []
+    for name, sink in (('oxlog', OXLOG), ('ofile', OFILE)):
+        limiter = getattr(sink, 'limiter', None)
+        if limiter:
+            st = limiter.stats()
+            z.append('{}: rec tokens {}, byte tokens {}, throttled {:,.1f}s in {:,d} waits'.format(
+                        name, st['rectokens'], st['bytetokens'], st['throttled'], st['nthrottled']))
+    return '; '.join(z)
+
+#
+# makeCoder
+#
+def makeCoder():
+    """A binrec.DictCoder for a sink, if TXDICT (binary orecs only)."""
+    if not (TXDICT and OFORMAT == 'binary'):
+        return None
+    return binrec.DictCoder(TXDICT)
+
+#
+# openXFILE: XFILE -> OXLOG (host:port) or OFILE (dev/test pfn).
+#
+def openXFILE():
+    global OXLOG, OFILE
+    me = 'openXFILE'
+    OXLOG = OFILE = None
+    if not XFILE:
+        return
+    host, port = detectHP(XFILE)
+    if host and port:
+        try:
+            OXLOG = xlogtx.XLogBatcher((host, port), limiter=makeLimiter(TXRATE, TXBYTES),
+                        maxbytes=BATCHBYTES, maxcount=BATCHCOUNT, maxage=BATCHAGE, 
+                        nodelay=TCPNODELAY, sndbuf=SNDBUF, maxqueue=BATCHQUEUE,
+                        compress=TXCOMPRESS, level=TXLEVEL, coder=makeCoder())
+        except Exception as E:
+            errmsg = '%s: cannot create XLogBatcher: %s' % (me, E)
+            DOSQUAWK(errmsg)
+            raise
+    else:
+        try:
+            opfn = XFILE
+            OFILE = ofwriter.OFWriter(opfn, encoding=ENCODING, errors=ERRORS, 
+                        blocksize=OFBLOCK, interval=OFINTERVAL, 
+                        durability=OFDURABLE, fsyncmb=OFFSYNCMB, 
+                        limiter=makeLimiter(OFRATE, OFBYTES),
+                        framing='length' if OFORMAT == 'binary' else 'line',
+                        coder=makeCoder())
+        except Exception as E:
+            errmsg = '%s: cannot open output file %s: %s' % (me, opfn, E)
+            DOSQUAWK(errmsg)
+            raise
+
+#
+# openCOLSINK: COLPATH -> COLSINK, if numpy's there.
+#
+def openCOLSINK():
+    global COLSINK
+    me = 'openCOLSINK'
+    COLSINK = None
+    if not COLPATH:
+        return
+    if not colsink.available():
+        _sl.error('%s: numpy is not available, no columnar export to %s' % (me, COLPATH))
+        return
+    try:
+        COLSINK = colsink.ColumnarSink(COLPATH)
+    except Exception as E:
+        errmsg = '%s: cannot create ColumnarSink: %s' % (me, E)
+        DOSQUAWK(errmsg)
+        raise
+
 #
 # maininits
 #
 def maininits():
     global gRPFN, gRFILE
-    global WPATH, INTERVAL
+    global WPATH, INTERVAL, XFILE, TXRATE, TXBYTES, TXBURST, TXCOMPRESS, OFORMAT
+    global COLPATH, TXDICT, INTERNN
+    global BACKFILL, BATCH, DEDUPN, MMAP, GZINDEX, CKPTLINES, CKPTBYTES, CKPTSECS
+    global OFDURABLE, OFBLOCK, DBMEM, DBDELAY, DBSYNC
     me = 'maininits'
     _sl.info(me)
     try:
@@ -1567,6 +2459,31 @@ def maininits():
 
         WPATH = _a.argString('wpath', 'watched path', WPATH)
         INTERVAL = _a.argFloat('interval', 'cylce interval', INTERVAL)
+        XFILE = _a.argString('ofile', 'xlog host:port or output pfn', XFILE)
+        TXRATE = _a.argFloat('txrate', 'max orecs per sec', TXRATE)
+        TXBYTES = _a.argFloat('txbytes', 'max bytes per sec', TXBYTES)
+        TXBURST = _a.argFloat('txburst', 'burst, in seconds of txrate/txbytes', TXBURST)
+        TXCOMPRESS = _a.argString('txcompress', 'oxlog compression: batch or stream', TXCOMPRESS)
+        OFORMAT = _a.argString('oformat', 'orec format: json or binary', OFORMAT)
+        TXDICT = int(_a.argFloat('txdict', 'dictionary ids for binary orecs', TXDICT) or 0)
+        COLPATH = _a.argString('colpath', 'columnar export folder', COLPATH)
+        INTERNN = int(_a.argFloat('internn', 'intern table size', INTERNN) or 0)
+        BACKFILL = int(_a.argFloat('backfill', 'backfill process pool size', BACKFILL) or 0)
+        BATCH = max(1, int(_a.argFloat('batch', 'logrecs per batch', BATCH) or 0))
+        DEDUPN = int(_a.argFloat('dedupn', 'sent records remembered, to drop resends', DEDUPN) or 0)
+        MMAP = bool(_a.argFloat('mmap', 'mmap static files (0/1)', MMAP))
+        GZINDEX = int(_a.argFloat('gzindex', '.gz access point spacing', GZINDEX) or 0)
+        CKPTLINES = int(_a.argFloat('ckptlines', 'checkpoint every this many lines', CKPTLINES) or 0)
+        CKPTBYTES = int(_a.argFloat('ckptbytes', 'checkpoint every this many bytes', CKPTBYTES) or 0)
+        CKPTSECS = _a.argFloat('ckptsecs', 'checkpoint every this many seconds', CKPTSECS)
+        OFDURABLE = _a.argString('ofdurable', 'ofile durability: none, flush or fsync', OFDURABLE)
+        OFBLOCK = int(_a.argFloat('ofblock', 'ofile write block size', OFBLOCK) or 0)
+        DBMEM = bool(_a.argFloat('dbmem', 'in-memory ffwdb table (0/1)', DBMEM))
+        DBDELAY = _a.argFloat('dbdelay', 'ffwdb write-behind interval', DBDELAY)
+        DBSYNC = _a.argString('dbsync', 'ffwdb synchronous: off, normal, full or extra', DBSYNC)
+        makeInterns()
+        openXFILE()
+        openCOLSINK()
 
     except Exception as E:
         errmsg = '{}: {} @ {}'.format(me, E, _m.tblineno())
@@ -1587,6 +2504,24 @@ def main():
         _sl.info()
         _sl.info('    wpath: ' + WPATH)
         _sl.info(' interval: ' + str(INTERVAL))
+        _sl.info('    ofile: ' + str(XFILE))
+        _sl.info('   txrate: ' + str(TXRATE))
+        _sl.info('  txbytes: ' + str(TXBYTES))
+        _sl.info('  txburst: ' + str(TXBURST))
+        _sl.info('txcompress: ' + str(TXCOMPRESS))
+        _sl.info('  oformat: ' + str(OFORMAT))
+        _sl.info('   txdict: ' + str(TXDICT))
+        _sl.info('  colpath: ' + str(COLPATH))
+        _sl.info('  internn: ' + str(INTERNN))
+        _sl.info(' backfill: ' + str(BACKFILL))
+        _sl.info('    batch: ' + str(BATCH))
+        _sl.info('   dedupn: ' + str(DEDUPN))
+        _sl.info('     mmap: ' + str(MMAP))
+        _sl.info('  gzindex: ' + str(GZINDEX))
+        _sl.info('     ckpt: {} lines, {} bytes, {} secs'.format(CKPTLINES, CKPTBYTES, CKPTSECS))
+        _sl.info('ofdurable: ' + str(OFDURABLE))
+        _sl.info('  ofblock: ' + str(OFBLOCK))
+        _sl.info('    dbmem: {} (delay {}, sync {})'.format(DBMEM, DBDELAY, DBSYNC))
         _sl.info()
 
         # FFW DB PFN.  DB creation must be done in watcherThread.
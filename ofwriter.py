@@ -0,0 +1,185 @@
+
+# *** NL2XLOG version ***
+
+# Buffered, group-committed flat file sink for orecs (OFILE).
+# Orecs are encoded into a large byte block, which is written out
+#   when full or when it gets old, rather than one text-layer write
+#   per orec.  An ager thread writes out a block that's got old with
+#   no further writes.
+# commit() is the durability point.  The caller makes it just before
+#   checkpointing 'processed' in FFWDB, so a crash can lose or repeat
+#   at most what came after the last commit.
+#
+# Durability policies:
+#   'none'   commit() does nothing; blocks go out when full or old.
+#   'flush'  commit() writes the block to the OS.
+#   'fsync'  as 'flush', plus fsync at commit() and every fsyncmb MB.
+#
+# An optional ratelimit.RateLimiter paces block writes by orecs and bytes.
+#
+# Framing: 'line' (orec + newline) or 'length' (4-byte length + orec,
+#   for binrec's binary orecs).
+# An optional coder (binrec.DictCoder) dictionary codes the orecs for
+#   this session, which starts with its reset() record.
+
+import os, time, struct, threading
+from l_misc import tblineno
+
+DURABILITIES = ('none', 'flush', 'fsync')
+FRAMINGS = ('line', 'length')
+RLEN = struct.Struct('!I')          # 'length' framing: as binrec.RLEN.
+
+
+class OFWriter():
+
+    def __init__(self, pfn, encoding='utf-8', errors='strict', blocksize=1048576,
+                 interval=1.0, durability='flush', fsyncmb=64, limiter=None, framing='line', 
+                 coder=None):
+        if durability not in DURABILITIES:
+            raise ValueError('OFWriter: bad durability: %s' % repr(durability))
+        if framing not in FRAMINGS:
+            raise ValueError('OFWriter: bad framing: %s' % repr(framing))
+        self.framing = framing
+        self.pfn = pfn
+        self.encoding = encoding
+        self.errors = errors
+        self.blocksize = blocksize      # Write out at this many bytes,
+        self.interval = interval        #   or when the block is this old (seconds).
+        self.durability = durability
+        self.fsyncn = int(fsyncmb * 1048576)
+        self.limiter = limiter
+        self.coder = coder              # Has reset() and code(orec).  None: orecs as written.
+        self.block = bytearray()
+        self.nblock = 0                 # Orecs in the block.
+        self.t0 = None                  # When the block got its first orec.
+        self.nsynced = 0                # Bytes written since the last fsync.
+        self.lock = threading.RLock()
+        self.stop = threading.Event()
+        try:
+            self.fd = os.open(pfn, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        except Exception as E:
+            errmsg = 'OFWriter: %s: %s @ %s' % (pfn, E, tblineno())
+            raise RuntimeError(errmsg)
+        if coder:
+            self.write(coder.reset())
+        self.ager = None
+        if interval > 0:
+            self.ager = threading.Thread(target=self._ager, daemon=True)
+            self.ager.start()
+
+    def _ager(self):
+        while not self.stop.wait(self.interval / 2):
+            try:
+                with self.lock:
+                    if self.t0 and (time.time() - self.t0) >= self.interval:
+                        self._writeout()
+            except Exception:
+                pass                    # The next write()/flush() will raise it for the caller.
+
+    def write(self, orec):
+        """Buffer one orec (str or bytes), newline terminated or length prefixed."""
+        if type(orec) is str:
+            orec = orec.encode(self.encoding, self.errors)
+        with self.lock:
+            if self.coder:
+                orec = self.coder.code(orec)
+            if not self.block:
+                self.t0 = time.time()
+            if self.framing == 'line':
+                self.block += orec
+                self.block += b'\n'
+            else:
+                self.block += RLEN.pack(len(orec))
+                self.block += orec
+            self.nblock += 1
+            if len(self.block) >= self.blocksize or (time.time() - self.t0) >= self.interval:
+                self._writeout()
+
+    def writeMany(self, orecs):
+        """Buffer a list of orecs, as write() each.  Write out is checked once, after."""
+        if not orecs:
+            return
+        with self.lock:
+            if not self.block:
+                self.t0 = time.time()
+            block, encoding, errors, coder = self.block, self.encoding, self.errors, self.coder
+            line = (self.framing == 'line')
+            for orec in orecs:
+                if type(orec) is str:
+                    orec = orec.encode(encoding, errors)
+                if coder:
+                    orec = coder.code(orec)
+                if line:
+                    block += orec
+                    block += b'\n'
+                else:
+                    block += RLEN.pack(len(orec))
+                    block += orec
+            self.nblock += len(orecs)
+            if len(block) >= self.blocksize or (time.time() - self.t0) >= self.interval:
+                self._writeout()
+
+    def _writeout(self):
+        # Caller holds self.lock.
+        try:
+            if self.limiter:
+                self.limiter.acquire(self.nblock, len(self.block))
+            n = 0
+            try:
+                with memoryview(self.block) as z:
+                    while n < len(z):
+                        n += os.write(self.fd, z[n:])
+            finally:
+                if n < len(self.block):
+                    # Failed part way: a retry writes only the rest.  (A copy:
+                    # a slice of the view may live on in the traceback.)
+                    self.block = self.block[n:]
+                    self.nsynced += n
+            self.nsynced += len(self.block)
+            self.block = bytearray()
+            self.nblock = 0
+            self.t0 = None
+            if self.durability == 'fsync' and self.nsynced >= self.fsyncn:
+                self._fsync()
+        except Exception as E:
+            errmsg = 'OFWriter.write: %s @ %s' % (E, tblineno())
+            raise RuntimeError(errmsg)
+
+    def _fsync(self):
+        os.fsync(self.fd)
+        self.nsynced = 0
+
+    def commit(self):
+        """Make what's been written durable, per policy."""
+        if self.durability == 'none':
+            return
+        with self.lock:
+            if self.block:
+                self._writeout()
+            if self.durability == 'fsync' and self.nsynced:
+                try:
+                    self._fsync()
+                except Exception as E:
+                    errmsg = 'OFWriter.commit: %s @ %s' % (E, tblineno())
+                    raise RuntimeError(errmsg)
+
+    def pending(self):
+        """Orecs buffered, not yet written out?"""
+        return bool(self.block)
+
+    def flush(self):
+        with self.lock:
+            if self.block:
+                self._writeout()
+
+    def close(self):
+        self.stop.set()
+        if self.ager:
+            self.ager.join()
+        try:
+            self.flush()
+            if self.durability == 'fsync':
+                self._fsync()
+        finally:
+            try:  os.close(self.fd)
+            except:  pass
@@ -0,0 +1,70 @@
+
+# *** NL2XLOG version ***
+
+# Token bucket rate limiting for the sinks (OXLOG, OFILE).
+# TokenBucket: 'rate' tokens/sec accrue, up to 'burst', so idle time
+#   banks a burst instead of being lost.  A take bigger than what's
+#   there goes into debt, and the taker waits out the debt.
+# RateLimiter: a records/sec and a bytes/sec bucket (either may be
+#   off), and how long it has throttled its caller, for observing.
+
+import threading, time
+
+BURST = 1.0                     # Default burst: this many seconds' worth of rate.
+
+
+class TokenBucket():
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate                # Tokens/sec.
+        self.burst = burst if burst else rate * BURST
+        self.tokens = self.burst
+        self.t = time.monotonic()
+
+    def _refill(self):
+        t = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (t - self.t) * self.rate)
+        self.t = t
+
+    def take(self, n):
+        """Take n tokens.  Returns seconds to wait before going ahead."""
+        self._refill()
+        self.tokens -= n
+        return -self.tokens / self.rate if self.tokens < 0 else 0
+
+    def level(self):
+        self._refill()
+        return self.tokens
+
+
+class RateLimiter():
+
+    def __init__(self, recrate=0, byterate=0, recburst=None, byteburst=None):
+        self.recs = TokenBucket(recrate, recburst) if recrate else None
+        self.bytes = TokenBucket(byterate, byteburst) if byterate else None
+        self.lock = threading.Lock()
+        self.throttled = 0.0            # Total seconds waited.
+        self.nthrottled = 0             # Times waited.
+
+    def acquire(self, nrecs, nbytes):
+        """Wait until nrecs records of nbytes bytes may go."""
+        with self.lock:
+            w = 0
+            if self.recs:
+                w = max(w, self.recs.take(nrecs))
+            if self.bytes:
+                w = max(w, self.bytes.take(nbytes))
+            if w:
+                self.throttled += w
+                self.nthrottled += 1
+        if w:
+            time.sleep(w)
+        return w
+
+    def stats(self):
+        """Current tokens and throttling so far."""
+        with self.lock:
+            return {'rectokens': self.recs.level() if self.recs else None,
+                    'bytetokens': self.bytes.level() if self.bytes else None,
+                    'throttled': self.throttled,
+                    'nthrottled': self.nthrottled}
@@ -0,0 +1,368 @@
+
+# *** NL2XLOG version ***
+
+# Block-oriented logfile readers for exportFile.
+#
+# GzBlockReader: a thread inflates a .gz file (zlib, which releases
+#   the GIL) in large chunks into a bounded queue of line blocks, so
+#   inflating overlaps with parsing/exporting on the caller's thread.
+#   Blocks are bytes ending at a b'\n' (but maybe the last one).
+#
+# GzIndexReader: as GzBlockReader, but inflates with libz itself 
+#   (ctypes), zran style, so it can start at an access point: a 
+#   deflate block boundary (compressed offset and bits), its 
+#   uncompressed offset and the 32K of output before it.  While
+#   reading, it appends a new access point to an index file every
+#   'spacing' uncompressed bytes.  A resumed export then starts at the
+#   last point before what it had done, instead of at byte 0.
+#   Needs libz (libz()); else use GzBlockReader.
+#
+# MmapLineReader: lines of an uncompressed (static) file, from a byte
+#   offset, via an mmap of it.  Lines are found a large block at a
+#   time, and an all-ASCII block (the usual) is decoded in one go,
+#   rather than a read, a bytes object and a decode per line.
+
+import os, mmap, struct, threading, queue, zlib
+import itertools, operator
+import ctypes, ctypes.util
+from l_misc import tblineno
+
+CHUNK = 1048576                 # Compressed bytes read per inflate.
+BLOCK = 1048576                 # Mapped bytes split into lines at a time.
+DEPTH = 8                       # Max line blocks queued.
+SPACING = 4 * 1048576           # Uncompressed bytes between access points.
+TRUNCATED = 'Compressed file ended before the end-of-stream marker was reached'
+
+
+class GzBlockReader():
+
+    start = 0                           # Uncompressed offset of the first block.
+
+    def __init__(self, pfn, chunk=CHUNK, depth=DEPTH):
+        self.pfn = pfn
+        self.chunk = chunk
+        self.q = queue.Queue(maxsize=depth)
+        self.stop = False
+        self.f = open(pfn, 'rb')
+        self.t = threading.Thread(target=self._inflater, daemon=True)
+        self.t.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _put(self, z):
+        # Block while the queue is full, unless told to stop.
+        while not self.stop:
+            try:
+                self.q.put(z, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _inflater(self):
+        try:
+            d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            fresh = False               # d is for a further member, not yet fed.
+            pending = False             # d is fed, and not at its end of stream.
+            tail = b''
+            while not self.stop:
+                z = self.f.read(self.chunk)
+                if not z:
+                    if pending:
+                        raise EOFError(TRUNCATED)
+                    break
+                while z:
+                    if fresh and not z.strip(b'\0'):
+                        break           # Trailing zero padding.
+                    fresh = False
+                    y = d.decompress(z)
+                    z = b''
+                    pending = True
+                    if d.eof:
+                        # Next gzip member, if any.
+                        z = d.unused_data
+                        d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                        fresh = True
+                        pending = False
+                    if y:
+                        y = tail + y
+                        x = y.rfind(b'\n') + 1
+                        tail = y[x:]
+                        if x and not self._put(y[:x]):
+                            return
+            if tail:
+                self._put(tail)
+            self._put(None)             # EOF.
+        except Exception as E:
+            errmsg = 'GzBlockReader: %s: %s @ %s' % (self.pfn, E, tblineno())
+            self._put(RuntimeError(errmsg))
+
+    def blocks(self):
+        """Yield line blocks until EOF.  Raises what the inflater raised."""
+        while True:
+            z = self.q.get()
+            if z is None:
+                return
+            if isinstance(z, Exception):
+                raise z
+            yield z
+
+    def close(self):
+        self.stop = True
+        self.t.join()
+        try:  self.f.close()
+        except:  pass
+
+
+def blockLines(block):
+    """Lines (b'\n' stripped) of a line block."""
+    z = block.split(b'\n')
+    if not z[-1]:
+        z.pop()
+    return z
+
+
+class MmapLineReader():
+
+    def __init__(self, pfn, start=0):
+        self.pfn = pfn
+        self.start = start
+        self.m = None
+        self.f = open(pfn, 'rb')
+        try:
+            self.size = os.fstat(self.f.fileno()).st_size
+            if self.size > start:
+                self.m = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+                if hasattr(self.m, 'madvise'):
+                    self.m.madvise(mmap.MADV_SEQUENTIAL)
+        except Exception as E:
+            self.close()
+            errmsg = 'MmapLineReader: %s: %s @ %s' % (pfn, E, tblineno())
+            raise RuntimeError(errmsg)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def lines(self, encoding='utf-8', errors='strict', block=BLOCK):
+        """Yield (line, end) from start: line decoded, without its '\\n', end the offset after it."""
+        m = self.m
+        if m is None:
+            return
+        x, n = self.start, self.size
+        while x < n:
+            # A block of whole lines (but maybe the last one).
+            y = x + block
+            if y < n:
+                z = m.rfind(b'\n', x, y)
+                if z < 0:
+                    z = m.find(b'\n', y)       # A line longer than block.
+                y = z + 1 if z >= 0 else n
+            else:
+                y = n
+            z = m[x:y]
+            if z.isascii():
+                # One decode, and str lengths are byte lengths.
+                lines = z.decode('ascii').split('\n')
+                lens = None
+            else:
+                lines = z.split(b'\n')
+                lens = [len(zz) for zz in lines]
+                lines = [zz.decode(encoding, errors) for zz in lines]
+            if z.endswith(b'\n'):
+                lines.pop()
+            # Line ends, summed in C.
+            ends = list(itertools.accumulate(map(operator.add, lens or map(len, lines), itertools.repeat(1)), initial=x))
+            del ends[0]
+            if not z.endswith(b'\n'):
+                ends[-1] = y                # Unterminated last line.
+            yield from zip(lines, ends)
+            x = y
+
+    def close(self):
+        if self.m is not None:
+            self.m.close()
+            self.m = None
+        try:  self.f.close()
+        except:  pass
+
+
+#
+# libz, for GzIndexReader.
+#
+
+Z_OK, Z_STREAM_END, Z_BUF_ERROR, Z_BLOCK = 0, 1, -5, 5
+WINSIZE = 32768                 # Deflate window.
+OUTSIZE = 262144                # Inflate output buffer.
+
+class _ZStream(ctypes.Structure):
+    _fields_ = [('next_in', ctypes.c_void_p), ('avail_in', ctypes.c_uint), ('total_in', ctypes.c_ulong),
+                ('next_out', ctypes.c_void_p), ('avail_out', ctypes.c_uint), ('total_out', ctypes.c_ulong),
+                ('msg', ctypes.c_char_p), ('state', ctypes.c_void_p),
+                ('zalloc', ctypes.c_void_p), ('zfree', ctypes.c_void_p), ('opaque', ctypes.c_void_p),
+                ('data_type', ctypes.c_int), ('adler', ctypes.c_ulong), ('reserved', ctypes.c_ulong)]
+
+_LIBZ = []                      # [libz CDLL or None], once looked for.
+
+def libz():
+    """libz via ctypes, or None if it can't be loaded."""
+    if not _LIBZ:
+        try:
+            z = ctypes.CDLL(ctypes.util.find_library('z') or 'libz.so.1')
+            z.zlibVersion.restype = ctypes.c_char_p
+            z.zlibVersion()
+            _LIBZ.append(z)
+        except Exception:
+            _LIBZ.append(None)
+    return _LIBZ[0]
+
+
+#
+# Index file: header (IMAGIC, .gz size, .gz mtime_ns), then access
+# points: IPOINT (compressed offset, uncompressed offset, bits, 
+# length) + that many bytes of zlib'd window.
+#
+
+IMAGIC = b'NLGZI1'
+IHEADER = struct.Struct('!6sQQ')
+IPOINT = struct.Struct('!QQBI')
+
+def loadGzIndex(pfn, ipfn):
+    """Access points [(coff, bits, uoff, window), ...] in ipfn for pfn.  [] if none or stale."""
+    try:
+        with open(ipfn, 'rb') as f:
+            z = f.read()
+    except FileNotFoundError:
+        return []
+    st = os.stat(pfn)
+    if len(z) < IHEADER.size or IHEADER.unpack_from(z) != (IMAGIC, st.st_size, st.st_mtime_ns):
+        return []                       # Another file (reused inode?) or torn.
+    points = []
+    x = IHEADER.size
+    while x + IPOINT.size <= len(z):
+        coff, uoff, bits, n = IPOINT.unpack_from(z, x)
+        x += IPOINT.size
+        if x + n > len(z):
+            break                       # Torn last point.
+        points.append((coff, bits, uoff, zlib.decompress(z[x:x+n])))
+        x += n
+    return points
+
+
+class GzIndexReader(GzBlockReader):
+
+    def __init__(self, pfn, ipfn, skip=0, spacing=SPACING, chunk=CHUNK, depth=DEPTH):
+        self.ipfn = ipfn                # Index file.
+        self.spacing = spacing
+        points = loadGzIndex(pfn, ipfn)
+        self.point = None               # Where to start.
+        for p in points:
+            if p[2] <= skip:
+                self.point = p
+        self.start = self.point[2] if self.point else 0
+        self.last = points[-1][2] if points else 0      # Uncompressed offset of the last point.
+        if not points:
+            st = os.stat(pfn)
+            with open(ipfn, 'wb') as f:
+                f.write(IHEADER.pack(IMAGIC, st.st_size, st.st_mtime_ns))
+        super().__init__(pfn, chunk, depth)
+
+    def _point(self, coff, bits, uoff, window):
+        # Append an access point to the index.
+        z = zlib.compress(window)
+        with open(self.ipfn, 'ab') as f:
+            f.write(IPOINT.pack(coff, uoff, bits, len(z)) + z)
+        self.last = uoff
+
+    def _inflater(self):
+        z = libz()
+        strm = _ZStream()
+        ps = ctypes.byref(strm)
+        ver = z.zlibVersion()
+        try:
+            # Start at the access point (raw deflate), or at SOF (gzip).
+            if self.point:
+                coff, bits, uoff, window = self.point
+                self.f.seek(coff - (1 if bits else 0))
+                if z.inflateInit2_(ps, -15, ver, ctypes.sizeof(strm)) != Z_OK:
+                    raise RuntimeError('inflateInit2 failed')
+                if bits:
+                    z.inflatePrime(ps, bits, self.f.read(1)[0] >> (8 - bits))
+                z.inflateSetDictionary(ps, window, len(window))
+                raw = True
+            else:
+                coff, uoff, window = 0, 0, b''
+                if z.inflateInit2_(ps, 31, ver, ctypes.sizeof(strm)) != Z_OK:
+                    raise RuntimeError('inflateInit2 failed')
+                raw = False
+            due = self.last + self.spacing
+            outbuf = ctypes.create_string_buffer(OUTSIZE)
+            trailer = 0                 # Bytes of gzip trailer to skip (after a raw member end).
+            between = False             # At a member end: another member or the end?
+            done = False
+            tail = b''
+            while not (self.stop or done):
+                data = self.f.read(self.chunk)
+                if not data:
+                    # Mid-member (or its trailer), unless nothing's been read.
+                    if trailer or not (between or coff == 0):
+                        raise EOFError(TRUNCATED)
+                    break
+                inbuf = ctypes.create_string_buffer(data, len(data))
+                strm.next_in = ctypes.addressof(inbuf)
+                strm.avail_in = len(data)
+                while strm.avail_in and not self.stop:
+                    if trailer:
+                        n = min(trailer, strm.avail_in)
+                        strm.next_in += n
+                        strm.avail_in -= n
+                        coff += n
+                        trailer -= n
+                        continue
+                    if between:
+                        if ctypes.string_at(strm.next_in, 1) != b'\x1f':
+                            done = True # Trailing zero padding (or junk).
+                            break
+                        between = False
+                    strm.next_out = ctypes.addressof(outbuf)
+                    strm.avail_out = OUTSIZE
+                    n = strm.avail_in
+                    rc = z.inflate(ps, Z_BLOCK)
+                    if rc not in (Z_OK, Z_STREAM_END, Z_BUF_ERROR):
+                        raise RuntimeError('inflate: %d %s' % (rc, strm.msg))
+                    coff += n - strm.avail_in
+                    n = OUTSIZE - strm.avail_out
+                    y = ctypes.string_at(outbuf, n) if n else b''
+                    uoff += n
+                    if y:
+                        window = (window + y)[-WINSIZE:]
+                    if rc == Z_STREAM_END:
+                        # Next gzip member, if any.
+                        if raw:
+                            trailer = 8
+                        z.inflateReset2(ps, 31)
+                        raw = False
+                        between = True
+                    elif (strm.data_type & 128) and not (strm.data_type & 64) and uoff >= due:
+                        self._point(coff, strm.data_type & 7, uoff, window)
+                        due = uoff + self.spacing
+                    if y:
+                        y = tail + y
+                        x = y.rfind(b'\n') + 1
+                        tail = y[x:]
+                        if x and not self._put(y[:x]):
+                            return
+            if tail:
+                self._put(tail)
+            self._put(None)             # EOF.
+        except Exception as E:
+            errmsg = 'GzIndexReader: %s: %s @ %s' % (self.pfn, E, tblineno())
+            self._put(RuntimeError(errmsg))
+        finally:
+            z.inflateEnd(ps)
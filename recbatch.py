@@ -0,0 +1,78 @@
+
+# *** NL2XLOG version ***
+
+# Batches of records, flowing between the export stages.
+# A RecordBatch holds up to 'capacity' logrecs of one ae, and what the
+#   stages make of them, column by column: ints in arrays, strings in
+#   lists.  Each stage does a whole batch per call (nlmon):
+#     parseBatch   logrecs -> field columns (unparseable rows dropped)
+#     genBatch     field columns -> orecs, vrecs
+#     emitBatch    orecs -> the sinks (sendMany, writeMany)
+#   so the per call and per stage overheads are paid per batch, and
+#   per batch constants (eg, _el, _id JSON) are made once.
+
+import array
+from l_misc import tblineno
+
+CAPACITY = 2048                 # Logrecs per batch.
+
+# Field columns, in order, by ae.  Ints are array('q') columns (lists
+#   in a batch with one that won't fit).
+ACCESS = ('remote_addr', 'remote_user', 'request', 'time_local', 'time_utc',
+          'status', 'body_bytes_sent', 'http_referer', 'http_user_agent')
+ACCESSINTS = ('time_utc', 'status', 'body_bytes_sent')
+ERROR = ('time_local', 'time_utc', 'status', 'stuff', 'remote_addr', 'request', 'server')
+ERRORINTS = ('time_utc',)
+
+
+class RecordBatch():
+
+    __slots__ = ('ae', 'capacity', 'names', 'ints', 'logrecs', 'offsets', 'orecs', 'vrecs',
+                 'remote_addr', 'remote_user', 'request', 'time_local', 'time_utc', 'status',
+                 'body_bytes_sent', 'http_referer', 'http_user_agent', 'stuff', 'server')
+
+    def __init__(self, ae, capacity=CAPACITY):
+        if ae not in ('a', 'e'):
+            raise ValueError('RecordBatch: bad ae: %s' % repr(ae))
+        self.ae = ae
+        self.capacity = capacity
+        self.names = ACCESS if ae == 'a' else ERROR
+        self.ints = ACCESSINTS if ae == 'a' else ERRORINTS
+        for name in set(ACCESS + ERROR) - set(self.names):
+            setattr(self, name, None)
+        self.clear()
+
+    def clear(self):
+        """Empty, for the next batch."""
+        self.logrecs = []               # str.
+        self.offsets = array.array('q') # Byte offsets of logrecs in their file, -1: none.
+        self.orecs = []                 # str or bytes.
+        self.vrecs = []                 # Screen text (TXTLEN), or empty.
+        for name in self.names:
+            setattr(self, name, array.array('q') if name in self.ints else [])
+
+    def add(self, logrec, offset=-1):
+        """Add a logrec.  True if the batch is now full."""
+        self.logrecs.append(logrec)
+        self.offsets.append(offset)
+        return len(self.logrecs) >= self.capacity
+
+    def __len__(self):
+        return len(self.logrecs)
+
+    def setRows(self, rows):
+        """Set the field columns from rows (tuples, in self.names order)."""
+        try:
+            cols = tuple(zip(*rows)) if rows else ((),) * len(self.names)
+            for name, col in zip(self.names, cols):
+                if name in self.ints:
+                    try:
+                        col = array.array('q', col)
+                    except OverflowError:
+                        col = list(col)     # Ints past 64 bits (eg, a mangled body_bytes_sent).
+                else:
+                    col = list(col)
+                setattr(self, name, col)
+        except Exception as E:
+            errmsg = 'RecordBatch.setRows: %s @ %s' % (E, tblineno())
+            raise RuntimeError(errmsg)
@@ -0,0 +1,8 @@
+
+# *** NL2XLOG version ***
+
+# The modules are top level, beside tests/.
+
+import os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
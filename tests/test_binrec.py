@@ -0,0 +1,93 @@
+
+# *** NL2XLOG version ***
+
+# binrec: binary orecs, and their dictionary coding.
+
+import io, json
+import pytest
+
+import binrec
+
+
+def access(x, ua='Mozilla/5.0 (X11; Linux x86_64)', ra='10.1.2.3'):
+    return binrec.encodeAccess('0', 'TEST', 'test', 'a', 100 + x, 'http://example.com/%d' % (x % 2), 
+                               ua, ra, None, 'GET /%d HTTP/1.1' % x, 200, 
+                               '[03/Aug/2015:12:53:06 -0700]', 1438631586 + x)
+
+def test_dict_round_trip():
+    # Coded with ids recycled (6 strings, 5 ids), expanded back to the plain orecs.
+    recs = [access(x, ua='agent %d' % (x % 3), ra=('::1' if x % 4 else '10.0.0.1')) for x in range(40)]
+    recs.insert(5, binrec.encodeError('0', 'TEST', 'test', 'e', '[error]', 'stuff', 't', 1))
+    c, d = binrec.DictCoder(5), binrec.DictDecoder()
+    coded = [c.code(z) for z in [c.reset()] + recs]
+    assert c.nrefs > 0
+    assert sum(map(len, coded)) < sum(map(len, recs))
+    z = [d.expand(rec) for rec in coded]
+    assert z[0] is None and z[1:] == recs
+
+def test_dict_reset():
+    # After a reset both ends start over: the first use is a definition.
+    c, d = binrec.DictCoder(), binrec.DictDecoder()
+    a = access(1)
+    d.expand(c.code(c.reset()))
+    d.expand(c.code(a))
+    assert d.expand(c.code(a)) == a
+    z = c.code(c.reset())
+    assert d.expand(z) is None and d.strs == {}
+    assert d.expand(c.code(a)) == a
+
+def test_short_and_none_not_coded():
+    c = binrec.DictCoder()
+    a = binrec.encodeAccess('0', 'TEST', 'test', 'a', 1, None, 'ab', '10.0.0.1', None, 'GET /', 200, 't', 1)
+    assert c.code(a) == a and c.code(a) == a and not c.ids
+
+def accessDict(row):
+    el, srcid, subid, sl, bb, rf, ua, ra, ru, rq, st, tl, tu = row
+    return {'_el': el, '_id': srcid, '_ip': None, '_si': subid, '_sl': sl, '_ts': binrec._tsBD(tu),
+            'ae': 'a', 'body_bytes_sent': bb, 'http_referer': rf, 'http_user_agent': ua,
+            'remote_addr': ra, 'remote_user': ru, 'request': rq, 'status': st,
+            'time_local': tl, 'time_utc': tu}
+
+ROWS = [
+    ('0', 'TEST', 'test', 'a', 100, 'http://r/', 'curl', '10.1.2.3', None, 'GET / HTTP/1.1', 200, 't', 1438631586),
+    ('0', 'TEST', 'test', 'a', 0, None, None, '::1', 'bob', None, 0, 't', -1),
+    ('0', 'TEST', 'test', 'a', 2**63 - 1, 'x' * 251, 'y' * 252, '010.1.2.3', '', 'caf\xe9 ☃ \ud800', 65535, '', 0),
+    ('0', 'TEST', 'test', 'a', 5, 'r', 'u' * 70000, None, None, 'GET /', 404, 't', 2**62),
+]
+
+def test_access_round_trip():
+    for row in ROWS:
+        assert binrec.decode(binrec.encodeAccess(*row)) == accessDict(row)
+    assert binrec.encodeAccess(*ROWS[0])[:1] == b'A'
+    assert len(binrec.encodeAccess(*ROWS[0])) < len(json.dumps(accessDict(ROWS[0])))
+
+def test_accesses_as_encodeAccess():
+    rows = ROWS + [ROWS[0][:10] + (200, 't', 1.5)]
+    cols = [list(z) for z in zip(*rows)]
+    assert binrec.encodeAccesses(*ROWS[0][:4], *cols[4:]) == [binrec.encodeAccess(*row) for row in rows]
+
+def test_error_round_trip():
+    row = ('0', 'TEST', 'test', 'e', '[error]', 'open() "/x" failed\tclient: 1.2.3.4', '2015/08/03 12:53:06', 1438631586)
+    d = binrec.decode(binrec.encodeError(*row))
+    assert d == {'_el': '0', '_id': 'TEST', '_ip': None, '_si': 'test', '_sl': 'e', '_ts': '1438631586.    ',
+                 'ae': 'e', 'status': '[error]', 'stuff': row[5], 'time_local': row[6], 'time_utc': row[7]}
+    cols = [[z, z] for z in row]
+    assert binrec.encodeErrors(*row[:4], *cols[4:]) == [binrec.encodeError(*row)] * 2
+
+@pytest.mark.parametrize('bb, st, tu', [(2**63, 200, 1), (-1, 200, 1), (1, 65536, 1), (1, 200, 1.5), (1, '200', 1)])
+def test_wont_fit_is_json(bb, st, tu):
+    # Left to JSON (None), which decode() reads too.
+    row = ROWS[0][:4] + (bb,) + ROWS[0][5:10] + (st, 't', tu)
+    assert binrec.encodeAccess(*row) is None
+    if type(tu) is not int:
+        assert binrec.encodeError('0', 'TEST', 'test', 'e', '[warn]', '', 't', tu) is None
+    z = json.dumps(accessDict(row), sort_keys=True).encode()
+    assert binrec.decode(z) == json.loads(z)
+
+def test_read_records():
+    recs = [binrec.encodeAccess(*row) for row in ROWS]
+    z = b''.join(binrec.RLEN.pack(len(rec)) + rec for rec in recs)
+    assert list(binrec.readRecords(io.BytesIO(z))) == recs
+    assert list(binrec.readRecords(io.BytesIO(z[:-1]))) == recs[:-1]       # Torn last record.
+    with pytest.raises(ValueError):
+        binrec.decode(b'Q' + recs[0][1:])
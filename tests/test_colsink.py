@@ -0,0 +1,71 @@
+
+# *** NL2XLOG version ***
+
+# colsink: ColumnarSink's hourly parts, and reading them back.
+
+import os
+import pytest
+
+import colsink
+
+pytestmark = pytest.mark.skipif(not colsink.available(), reason='no numpy')
+
+T0 = 1438630000 // 3600 * 3600          # An hour's start.
+
+def row(t, x=0):
+    return (t, 200, 100 + x, '10.0.0.%d' % (x % 256), 'GET /%d HTTP/1.1' % (x % 3), 
+            None if x % 2 else 'curl/8', '-')
+
+def test_part_round_trip(tmp_path):
+    s = colsink.ColumnarSink(str(tmp_path))
+    for x in range(100):
+        s.add(*row(T0 + x, x))
+    s.add(*row(T0 + 3600))
+    s.close()
+    m = colsink.loadManifest(str(tmp_path))
+    assert [(p['rows'], p['tmin'], p['tmax']) for p in m['parts']] == \
+        [(100, T0, T0 + 99), (1, T0 + 3600, T0 + 3600)]
+    z = colsink.loadPart(str(tmp_path), m['parts'][0]['part'])
+    assert list(z['time_utc']) == list(range(T0, T0 + 100))
+    assert z['ipv4'][1] == colsink.ipv4('10.0.0.1') == 0x0a000001
+    assert [z['request.dict'][x] for x in z['request'][:4]] == \
+        ['GET /0 HTTP/1.1', 'GET /1 HTTP/1.1', 'GET /2 HTTP/1.1', 'GET /0 HTTP/1.1']
+    assert list(z['user_agent'][:2]) == [0, -1]
+
+def test_part_not_in_manifest(tmp_path):
+    # A crash after the rename, before the manifest: the next part of
+    # that hour gets the next seqn.
+    s = colsink.ColumnarSink(str(tmp_path))
+    s.add(*row(T0))
+    s.flush()
+    os.remove(os.path.join(str(tmp_path), colsink.MANIFEST))
+    s = colsink.ColumnarSink(str(tmp_path))
+    s.add(*row(T0 + 1))
+    s.close()
+    assert [p['part'][-4:] for p in colsink.loadManifest(str(tmp_path))['parts']] == ['0001']
+    assert sorted(os.listdir(str(tmp_path)))[:2] == [s.manifest['parts'][0]['part'][:-1] + '0', 
+                                                     s.manifest['parts'][0]['part']]
+
+def test_buffered_rows_bounded(tmp_path):
+    # Many open hours: past maxbuffered, the oldest is written.
+    s = colsink.ColumnarSink(str(tmp_path), maxbuffered=10)
+    for x in range(50):
+        s.add(*row(T0 + 3600 * (x // 4) + x, x))
+        assert s.nbuffered < 10
+    s.close()
+    m = colsink.loadManifest(str(tmp_path))
+    assert sum(p['rows'] for p in m['parts']) == 50 and s.nbuffered == 0
+
+def test_values_that_wont_fit(tmp_path):
+    # Sentinels for status and body_bytes_sent; no time_utc, no row.
+    s = colsink.ColumnarSink(str(tmp_path))
+    s.add(*row(T0))
+    s.add(T0 + 1, 70000, 2**70, '10.0.0.1', 'GET /', None, None)
+    s.add(T0 + 2, -1, '5', '10.0.0.1', 'GET /', None, None)
+    s.add(2**64, 200, 1, '10.0.0.1', 'GET /', None, None)
+    s.add(None, 200, 1, '10.0.0.1', 'GET /', None, None)
+    s.close()
+    assert s.nbad == 4 and s.nrows == 3
+    z = colsink.loadPart(str(tmp_path), colsink.loadManifest(str(tmp_path))['parts'][0]['part'])
+    assert list(z['status']) == [200, colsink.BADSTATUS, colsink.BADSTATUS]
+    assert list(z['body_bytes_sent']) == [100, colsink.BADBYTES, colsink.BADBYTES]
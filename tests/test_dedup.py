@@ -0,0 +1,40 @@
+
+# *** NL2XLOG version ***
+
+# dedup: DedupWindow, and resends dropped on re-export.
+
+import array
+
+import dedup
+
+
+def test_window_forgets_oldest():
+    w = dedup.DedupWindow(capacity=3)
+    for k in (1, 2, 3, 4):
+        w.add(k)
+    assert not w.seen(1)
+    assert w.seen(2) and w.seen(4)
+    assert w.ndropped == 2
+
+def test_key_ignores_line_end():
+    k = dedup.DedupWindow.key('a', 10, 'x y z')
+    assert k == dedup.DedupWindow.key('a', 10, b'x y z\r\n')
+    assert k != dedup.DedupWindow.key('a', 11, 'x y z')
+    assert k != dedup.DedupWindow.key('e', 10, 'x y z')
+
+def test_journal_reload_and_compact(tmp_path):
+    pfn = str(tmp_path / 'd.dedup')
+    w = dedup.DedupWindow(pfn, capacity=4)
+    for k in range(1, 11):
+        w.add(k)
+        w.flush()
+    w.add(11)                           # Not journaled.
+    w.close()
+    with open(pfn, 'ab') as f:
+        f.write(b'\1\2\3')              # Torn key.
+    w = dedup.DedupWindow(pfn, capacity=4)
+    assert [k for k in range(1, 12) if w.seen(k)] == [8, 9, 10, 11]
+    a = array.array('Q')
+    a.frombytes(open(pfn, 'rb').read()[:-3])
+    assert len(a) <= 2 * 4
+    w.close()
@@ -0,0 +1,61 @@
+
+# *** NL2XLOG version ***
+
+# dirwatch: DirWatcher wakes for wanted changes, by inotify or by polling.
+
+import threading, time
+import pytest
+
+import dirwatch
+
+
+@pytest.fixture(params=[True, False], ids=['inotify', 'poll'])
+def watcher(request, tmp_path):
+    w = dirwatch.DirWatcher(str(tmp_path), wanted=lambda fn: fn.startswith('access.log'),
+                            pollmin=0.05, pollmax=0.2, inotify=request.param)
+    yield w
+    w.close()
+
+def later(fn, s=0.2):
+    t = threading.Timer(s, fn)
+    t.start()
+    return t
+
+def test_idle_times_out(watcher):
+    t0 = time.time()
+    assert not watcher.wait(0.5)
+    assert time.time() - t0 >= 0.5
+
+def test_wanted_change_wakes(watcher, tmp_path):
+    pfn = tmp_path / 'access.log'
+    later(lambda: pfn.write_text('x\n'))
+    t0 = time.time()
+    assert watcher.wait(5)
+    assert time.time() - t0 < 2
+    later(lambda: pfn.write_text('x\ny\n'))
+    assert watcher.wait(5)
+
+def test_unwanted_change_ignored(watcher, tmp_path):
+    later(lambda: (tmp_path / 'nlmon.s3').write_text('db'))
+    assert not watcher.wait(0.6)
+
+def test_stop(watcher):
+    stop = threading.Event()
+    later(stop.set)
+    t0 = time.time()
+    assert not watcher.wait(30, stop.is_set)
+    assert time.time() - t0 < 1.5
+
+def test_changes_named(watcher, tmp_path):
+    assert watcher.changes() is None            # At first: anything may have.
+    assert watcher.changes() == set()
+    later(lambda: (tmp_path / 'access.log').write_text('x\n'))
+    (tmp_path / 'nlmon.s3').write_text('db')
+    assert watcher.wait(5)
+    time.sleep(0.1)
+    watcher.wait(0.3)                           # The rest of the events.
+    assert watcher.changes() == {'access.log'}
+    later(lambda: (tmp_path / 'access.log').rename(tmp_path / 'access.log.1'))
+    assert watcher.wait(5)
+    watcher.wait(0.3)
+    assert watcher.changes() == {'access.log', 'access.log.1'}
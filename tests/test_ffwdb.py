@@ -0,0 +1,152 @@
+
+# *** NL2XLOG version ***
+
+# ffwdb: FFWDB, and FFWTable's write-behind copy of it.
+
+import pytest
+
+import ffwdb
+
+
+def fi(inode, **kw):
+    z = {'inode': inode, 'ae': 'a', 'modified': 1.0, 'size': 100, 'acquired': 1.0,
+         'processed': 0, 'static': 1, 'filename': 'access.log.%d' % inode, 'extra': None}
+    z.update(kw)
+    return z
+
+@pytest.fixture(params=['FFWDB', 'FFWTable'])
+def db(request, tmp_path):
+    z = getattr(ffwdb, request.param)(str(tmp_path / 'nlmon.s3'))
+    yield z
+    z.disconnect()
+
+def test_insert_update_select(db):
+    assert db.insert(fi(1))['filename'] == 'access.log.1'
+    assert db.update({'inode': 1, 'size': 200})['size'] == 200
+    assert db.select(1)['size'] == 200
+
+def test_insert_duplicate_raises(db):
+    db.insert(fi(1))
+    with pytest.raises(RuntimeError, match='already in db'):
+        db.insert(fi(1))
+
+def test_update_missing_raises(db):
+    with pytest.raises(RuntimeError, match='not in db'):
+        db.update({'inode': 2, 'size': 1})
+    assert db.select(2) is None
+
+def failing(monkeypatch, n):
+    """FFWDB.upsert_many fails n times (-1: always)."""
+    upsert_many = ffwdb.FFWDB.upsert_many
+    fails = [n]
+    def z(self, fis):
+        if fis and fails[0]:
+            fails[0] -= 1
+            raise RuntimeError('FFWDB.upsert_many: disk I/O error')
+        return upsert_many(self, fis)
+    monkeypatch.setattr(ffwdb.FFWDB, 'upsert_many', z)
+
+def test_table_writer_retries(tmp_path, monkeypatch):
+    pfn = str(tmp_path / 'nlmon.s3')
+    t = ffwdb.FFWTable(pfn, delay=0.01)
+    failing(monkeypatch, 2)
+    t.insert(fi(1))
+    t.checkpoint(1, 50)
+    t.disconnect()
+    assert t.nerrors == 2 and t.error is None
+    db = ffwdb.FFWDB(pfn)
+    assert db.select(1)['processed'] == 50
+    db.disconnect()
+
+def test_table_writer_gives_up(tmp_path, monkeypatch):
+    t = ffwdb.FFWTable(str(tmp_path / 'nlmon.s3'), delay=0.01, retries=2)
+    failing(monkeypatch, -1)
+    t.insert(fi(1))
+    t.writer.join(5)
+    assert not t.writer.is_alive()
+    with pytest.raises(RuntimeError, match='disk I/O error'):
+        t.checkpoint(1, 50)
+    with pytest.raises(RuntimeError):
+        t.disconnect()
+
+def test_table_sync_commits(tmp_path):
+    # sync() returns only once its changes are committed (by the writer).
+    pfn = str(tmp_path / 'nlmon.s3')
+    t = ffwdb.FFWTable(pfn, delay=60)
+    try:
+        for x in range(1, 50):
+            t.extra({'moving': {'inode': x}})
+            t.checkpoint(1, x)
+            t.sync()
+            db = ffwdb.FFWDB(pfn)
+            assert db.extra() == {'moving': {'inode': x}}
+            db.disconnect()
+        with t.cycle():
+            t.extra({})
+            t.sync()                    # Not inside a cycle.
+    finally:
+        t.disconnect()
+
+def test_wal_and_synchronous(tmp_path):
+    db = ffwdb.FFWDB(str(tmp_path / 'nlmon.s3'), synchronous='full')
+    try:
+        assert db.db.execute('pragma journal_mode').fetchone()[0] == 'wal'
+        assert db.db.execute('pragma synchronous').fetchone()[0] == 2
+    finally:
+        db.disconnect()
+    with pytest.raises(ValueError):
+        ffwdb.FFWDB(str(tmp_path / 'x.s3'), synchronous='sometimes')
+
+def test_cycle_commits_at_end(tmp_path):
+    # A cycle's writes are one transaction; a reader (WAL) isn't blocked
+    # by it, and sees none of it until it ends.
+    pfn = str(tmp_path / 'nlmon.s3')
+    db, reader = ffwdb.FFWDB(pfn), ffwdb.FFWDB(pfn)
+    try:
+        with db.cycle():
+            db.insert(fi(1))
+            with db.cycle():
+                db.insert(fi(2))
+            db.checkpoint(1, 50)
+            assert reader.count() == 0
+            assert db.count() == 2
+        assert reader.select(1)['processed'] == 50 and reader.count() == 2
+    finally:
+        db.disconnect()
+        reader.disconnect()
+
+def test_cycle_rolls_back_on_error(tmp_path):
+    db = ffwdb.FFWDB(str(tmp_path / 'nlmon.s3'))
+    try:
+        db.insert(fi(1))
+        with pytest.raises(ZeroDivisionError):
+            with db.cycle():
+                db.checkpoint(1, 50)
+                db.insert(fi(2))
+                1/0
+        assert db.select(1)['processed'] == 0 and db.select(2) is None
+        assert not db.cycling
+    finally:
+        db.disconnect()
+
+def test_oldest_and_unfinished(db):
+    assert db.oldest() is None
+    db.upsert_many([fi(1, modified=3.0), fi(2, modified=1.0, processed=100), fi(3, modified=2.0, static=0)])
+    assert db.oldest()['inode'] == 3
+    assert db.oldest(unfinished=False)['inode'] == 1
+    assert [z['inode'] for z in db.unfinished()] == [3, 1]
+    assert [z['inode'] for z in db.unfinished(static=True)] == [1]
+    db.checkpoint(3, 100)
+    assert db.oldest()['inode'] == 1
+
+def test_held_back_not_unfinished(db):
+    # A live file held back at its size is done until it grows.
+    db.upsert_many([fi(1, modified=1.0, static=0), fi(2, modified=2.0)])
+    db.checkpoint(1, 80, held=100)
+    assert db.select(1)['held'] == 100
+    assert db.oldest()['inode'] == 2
+    assert [z['inode'] for z in db.unfinished()] == [2]
+    db.update({'inode': 1, 'size': 120})
+    assert db.oldest()['inode'] == 1
+    db.update({'inode': 1, 'size': 100, 'static': 1})
+    assert [z['inode'] for z in db.unfinished(static=True)] == [1, 2]
@@ -0,0 +1,458 @@
+
+# *** NL2XLOG version ***
+
+# nlmon: the watcher, end to end, and its export stages.
+
+import os, sys, gzip, json, time, threading, subprocess
+import pytest
+
+import nlmon
+
+
+@pytest.fixture(autouse=True)
+def interns():
+    """nlmon's intern tables, as maininits makes them."""
+    nlmon.makeInterns()
+
+@pytest.fixture
+def wpath(tmp_path, monkeypatch):
+    """A WPATH, with nlmon's settings for a short test run."""
+    w = tmp_path / 'w'
+    (w / 'done').mkdir(parents=True)
+    for k, v in {'WPATH': str(w), 'DONESD': 'done', 'TXTLEN': 0, 'DOTDIV': 0,
+                 'SRCID': 'TEST', 'SUBID': 'test', 'INTERVAL': 0.2, 'RESYNC': 0.2,
+                 'CYCLEMIN': 0, 'HEARTBEAT': False, 'FWTSTOP': False, 'FWTSTOPPED': False,
+                 'OXLOG': None, 'OFILE': None, 'COLSINK': None, 'DEDUPN': 0,
+                 'SPOOLD': str(tmp_path)}.items():
+        monkeypatch.setattr(nlmon, k, v)
+    monkeypatch.setattr(nlmon, 'FFWDBPFN', str(w / 'nlmon.s3'))
+    return w
+
+def runWatcher(until, timeout=30):
+    """watcherThread, until until() or timeout."""
+    t = threading.Thread(target=nlmon.watcherThread)
+    t.start()
+    try:
+        t1 = time.monotonic() + timeout
+        while not until() and time.monotonic() < t1 and t.is_alive():
+            time.sleep(0.05)
+    finally:
+        nlmon.FWTSTOP = True
+        t.join(10)
+    assert not t.is_alive()
+
+@pytest.mark.parametrize('backfill', [0, 2])
+def test_watcher_exports_and_archives(wpath, tmp_path, backfill, monkeypatch):
+    monkeypatch.setattr(nlmon, 'BACKFILL', backfill)
+    lines = (nlmon.A0 + '\n' + nlmon.A4 + '\n' + nlmon.A6 + '\n') * 100
+    (wpath / 'access.log.1').write_text(lines)
+    with gzip.open(wpath / 'access.log.2.gz', 'wt') as f:
+        f.write(lines)
+    (wpath / 'error.log.1').write_text((nlmon.E0 + '\n') * 10)
+    opfn = tmp_path / 'o.txt'
+    nlmon.OFILE = nlmon.ofwriter.OFWriter(str(opfn))
+    try:
+        runWatcher(lambda: len(os.listdir(wpath / 'done')) == 3)
+    finally:
+        nlmon.OFILE.close()
+    assert sorted(fn[7:] for fn in os.listdir(wpath / 'done')) == \
+        ['access.log.1', 'access.log.2.gz', 'error.log.1']
+    orecs = [json.loads(z) for z in opfn.read_text().splitlines()]
+    assert len(orecs) == 610
+    assert sum(1 for d in orecs if d['time_utc'] == json.loads(nlmon.A1)['time_utc']) == 200
+    assert sum(1 for d in orecs if d['ae'] == 'e') == 10
+    assert not [fn for fn in os.listdir(tmp_path) if fn.endswith('.spool')]
+
+def test_watcher_export_off(wpath, tmp_path, monkeypatch):
+    monkeypatch.setattr(nlmon, 'EXPORT', False)
+    (wpath / 'access.log.1').write_text(nlmon.A0 + '\n')
+    opfn = tmp_path / 'o.txt'
+    nlmon.OFILE = nlmon.ofwriter.OFWriter(str(opfn))
+    try:
+        runWatcher(lambda: os.path.exists(nlmon.FFWDBPFN), timeout=2)
+        time.sleep(0.5)
+    finally:
+        nlmon.FWTSTOP = True
+        nlmon.OFILE.close()
+    assert opfn.read_text() == ''
+    assert os.path.exists(wpath / 'access.log.1')
+
+def test_watcher_idles_when_done(wpath, tmp_path, monkeypatch):
+    # Once the file's exported, cycles are RESYNC apart, not INTERVAL.
+    monkeypatch.setattr(nlmon, 'INTERVAL', 0.05)
+    monkeypatch.setattr(nlmon, 'RESYNC', 60)
+    monkeypatch.setattr(nlmon, 'DONESD', None)
+    (wpath / 'access.log').write_text(nlmon.A0 + '\n')
+    cycles = []
+    changes = nlmon.dirwatch.DirWatcher.changes
+    monkeypatch.setattr(nlmon.dirwatch.DirWatcher, 'changes', lambda self: cycles.append(1) or changes(self))
+    nlmon.OFILE = nlmon.ofwriter.OFWriter(str(tmp_path / 'o.txt'))
+    try:
+        runWatcher(lambda: False, timeout=1.5)
+    finally:
+        nlmon.OFILE.close()
+    assert (tmp_path / 'o.txt').read_text().count('\n') == 1
+    assert len(cycles) <= 4
+
+def test_done_with_rolled_file(wpath, monkeypatch):
+    # The first move misses (rolled), the second's sink name is taken.
+    monkeypatch.setattr(nlmon, 'FFWDB', nlmon.ffwdb.FFWDB(nlmon.FFWDBPFN))
+    monkeypatch.setattr(nlmon, 'INODE2FN', {})
+    (wpath / 'access.log.2').write_text(nlmon.A0 + '\n')
+    (wpath / 'done' / '000002-access.log.2').write_text('')
+    fi = nlmon.getFI('access.log.2', 0)
+    nlmon.FFWDB.insert(fi)
+    try:
+        nlmon.doneWithFile(fi['inode'], 'access.log.1')
+        assert (wpath / 'done' / '000003-access.log.2').read_text() == nlmon.A0 + '\n'
+        assert nlmon.FFWDB.select(fi['inode']) is None
+        assert nlmon.FFWDB.extra() == {'doneseq': 3}
+    finally:
+        nlmon.FFWDB.disconnect()
+
+def test_unused_prefetch_closed(wpath, monkeypatch):
+    # B was prefetched, but A (plain) is exported: B's reader is closed.
+    monkeypatch.setattr(nlmon, 'FFWDB', nlmon.ffwdb.FFWDB(nlmon.FFWDBPFN))
+    (wpath / 'access.log.1').write_text(nlmon.A0 + '\n')
+    with gzip.open(wpath / 'access.log.2.gz', 'wt') as f:
+        f.write(nlmon.A0 + '\n')
+    try:
+        a, b = (nlmon.FFWDB.insert(nlmon.getFI(fn, 0)) for fn in ('access.log.1', 'access.log.2.gz'))
+        nlmon.prefetch(b)
+        reader = nlmon.PREFETCH[(b['inode'], 0)]
+        nlmon.exportFile(a)
+        assert not nlmon.PREFETCH
+        assert reader.f.closed
+    finally:
+        nlmon.closePrefetch()
+        nlmon.FFWDB.disconnect()
+
+def test_dedup_drops_resends(wpath, tmp_path, monkeypatch):
+    # Re-export from 0 (a lost checkpoint): nothing is sent twice.
+    monkeypatch.setattr(nlmon, 'FFWDB', nlmon.ffwdb.FFWDB(nlmon.FFWDBPFN))
+    monkeypatch.setattr(nlmon, 'DEDUP', nlmon.dedup.DedupWindow(str(tmp_path / 'd.dedup'), 1000))
+    monkeypatch.setattr(nlmon, 'BATCH', 7)
+    (wpath / 'access.log.1').write_text((nlmon.A0 + '\n' + nlmon.A4 + '\n') * 50)
+    opfn = tmp_path / 'o.txt'
+    nlmon.OFILE = nlmon.ofwriter.OFWriter(str(opfn))
+    try:
+        fi = nlmon.FFWDB.insert(nlmon.getFI('access.log.1', 0))
+        nlmon.exportFile(fi)
+        assert not nlmon.DEDUP.pending
+        nlmon.FFWDB.checkpoint(fi['inode'], 0)
+        nlmon.exportFile(nlmon.FFWDB.select(fi['inode']))
+    finally:
+        nlmon.OFILE.close()
+        nlmon.DEDUP.close()
+        nlmon.FFWDB.disconnect()
+    assert opfn.read_text().count('\n') == 100
+    assert nlmon.DEDUP.ndropped == 100
+
+def test_dedup_journals_once_written(tmp_path, monkeypatch):
+    # Keys are journaled per batch, once the sink has written its orecs.
+    monkeypatch.setattr(nlmon, 'DEDUP', nlmon.dedup.DedupWindow(str(tmp_path / 'd.dedup'), 1000))
+    for k, v in {'TXTLEN': 0, 'SRCID': 'TEST', 'SUBID': 'test', 'OXLOG': None, 'OFILE': None}.items():
+        monkeypatch.setattr(nlmon, k, v)
+    nlmon.OFILE = nlmon.ofwriter.OFWriter(str(tmp_path / 'o.txt'), interval=60)
+    try:
+        b = nlmon.recbatch.RecordBatch('a', 10)
+        for x, line in enumerate((nlmon.A0, nlmon.A4) * 3):
+            b.add(line, 100 * x)
+        nlmon.exportBatch(b)
+        assert nlmon.OFILE.pending() and len(nlmon.DEDUP.pending) == 6
+        nlmon.OFILE.flush()
+        nlmon.dedupFlush()
+        assert not nlmon.DEDUP.pending and nlmon.DEDUP.njournal == 6
+    finally:
+        nlmon.OFILE.close()
+        nlmon.DEDUP.close()
+
+def test_interns_sized_by_maininits(monkeypatch):
+    # INTERNN as set by INI/args, not as at import.
+    monkeypatch.setattr(nlmon, 'INTERNN', 2)
+    monkeypatch.setattr(nlmon, 'XFILE', None)
+    monkeypatch.setattr(nlmon, 'COLPATH', None)
+    nlmon.maininits()
+    assert nlmon.UAS.capacity == nlmon.REFERERS.capacity == nlmon.ADDRS.capacity == 2
+    z = [nlmon.UAS.get(''.join(['"curl/', str(x), '"'])) for x in (0, 1, 1, 2, 0)]
+    assert z == ['curl/0', 'curl/1', 'curl/1', 'curl/2', 'curl/0']
+    assert z[2] is z[1] and z[4] is not z[0]        # 0 was evicted by 2.
+    assert (nlmon.UAS.nhits, len(nlmon.UAS.d)) == (1, 2)
+    assert nlmon.UAS.get('"-"') is None
+
+def test_maininits_reads_knobs(monkeypatch):
+    # BACKFILL and the durability knobs come from the INI/args.
+    args = {'backfill': 4, 'batch': 100, 'dedupn': 1000.0, 'mmap': 0, 'gzindex': 0,
+            'ckptlines': 500, 'ckptbytes': 1e6, 'ckptsecs': 2.5, 'ofdurable': 'fsync',
+            'ofblock': 4096, 'dbmem': 0, 'dbdelay': 0.25, 'dbsync': 'FULL'}
+    monkeypatch.setattr(nlmon._a, 'argFloat', lambda k, d, v=None: args.get(k, v))
+    monkeypatch.setattr(nlmon._a, 'argString', lambda k, d, v=None: args.get(k, v))
+    monkeypatch.setattr(nlmon, 'XFILE', None)
+    monkeypatch.setattr(nlmon, 'COLPATH', None)
+    for k in ('BACKFILL', 'BATCH', 'DEDUPN', 'MMAP', 'GZINDEX', 'CKPTLINES', 'CKPTBYTES',
+              'CKPTSECS', 'OFDURABLE', 'OFBLOCK', 'DBMEM', 'DBDELAY', 'DBSYNC'):
+        monkeypatch.setattr(nlmon, k, getattr(nlmon, k))       # Restored after.
+    nlmon.maininits()
+    assert (nlmon.BACKFILL, nlmon.BATCH, nlmon.DEDUPN, nlmon.MMAP, nlmon.GZINDEX) == (4, 100, 1000, False, 0)
+    assert (nlmon.CKPTLINES, nlmon.CKPTBYTES, nlmon.CKPTSECS) == (500, 1000000, 2.5)
+    assert (nlmon.OFDURABLE, nlmon.OFBLOCK) == ('fsync', 4096)
+    assert (nlmon.DBMEM, nlmon.DBDELAY, nlmon.DBSYNC) == (False, 0.25, 'FULL')
+    args.clear()
+    nlmon.maininits()                   # Unset: as they were.
+    assert (nlmon.BACKFILL, nlmon.BATCH, nlmon.MMAP) == (4, 100, False)
+
+@pytest.mark.parametrize('oformat', ['json', 'binary'])
+@pytest.mark.parametrize('ae', ['a', 'e'])
+def test_batch_matches_per_record(monkeypatch, ae, oformat):
+    # parseBatch + genBatch make the orecs parseLogrec + gen*orec make.
+    for k, v in {'TXTLEN': 0, 'SRCID': 'TEST', 'SUBID': 'test', 'OFORMAT': oformat}.items():
+        monkeypatch.setattr(nlmon, k, v)
+    if ae == 'a':
+        lines, gen, el = [nlmon.A0, nlmon.A2, nlmon.A4, nlmon.A6], nlmon.genACCESSorec, nlmon.AEL
+    else:
+        lines, gen, el = [nlmon.E0, nlmon.E2, nlmon.E4, nlmon.E6], nlmon.genERRORorec, nlmon.EEL
+    lines = lines * 3 + (['not a logrec'] if ae == 'a' else [])
+    b = nlmon.recbatch.RecordBatch(ae, 100)
+    for line in lines:
+        b.add(line)
+    nlmon.parseBatch(b)
+    nlmon.genBatch(b)
+    z = []
+    for line in lines[:12]:
+        rc, rm, chunks = nlmon.parseLogrec(ae, line)
+        rc, rm, orec, vrec = gen(chunks, ae, el, ae, 'TEST', 'test')
+        assert rc == 0
+        z.append(orec)
+    assert b.orecs == z
+    # As the sample's JSON (but for _sl).
+    d = nlmon.binrec.decode(b.orecs[0] if oformat == 'binary' else b.orecs[0].encode())
+    x = json.loads(nlmon.A1 if ae == 'a' else nlmon.E1)
+    assert d.pop('_sl') == ae and x.pop('_sl') == '_'
+    assert d == x
+
+def requests(opfn):
+    """The request paths of an OFILE's orecs, in order."""
+    return [json.loads(z)['request'].split()[1] for z in opfn.read_text().splitlines()]
+
+def access(n0, n1):
+    return ''.join(['1.2.3.4 - - [03/Aug/2015:12:53:06 -0700] "GET /%d HTTP/1.1" 200 5 "-" "curl"\n' % x
+                    for x in range(n0, n1)])
+
+def test_live_partial_line_held_back(wpath, tmp_path, monkeypatch):
+    # A live file's unterminated line waits, and 'processed' is exactly
+    # what was exported, so nothing is sent twice.
+    monkeypatch.setattr(nlmon, 'FFWDB', nlmon.ffwdb.FFWDB(nlmon.FFWDBPFN))
+    pfn = wpath / 'access.log'
+    z = access(0, 4)
+    pfn.write_text(z[:-20])
+    opfn = tmp_path / 'o.txt'
+    nlmon.OFILE = nlmon.ofwriter.OFWriter(str(opfn))
+    try:
+        fi = nlmon.FFWDB.insert(nlmon.getFI('access.log', 0))
+        assert not fi['static']
+        nlmon.exportFile(fi)
+        fi = nlmon.FFWDB.select(fi['inode'])
+        assert fi['processed'] == len(access(0, 3))
+        with open(pfn, 'a') as f:
+            f.write(z[-20:] + access(4, 6))
+        fi['size'] = os.path.getsize(pfn)
+        nlmon.exportFile(fi)
+        assert nlmon.FFWDB.select(fi['inode'])['processed'] == fi['size']
+    finally:
+        nlmon.OFILE.close()
+        nlmon.FFWDB.disconnect()
+    assert requests(opfn) == ['/%d' % x for x in range(6)]
+
+def test_held_back_tail_blocks_nothing(wpath, tmp_path, monkeypatch):
+    # A live file whose last line never ends is done with until it
+    # grows; the newer files after it still get exported.
+    monkeypatch.setattr(nlmon, 'DONESD', None)
+    (wpath / 'access.log').write_text(access(0, 2) + access(2, 3)[:-20])
+    os.utime(wpath / 'access.log', (1.0e9, 1.0e9))
+    (wpath / 'error.log').write_text(nlmon.E0 + '\n')
+    opfn = tmp_path / 'o.txt'
+    nlmon.OFILE = nlmon.ofwriter.OFWriter(str(opfn))
+    try:
+        runWatcher(lambda: opfn.exists() and opfn.read_text().count('\n') == 3, timeout=10)
+        ino = os.stat(wpath / 'access.log').st_ino
+        fi = nlmon.FFWDB.select(ino)
+        assert fi['processed'] == len(access(0, 2)) and fi['held'] == fi['size']
+        assert not nlmon.FFWDB.unfinished()
+    finally:
+        nlmon.OFILE.close()
+        nlmon.FFWDB.disconnect()
+    assert opfn.read_text().count('\n') == 3
+
+@pytest.mark.parametrize('how', ['mmap', 'read', 'gz'])
+def test_checkpoints_and_resume(wpath, tmp_path, monkeypatch, how):
+    # Checkpoints every CKPTLINES (at batch ends); a stopped export
+    # resumes from the last one, and nothing is lost or sent twice.
+    monkeypatch.setattr(nlmon, 'FFWDB', nlmon.ffwdb.FFWDB(nlmon.FFWDBPFN))
+    for k, v in {'BATCH': 5, 'CKPTLINES': 10, 'MMAP': how == 'mmap'}.items():
+        monkeypatch.setattr(nlmon, k, v)
+    fn = 'access.log.1' + ('.gz' if how == 'gz' else '')
+    if how == 'gz':
+        with gzip.open(wpath / fn, 'wt') as f:
+            f.write(access(0, 47))
+    else:
+        (wpath / fn).write_text(access(0, 47))
+    ckpts = []
+    checkpoint = nlmon.checkpoint
+    def ckpt(fi, fprocessed, uprocessed=None, held=None):
+        ckpts.append(fprocessed if uprocessed is None else uprocessed)
+        checkpoint(fi, fprocessed, uprocessed, held)
+    monkeypatch.setattr(nlmon, 'checkpoint', ckpt)
+    exportBatch, nbatches = nlmon.exportBatch, []
+    def stopper(b):
+        nbatches.append(len(b))
+        if len(nbatches) == 5:
+            nlmon.FWTSTOP = True
+        return exportBatch(b)
+    monkeypatch.setattr(nlmon, 'exportBatch', stopper)
+    opfn = tmp_path / 'o.txt'
+    nlmon.OFILE = nlmon.ofwriter.OFWriter(str(opfn))
+    try:
+        fi = nlmon.FFWDB.insert(nlmon.getFI(fn, 0))
+        nlmon.exportFile(fi)
+        assert ckpts == [len(access(0, 10)), len(access(0, 20)), len(access(0, 25))]
+        fi = nlmon.FFWDB.select(fi['inode'])
+        assert fi['processed' if how != 'gz' else 'uprocessed'] == len(access(0, 25))
+        nlmon.FWTSTOP = False
+        nlmon.exportFile(fi)
+        fi = nlmon.FFWDB.select(fi['inode'])
+        assert fi['processed'] == fi['size']
+    finally:
+        nlmon.OFILE.close()
+        nlmon.FFWDB.disconnect()
+    assert requests(opfn) == ['/%d' % x for x in range(47)]
+
+def test_scan_and_inode_index(wpath, monkeypatch):
+    # getFIs indexes inodes as it scans; inode2filename uses the index,
+    # rescanning only for a miss or a stale (rolled) name.
+    monkeypatch.setattr(nlmon, 'INODE2FN', {})
+    for fn in ('access.log', 'access.log.1', 'error.log', 'other.txt'):
+        (wpath / fn).write_text(fn)
+    fis = nlmon.getFIs(0)
+    assert sorted(fi['filename'] for fi in fis) == ['access.log', 'access.log.1', 'error.log']
+    for fi in fis:
+        z = nlmon.getFI(fi['filename'], fi['acquired'])
+        assert fi == z and nlmon.INODE2FN[fi['inode']] == fi['filename']
+    scans = []
+    scandir = os.scandir
+    monkeypatch.setattr(nlmon.os, 'scandir', lambda p: scans.append(p) or scandir(p))
+    ino = os.stat(wpath / 'access.log').st_ino
+    assert nlmon.inode2filename(ino) == 'access.log' and not scans
+    os.rename(wpath / 'access.log.1', wpath / 'access.log.2')
+    os.rename(wpath / 'access.log', wpath / 'access.log.1')
+    assert nlmon.inode2filename(ino, stale='access.log') == 'access.log.1' and len(scans) == 1
+    assert nlmon.inode2filename(-1) is None and len(scans) == 2
+
+CRASH = """
+import os, sys
+import nlmon
+w, n = sys.argv[1], int(sys.argv[2])
+for k, v in {'WPATH': w, 'TXTLEN': 0, 'DOTDIV': 0, 'SRCID': 'TEST', 'SUBID': 'test',
+             'OXLOG': None, 'COLSINK': None, 'BATCH': 5, 'CKPTLINES': 5}.items():
+    setattr(nlmon, k, v)
+nlmon.makeInterns()
+nlmon.FFWDB = nlmon.ffwdb.FFWTable(os.path.join(w, 'nlmon.s3'), delay=60)
+nlmon.OFILE = nlmon.ofwriter.OFWriter(os.path.join(w, 'o.txt'))
+fi = nlmon.FFWDB.select(nlmon.FFWDB.inodes()[0])
+exportBatch, nbatches = nlmon.exportBatch, []
+def crasher(b):
+    nbatches.append(len(b))
+    if len(nbatches) > n:
+        os._exit(9)                 # Between batches: no cleanup, no write-behind.
+    return exportBatch(b)
+nlmon.exportBatch = crasher
+nlmon.exportFile(fi)
+"""
+
+def test_crash_resends_at_most_a_batch(wpath, tmp_path, monkeypatch):
+    # DBMEM's write-behind is 60s here, but checkpoints are written
+    # through: a killed export resumes within a batch of where it died.
+    (wpath / 'access.log.1').write_text(access(0, 47))
+    db = nlmon.ffwdb.FFWDB(str(wpath / 'nlmon.s3'))
+    db.insert(nlmon.getFI('access.log.1', 0))
+    db.disconnect()
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    z = subprocess.run([sys.executable, '-c', CRASH, str(wpath), '4'], env=env, timeout=60)
+    assert z.returncode == 9
+    assert len(requests(wpath / 'o.txt')) == 20
+    monkeypatch.setattr(nlmon, 'FFWDB', nlmon.ffwdb.FFWDB(nlmon.FFWDBPFN))
+    monkeypatch.setattr(nlmon, 'BATCH', 5)
+    nlmon.OFILE = nlmon.ofwriter.OFWriter(str(wpath / 'o.txt'))
+    try:
+        fi = nlmon.FFWDB.select(nlmon.FFWDB.inodes()[0])
+        assert fi['processed'] >= len(access(0, 15))
+        nlmon.exportFile(fi)
+    finally:
+        nlmon.OFILE.close()
+        nlmon.FFWDB.disconnect()
+    z = requests(wpath / 'o.txt')
+    assert sorted(set(z), key=lambda r: int(r[1:])) == ['/%d' % x for x in range(47)]
+    assert len(z) - 47 <= 5
+
+@pytest.mark.parametrize('gzindex', [0, 256])
+def test_backfill_resumes(wpath, tmp_path, monkeypatch, gzindex):
+    # Backfill starts where earlier exports checkpointed: 'processed'
+    # for plain files, 'uprocessed' for .gz ones.
+    for k, v in {'BACKFILL': 2, 'GZINDEX': gzindex}.items():
+        monkeypatch.setattr(nlmon, k, v)
+    (wpath / 'access.log.1').write_text(access(0, 47))
+    with gzip.open(wpath / 'access.log.2.gz', 'wt') as f:
+        f.write(access(100, 147))
+    db = nlmon.ffwdb.FFWDB(nlmon.FFWDBPFN)
+    a, b = (db.insert(nlmon.getFI(fn, 0)) for fn in ('access.log.1', 'access.log.2.gz'))
+    db.checkpoint(a['inode'], len(access(0, 20)))
+    db.checkpoint(b['inode'], 0, len(access(100, 130)))
+    db.disconnect()
+    opfn = tmp_path / 'o.txt'
+    nlmon.OFILE = nlmon.ofwriter.OFWriter(str(opfn))
+    try:
+        runWatcher(lambda: len(os.listdir(wpath / 'done')) == 2)
+    finally:
+        nlmon.OFILE.close()
+    z = requests(opfn)
+    assert sorted(z) == sorted(['/%d' % x for x in list(range(20, 47)) + list(range(130, 147))])
+
+def test_cycles_look_at_changes(wpath, tmp_path, monkeypatch):
+    # After the first (full) scan, cycles stat only the files DIRWATCH
+    # names, and a rotation (rename, new file) is tracked from those.
+    monkeypatch.setattr(nlmon, 'DONESD', None)
+    monkeypatch.setattr(nlmon, 'RESYNC', 600)       # No periodic full scan.
+    monkeypatch.setattr(nlmon, 'INTERVAL', 0.05)
+    for x in range(1, 31):
+        (wpath / ('error.log.%d' % x)).write_text(nlmon.E0 + '\n')
+    (wpath / 'access.log').write_text(access(0, 1))
+    stats = []
+    getFI = nlmon.getFI
+    monkeypatch.setattr(nlmon, 'getFI', lambda fn, *a: stats.append(fn) or getFI(fn, *a))
+    opfn = tmp_path / 'o.txt'
+    nlmon.OFILE = nlmon.ofwriter.OFWriter(str(opfn))
+    def step(until):
+        t1 = time.monotonic() + 10
+        while not until() and time.monotonic() < t1:
+            time.sleep(0.05)
+        assert until()
+    t = threading.Thread(target=nlmon.watcherThread)
+    t.start()
+    try:
+        step(lambda: nlmon.FFWDB and nlmon.FFWDB.rows() and not nlmon.FFWDB.unfinished())
+        assert len(stats) >= 31
+        del stats[:]
+        with open(wpath / 'access.log', 'a') as f:
+            f.write(access(1, 2))
+        step(lambda: opfn.read_text().count("\n") == 32)
+        assert set(stats) == {'access.log'}
+        ino = os.stat(wpath / 'access.log').st_ino
+        os.rename(wpath / 'access.log', wpath / 'access.log.1')
+        (wpath / 'access.log').write_text(access(2, 3))
+        step(lambda: opfn.read_text().count("\n") == 33)
+        rows = nlmon.FFWDB.rows()
+        assert rows[ino]['static'] and nlmon.INODE2FN[ino] == 'access.log.1'
+        assert len(rows) == 32 and set(stats) == {'access.log', 'access.log.1'}
+    finally:
+        nlmon.FWTSTOP = True
+        t.join(10)
+        nlmon.OFILE.close()
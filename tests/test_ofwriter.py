@@ -0,0 +1,56 @@
+
+# *** NL2XLOG version ***
+
+# ofwriter: OFWriter's blocks, framing and failures.
+
+import os, time
+import pytest
+
+import ofwriter
+
+
+def test_line_framing(tmp_path):
+    pfn = tmp_path / 'o.txt'
+    f = ofwriter.OFWriter(str(pfn), blocksize=64)
+    f.write('one')
+    f.writeMany(['two', b'three'] * 20)
+    f.close()
+    assert pfn.read_bytes() == b'one\n' + b'two\nthree\n' * 20
+
+def test_length_framing(tmp_path):
+    pfn = tmp_path / 'o.bin'
+    f = ofwriter.OFWriter(str(pfn), framing='length')
+    f.writeMany([b'\n\x00', b''])
+    f.close()
+    assert pfn.read_bytes() == b'\0\0\0\2\n\0' + b'\0\0\0\0'
+
+def test_ager_writes_old_block(tmp_path):
+    # No further write(): the ager writes the block out.
+    pfn = tmp_path / 'o.txt'
+    f = ofwriter.OFWriter(str(pfn), interval=0.1, durability='none')
+    try:
+        f.write('one')
+        assert pfn.read_bytes() == b''
+        t1 = time.monotonic() + 5
+        while not pfn.read_bytes() and time.monotonic() < t1:
+            time.sleep(0.02)
+        assert pfn.read_bytes() == b'one\n'
+    finally:
+        f.close()
+
+def test_partial_write_then_retry(tmp_path, monkeypatch):
+    # A write that fails part way: the retry writes the rest, once.
+    pfn = tmp_path / 'o.txt'
+    f = ofwriter.OFWriter(str(pfn), blocksize=1 << 20, interval=0)
+    write = os.write
+    def failing(fd, z):
+        if len(z) > 10:
+            return write(fd, z[:10])
+        raise OSError(28, 'No space left on device')
+    monkeypatch.setattr(ofwriter.os, 'write', failing)
+    with pytest.raises(RuntimeError, match='No space'):
+        f.write('0123456789abcdef')
+    monkeypatch.setattr(ofwriter.os, 'write', write)
+    f.write('more')                     # Appends to (resizes) the block.
+    f.close()
+    assert pfn.read_bytes() == b'0123456789abcdef\nmore\n'
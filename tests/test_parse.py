@@ -0,0 +1,92 @@
+
+# *** NL2XLOG version ***
+
+# nlmon's logrec parsing, timestamps and orec JSON.
+
+import json
+import pytest
+
+import nlmon
+
+
+ACCESS = [nlmon.A0, nlmon.A2, nlmon.A4, nlmon.A6,
+    '1.2.3.4 - bob [03/Aug/2015:12:53:06 -0700] "GET / HTTP/1.1" 404 0 "-" "-"',
+    '1.2.3.4 - - [03/Aug/2015:12:53:06 -0700] "" 400 0 "-" "-"',
+    # Not plain: the split parser's quirks apply.
+    '1.2.3.4 - - [03/Aug/2015:12:53:06 -0700] "GET /a b HTTP/1.1" 200 5 "-" "A \\"quoted\\" agent"',
+    '1.2.3.4 - -  [03/Aug/2015:12:53:06 -0700] "GET / HTTP/1.1" 200 5 "-" "curl"',
+    '1.2.3.4 - - [03/Aug/2015:12:53:06 -0700] "GET / HTTP/1.1" 200 5 " " "curl"',
+    '1.2.3.4 - - [03/Aug/2015:12:53:06 -0700] "GET /HTTP/1.0" HTTP/1.0" 200 5 "-" "curl"',
+]
+
+def slowParse(monkeypatch, ae, logrec):
+    with monkeypatch.context() as m:
+        m.setattr(nlmon, '_fastAccessChunks', lambda logrec: None)
+        return nlmon.parseLogrec(ae, logrec)
+
+@pytest.mark.parametrize('logrec', ACCESS)
+def test_fast_path_matches_split(monkeypatch, logrec):
+    assert nlmon.parseLogrec('a', logrec) == slowParse(monkeypatch, 'a', logrec)
+
+def test_fast_path_taken():
+    assert [bool(nlmon._fastAccessChunks(z)) for z in ACCESS] == [True, False] + [True] * 4 + [False] * 4
+    assert nlmon._fastAccessChunks('1.2.3.4 - - [x] "GET /" 200') is None
+
+
+def refError(locstr):
+    # strptime, localized as the slow path does.
+    z = nlmon.datetime.datetime.strptime(locstr, '%Y/%m/%d %H:%M:%S')
+    return int(nlmon._LOClocalize(z).timestamp())
+
+def refAccess(locstr):
+    return int(nlmon.datetime.datetime.strptime(locstr[1:-1], '%d/%b/%Y:%H:%M:%S %z').timestamp())
+
+@pytest.mark.parametrize('day', ['2015/03/08', '2015/11/01', '2016/03/13', '2015/07/05'])
+def test_error_times_around_dst(day):
+    # Every 10 minutes of DST change days (spring forward, fall back), 
+    # in order, so the per hour offsets and the last value memo are used.
+    for H in range(24):
+        for M in range(0, 60, 10):
+            locstr = '%s %02d:%02d:%02d' % (day, H, M, M % 7)
+            assert nlmon.CLFlocstr2utcut('e', locstr) == refError(locstr), locstr
+            assert nlmon.CLFlocstr2utcut('e', locstr) == refError(locstr), locstr
+
+@pytest.mark.parametrize('locstr', ['[03/Aug/2015:12:53:06 -0700]', '[08/Mar/2015:02:30:00 -0800]',
+    '[01/Nov/2015:01:30:00 -0700]', '[01/Nov/2015:01:30:00 -0800]', '[31/Dec/1999:23:59:59 +0545]',
+    '[29/Feb/2016:00:00:00 +0000]'])
+def test_access_times(locstr):
+    assert nlmon.CLFlocstr2utcut('a', locstr) == refAccess(locstr)
+
+@pytest.mark.parametrize('ae, locstr', [('a', '[29/Feb/2015:00:00:00 +0000]'), ('e', '2015/02/29 00:00:00'),
+                                        ('a', '[03/Aug/2015:24:00:00 -0700]'), ('e', '2015/08/03 12:60:00')])
+def test_bad_times_raise(ae, locstr):
+    with pytest.raises(ValueError):
+        nlmon.CLFlocstr2utcut(ae, locstr)
+
+
+@pytest.mark.parametrize('v', [None, 0, -1, 2**70, 'plain', '', ' ~!#[]', 'a "quote"', 'back\\slash',
+                               'tab\there', 'nl\n', '\x7f', 'caf\xe9', '☃', '\U0001f600', '\ud800'])
+def test_json_value(v):
+    assert nlmon._J(v) == json.dumps(v, ensure_ascii=True)
+
+@pytest.mark.parametrize('ae, logrec', [
+    ('a', nlmon.A0),
+    ('a', '1.2.3.4 bob - [03/Aug/2015:12:53:06 -0700] "GET /caf\xe9?q=\\x HTTP/1.1" 200 5 "ht\ttp://r/" "☃ agent"'),
+    ('e', nlmon.E0),
+    ('e', '2015/08/03 12:53:06 [error] 1#0: *1 open() "/caf\xe9\\x" failed, client: 1.2.3.4, server: s'),
+])
+def test_orec_json_as_dumps(monkeypatch, ae, logrec):
+    # The templated orec is json.dumps(sort_keys=True) of its logdict.
+    for k, v in {'TXTLEN': 0, 'OFORMAT': 'json', 'COLSINK': None}.items():
+        monkeypatch.setattr(nlmon, k, v)
+    nlmon.makeInterns()
+    gen = nlmon.genACCESSorec if ae == 'a' else nlmon.genERRORorec
+    rc, rm, chunks = nlmon.parseLogrec(ae, logrec)
+    rc, rm, orec, vrec = gen(chunks, ae, 20, '_', 'TEST', 'test')
+    assert rc == 0
+    d = json.loads(orec)
+    assert orec == json.dumps(d, ensure_ascii=True, sort_keys=True)
+    assert (d['_ip'], d['_el'], d['_id'], d['_si'], d['ae']) == (None, 20, 'TEST', 'test', ae)
+    assert d['_ts'] == nlmon.tsBDstr(d['time_utc'])
+    rc, rm, dorec, vrec = gen(nlmon.parseLogrec(ae, logrec)[2], ae, 20, '_', 'TEST', 'test', decorated=True)
+    assert dorec == '%s|%s|%s' % (d['_ts'], ae, orec)
@@ -0,0 +1,55 @@
+
+# *** NL2XLOG version ***
+
+# ratelimit: token buckets, on a fake clock.
+
+import pytest
+
+import ratelimit
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A fake monotonic clock; time.sleep advances it."""
+    now = [1000.0]
+    monkeypatch.setattr(ratelimit.time, 'monotonic', lambda: now[0])
+    def sleep(s):
+        now[0] += s
+    monkeypatch.setattr(ratelimit.time, 'sleep', sleep)
+    return now
+
+def test_bucket_burst_then_rate(clock):
+    b = ratelimit.TokenBucket(10, 20)
+    assert [b.take(1) for _ in range(20)] == [0] * 20
+    assert b.take(1) == pytest.approx(0.1)
+    assert b.take(4) == pytest.approx(0.5)
+    clock[0] += 0.5
+    assert b.level() == pytest.approx(0)
+
+def test_bucket_idle_banks_up_to_burst(clock):
+    b = ratelimit.TokenBucket(10)
+    assert b.burst == 10 * ratelimit.BURST
+    b.take(b.burst)
+    clock[0] += 0.3
+    assert b.level() == pytest.approx(3)
+    clock[0] += 3600
+    assert b.level() == b.burst
+
+def test_limiter_sustained_rate(clock):
+    # Past the burst, records and bytes go at no more than their rates.
+    r = ratelimit.RateLimiter(100, 1000, 10, 500)
+    t0 = clock[0]
+    for _ in range(110):
+        r.acquire(1, 20)
+    # Bytes bind: 110 * 20 = 2200, less the 500 burst, at 1000/sec;
+    # every acquire past the 10 record burst waits.
+    assert clock[0] - t0 == pytest.approx(1.7)
+    st = r.stats()
+    assert st['throttled'] == pytest.approx(1.7) and st['nthrottled'] == 110 - 10
+    assert st['rectokens'] == 10 and st['bytetokens'] == pytest.approx(0, abs=1e-6)     # Records refilled meanwhile.
+
+def test_limiter_one_bucket(clock):
+    r = ratelimit.RateLimiter(recrate=5)
+    assert r.acquire(5, 10 ** 9) == 0
+    assert r.acquire(1, 0) == pytest.approx(0.2)
+    assert r.stats()['bytetokens'] is None
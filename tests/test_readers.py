@@ -0,0 +1,98 @@
+
+# *** NL2XLOG version ***
+
+# readers: line blocks of .gz files, and lines of mmapped files.
+
+import gzip
+import pytest
+
+import readers
+
+
+LINES = b''.join(b'%06d some logrec text\n' % x for x in range(20000))
+
+def gzLines(reader):
+    with reader as f:
+        return b''.join(f.blocks())
+
+@pytest.fixture
+def gzfile(tmp_path):
+    pfn = tmp_path / 'access.log.2.gz'
+    with gzip.open(pfn, 'wb') as f:
+        f.write(LINES)
+    return pfn
+
+def test_gzblock_whole(gzfile):
+    assert gzLines(readers.GzBlockReader(str(gzfile), chunk=4096)) == LINES
+
+def test_gzblock_members_and_padding(gzfile):
+    z = gzfile.read_bytes()
+    gzfile.write_bytes(z + gzip.compress(b'last\n') + b'\0' * 100)
+    assert gzLines(readers.GzBlockReader(str(gzfile), chunk=4096)) == LINES + b'last\n'
+
+@pytest.mark.parametrize('cut', [0.5, 4])
+def test_gzblock_truncated(gzfile, cut):
+    # Mid-stream, and in the trailer.
+    z = gzfile.read_bytes()
+    gzfile.write_bytes(z[:int(len(z) * cut)] if cut < 1 else z[:-cut])
+    with pytest.raises(RuntimeError, match='end-of-stream'):
+        gzLines(readers.GzBlockReader(str(gzfile), chunk=4096))
+
+def test_gzblock_empty(tmp_path):
+    pfn = tmp_path / 'access.log.3.gz'
+    pfn.write_bytes(b'')
+    assert gzLines(readers.GzBlockReader(str(pfn))) == b''
+
+needsLibz = pytest.mark.skipif(readers.libz() is None, reason='no libz')
+
+@needsLibz
+def test_gzindex_resume(gzfile, tmp_path):
+    # Index while reading, then start from an access point.
+    ipfn = str(tmp_path / 'x.gzi')
+    assert gzLines(readers.GzIndexReader(str(gzfile), ipfn, spacing=65536, chunk=4096)) == LINES
+    skip = len(LINES) // 2
+    r = readers.GzIndexReader(str(gzfile), ipfn, skip=skip, chunk=4096)
+    assert 0 < r.start <= skip
+    assert gzLines(r) == LINES[r.start:]
+
+@needsLibz
+@pytest.mark.parametrize('cut', [0.5, 4])
+def test_gzindex_truncated(gzfile, tmp_path, cut):
+    z = gzfile.read_bytes()
+    gzfile.write_bytes(z[:int(len(z) * cut)] if cut < 1 else z[:-cut])
+    with pytest.raises(RuntimeError, match='end-of-stream'):
+        gzLines(readers.GzIndexReader(str(gzfile), str(tmp_path / 'x.gzi'), chunk=4096))
+
+@needsLibz
+def test_gzindex_members_and_padding(gzfile, tmp_path):
+    z = gzfile.read_bytes()
+    gzfile.write_bytes(z + gzip.compress(b'last\n') + b'\0' * 100)
+    assert gzLines(readers.GzIndexReader(str(gzfile), str(tmp_path / 'x.gzi'), chunk=4096)) == LINES + b'last\n'
+
+
+def mmapRef(data, start):
+    # (line, end) as the reader should give them.
+    z, x = [], start
+    while x < len(data):
+        y = data.find(b'\n', x)
+        y = len(data) if y < 0 else y + 1
+        z.append((data[x:y].rstrip(b'\n').decode('utf-8', 'replace'), y))
+        x = y
+    return z
+
+MIXED = (b'plain\n\ncaf\xc3\xa9 \xe2\x98\x83\n' + b'x' * 100 + b'\nbad \xff byte\n' + LINES[:2000])
+
+@pytest.mark.parametrize('data', [LINES[:3000], MIXED, MIXED + b'unterminated \xc3\xa9', b'\n\n', b'one'])
+@pytest.mark.parametrize('block', [16, 1000, readers.BLOCK])
+def test_mmap_lines(tmp_path, data, block):
+    pfn = tmp_path / 'access.log.1'
+    pfn.write_bytes(data)
+    for start in sorted({0, 1, data.find(b'\n') + 1, len(data)}):
+        with readers.MmapLineReader(str(pfn), start) as f:
+            assert list(f.lines('utf-8', 'replace', block)) == mmapRef(data, start)
+
+def test_mmap_empty(tmp_path):
+    pfn = tmp_path / 'access.log.1'
+    pfn.write_bytes(b'')
+    with readers.MmapLineReader(str(pfn)) as f:
+        assert list(f.lines()) == []
@@ -0,0 +1,135 @@
+
+# *** NL2XLOG version ***
+
+# xlogtx: XLogBatcher framing and sending, against a local socket.
+
+import socket, threading, time
+import pytest
+
+import xlogtx
+
+
+@pytest.fixture
+def server():
+    """A listening socket, and what its (one) connection receives."""
+    ls = socket.socket()
+    ls.bind(('127.0.0.1', 0))
+    ls.listen(1)
+    got = []
+    def rx():
+        c, _ = ls.accept()
+        with c:
+            while True:
+                z = c.recv(65536)
+                if not z:
+                    return
+                got.append(z)
+    t = threading.Thread(target=rx, daemon=True)
+    t.start()
+    yield ls.getsockname(), got, t
+    ls.close()
+
+class Held():
+    """A socket whose sendall()s wait for go."""
+    def __init__(self, sock):
+        self.sock = sock
+        self.go = threading.Event()
+    def sendall(self, z):
+        self.go.wait()
+        self.sock.sendall(z)
+    def close(self):
+        self.sock.close()
+
+def received(got, t):
+    t.join(5)
+    d = xlogtx.FrameDecoder()
+    return d.feed(b''.join(got))
+
+@pytest.mark.parametrize('compress', [None, 'batch', 'stream'])
+def test_round_trip(server, compress):
+    hp, got, t = server
+    recs = [b'rec %d ' % x * (x % 7) for x in range(2000)]
+    b = xlogtx.XLogBatcher(hp, maxcount=100, compress=compress)
+    b.sendMany(recs[:1000])
+    for rec in recs[1000:]:
+        b.send(rec)
+    b.disconnect()
+    assert received(got, t) == recs
+    assert b.nrecs == 2000 and b.nframes == 20
+
+def test_priorities(server):
+    # Waiting LIVE frames go ahead of BULK ones.
+    hp, got, t = server
+    b = xlogtx.XLogBatcher(hp, maxcount=1, maxqueue=16)
+    sock = b.sock = Held(b.sock)
+    b.send(b'first', xlogtx.BULK)
+    time.sleep(0.2)                     # The sender has it.
+    b.send(b'bulk', xlogtx.BULK)
+    b.send(b'live', xlogtx.LIVE)
+    sock.go.set()
+    b.disconnect()
+    assert received(got, t) == [b'first', b'live', b'bulk']
+
+def test_flush_blocks_without_lock(server):
+    # At the high-water mark, a blocked flush holds no lock: other
+    # callers (the ager, pending()) carry on, and order is kept.
+    hp, got, t = server
+    b = xlogtx.XLogBatcher(hp, maxcount=1, maxqueue=1)
+    sock = b.sock = Held(b.sock)
+    b.send(b'0')
+    time.sleep(0.2)                     # The sender has it,
+    b.send(b'1')                        #   this fills the queue,
+    z = threading.Thread(target=b.send, args=(b'2', ), daemon=True)
+    z.start()                           #   and this one blocks.
+    try:
+        time.sleep(0.2)
+        assert z.is_alive()
+        assert b.lock.acquire(timeout=1)
+        b.lock.release()
+        assert b.pending()
+    finally:
+        sock.go.set()
+    z.join(5)
+    b.disconnect()
+    assert received(got, t) == [b'0', b'1', b'2']
+
+@pytest.mark.parametrize('compress', [None, 'batch', 'stream'])
+def test_decoder_fed_in_pieces(server, compress):
+    # Frames split anywhere decode as whole ones.
+    hp, got, t = server
+    b = xlogtx.XLogBatcher(hp, compress=compress)
+    recs = [b'', b'x', b'rec \x00\xff' * 50] * 3
+    z = b''.join([b.frame(recs[x:x+3]) for x in range(0, len(recs), 3)])
+    b.disconnect()
+    for n in (1, 7, len(z)):
+        d = xlogtx.FrameDecoder()
+        out = []
+        for x in range(0, len(z), n):
+            out += d.feed(z[x:x+n])
+        assert out == recs and d.buf == b''
+
+def test_decode_frames(server):
+    hp, got, t = server
+    b = xlogtx.XLogBatcher(hp, compress='batch')
+    z = b.frame([b'a', b'bc']) + b.frame([b'def'])
+    b.compress = 'stream'
+    b.z = xlogtx.zlib.compressobj(6, xlogtx.zlib.DEFLATED, -15)
+    s = b.frame([b'g'])
+    b.disconnect()
+    assert xlogtx.decodeFrames(z + z[:9]) == ([b'a', b'bc', b'def'], z[:9])
+    with pytest.raises(ValueError):
+        xlogtx.decodeFrames(z + s)
+    with pytest.raises(ValueError):
+        xlogtx.decodeFrames(b'XXXX' + z[4:])
+
+def test_age_flush(server):
+    # Records below the size and count thresholds go out after maxage.
+    hp, got, t = server
+    b = xlogtx.XLogBatcher(hp, maxage=0.1)
+    b.send(b'lonely')
+    t1 = time.monotonic() + 5
+    while b.pending() and time.monotonic() < t1:
+        time.sleep(0.02)
+    assert not b.pending() and b.nframes == 1
+    b.disconnect()
+    assert received(got, t) == [b'lonely']
@@ -0,0 +1,288 @@
+
+# *** NL2XLOG version ***
+
+# Batched, framed transmission of orecs to an xlog server.
+# Orecs are accumulated and sent as one frame when a size, count
+#   or age threshold is reached, instead of one send per orec.
+# Frames go out on a sender thread, so sending overlaps the caller's
+#   reading and parsing.  At most maxqueue frames wait for it: past
+#   that high-water mark flush() (and so send()) blocks, pushing back
+#   on the caller.  drain() waits (no polling) until all are sent.
+# sendMany() queues a batch of records in one call.
+# Each frame has a priority (that of its records' send()s): waiting
+#   LIVE frames go out before BULK (backfill) ones.  An optional
+#   ratelimit.RateLimiter paces frames by records and bytes.
+#
+# Frame:  header FRAME ('NLXB', flags, count, length) followed by
+#         length bytes of payload: count records, each one a
+#         4-byte (network order) length and that many bytes.
+# Optional compression (flags says which):
+#   'batch'   F_DEFLATE: each payload is a raw deflate stream on its
+#             own.
+#   'stream'  F_STREAM: one raw deflate stream for the connection,
+#             sync flushed at the end of each payload, so repeats are
+#             found across frames.  Frames must be decoded in order.
+# Frames are built (and compressed) on the sender thread.
+# An optional coder (binrec.DictCoder) dictionary codes the records
+#   as their frames are built, in send order, for the connection.
+# FrameDecoder (or decodeFrames(), if no F_STREAM) is the other end
+#   (xlog stand-ins, tests).
+
+import socket, struct, threading, queue, time, zlib
+from l_misc import tblineno
+
+MAGIC = b'NLXB'
+FRAME = struct.Struct('!4sBII')     # magic, flags, count, length.
+RLEN = struct.Struct('!I')          # Record length.
+
+LIVE, BULK = 0, 1                   # Frame priorities.
+
+F_DEFLATE = 0x01                    # Frame flags: payload compressed alone,
+F_STREAM = 0x02                     #   or as part of the connection's stream.
+COMPRESSIONS = (None, 'batch', 'stream')
+
+
+class XLogBatcher():
+
+    def __init__(self, hp, limiter=None, maxbytes=65536, maxcount=500, maxage=0.5,
+                 nodelay=True, sndbuf=None, maxqueue=8, compress=None, level=6, coder=None):
+        if compress not in COMPRESSIONS:
+            raise ValueError('XLogBatcher: bad compress: %s' % repr(compress))
+        self.hp = hp                    # (host, port).
+        self.compress = compress
+        self.level = level
+        self.z = zlib.compressobj(level, zlib.DEFLATED, -15) if compress == 'stream' else None
+        self.coder = coder              # Has code(rec).  None: records as sent.
+        self.limiter = limiter          # ratelimit.RateLimiter, None: unthrottled.
+        self.maxbytes = maxbytes        # Flush thresholds.
+        self.maxcount = maxcount
+        self.maxage = maxage
+        self.txbacklog = []             # Encoded records awaiting a flush.
+        self.nbacklog = 0               # Their total length.
+        self.t0 = None                  # When the oldest of them arrived.
+        self.prio = LIVE                # Their priority.
+        self.nframes = self.nrecs = self.nbytes = 0
+        self.nraw = 0                   # Payload bytes before compression.
+        self.lock = threading.RLock()
+        self.frames = queue.PriorityQueue(maxsize=maxqueue)     # (prio, seqn, records) for the sender.
+        self.seqn = 0                   # FIFO within a priority.
+        self.nput = 0                   # Last seqn put: puts are in seqn order, outside self.lock.
+        self.turn = threading.Condition()
+        self.nqueued = 0                # Frames queued or being sent.
+        self.sent = threading.Condition()
+        self.error = None               # The sender's exception, raised to the caller.
+        self.stop = False
+        try:
+            self.sock = socket.create_connection(hp)
+            if nodelay:
+                self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if sndbuf:
+                self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, sndbuf)
+        except Exception as E:
+            errmsg = 'XLogBatcher: %s: %s @ %s' % (repr(hp), E, tblineno())
+            raise RuntimeError(errmsg)
+        self.sender = threading.Thread(target=self._sender, daemon=True)
+        self.sender.start()
+        # Age flushes for when orecs stop coming.
+        self.ager = threading.Thread(target=self._ager, daemon=True)
+        self.ager.start()
+
+    def _sender(self):
+        while True:
+            prio, seqn, recs = self.frames.get()
+            if recs is None:
+                return
+            try:
+                if not self.error:
+                    frame = self.frame(recs)
+                    if self.limiter:
+                        self.limiter.acquire(len(recs), len(frame))
+                    self.sock.sendall(frame)
+                    self.nframes += 1
+                    self.nrecs += len(recs)
+                    self.nbytes += len(frame)
+            except Exception as E:
+                self.error = 'XLogBatcher.sender: %s @ %s' % (E, tblineno())
+            finally:
+                with self.sent:
+                    self.nqueued -= 1
+                    self.sent.notify_all()
+
+    def _check(self):
+        if self.error:
+            raise RuntimeError(self.error)
+
+    def _ager(self):
+        while not self.stop:
+            time.sleep(self.maxage / 2)
+            try:
+                with self.lock:
+                    item = None
+                    if self.t0 and (time.time() - self.t0) >= self.maxage:
+                        item = self._take()
+                self._put(item)
+            except Exception:
+                pass                    # send()/flush() will raise it for the caller.
+
+    def send(self, rec, prio=LIVE):
+        """Queue one encoded record.  Flushes if a threshold is reached."""
+        items = []
+        with self.lock:
+            self._check()
+            if prio != self.prio:
+                items.append(self._take())      # A frame is of one priority.
+                self.prio = prio
+            if not self.txbacklog:
+                self.t0 = time.time()
+            self.txbacklog.append(rec)
+            self.nbacklog += len(rec)
+            if len(self.txbacklog) >= self.maxcount or \
+               self.nbacklog >= self.maxbytes or \
+               (time.time() - self.t0) >= self.maxage:
+                items.append(self._take())
+        for item in items:
+            self._put(item)
+        return len(rec)
+
+    def sendMany(self, recs, prio=LIVE):
+        """Queue a list of encoded records, as send() each, but under one lock and clock read."""
+        items = []
+        with self.lock:
+            self._check()
+            if prio != self.prio:
+                items.append(self._take())
+                self.prio = prio
+            n = 0
+            t = time.time()
+            for rec in recs:
+                if not self.txbacklog:
+                    self.t0 = t
+                self.txbacklog.append(rec)
+                self.nbacklog += len(rec)
+                n += len(rec)
+                if len(self.txbacklog) >= self.maxcount or self.nbacklog >= self.maxbytes:
+                    items.append(self._take())
+            if self.t0 and (t - self.t0) >= self.maxage:
+                items.append(self._take())
+        for item in items:
+            self._put(item)
+        return n
+
+    def frame(self, recs):
+        """Frame (and compress) a list of encoded records.  'stream': in send order only."""
+        if self.coder:
+            recs = [self.coder.code(z) for z in recs]
+        payload = b''.join([RLEN.pack(len(z)) + z for z in recs])
+        self.nraw += len(payload)
+        flags = 0
+        if self.compress == 'batch':
+            z = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+            payload = z.compress(payload) + z.flush()
+            flags = F_DEFLATE
+        elif self.compress == 'stream':
+            payload = self.z.compress(payload) + self.z.flush(zlib.Z_SYNC_FLUSH)
+            flags = F_STREAM
+        return FRAME.pack(MAGIC, flags, len(recs), len(payload)) + payload
+
+    def flush(self):
+        """Queue the backlog as one frame for the sender.  Blocks at the high-water mark."""
+        with self.lock:
+            self._check()
+            item = self._take()
+        self._put(item)
+
+    def _take(self):
+        # The backlog as a numbered frame item (None if empty).  Caller holds self.lock.
+        if not self.txbacklog:
+            return None
+        self.seqn += 1
+        item = (self.prio, self.seqn, self.txbacklog)
+        with self.sent:
+            self.nqueued += 1
+        self.txbacklog = []
+        self.nbacklog = 0
+        self.t0 = None
+        return item
+
+    def _put(self, item):
+        # Queue a _take()n item for the sender, in seqn order, without 
+        # self.lock: at the high-water mark only this caller waits.
+        if item is None:
+            return
+        seqn = item[1]
+        try:
+            with self.turn:
+                self.turn.wait_for(lambda: self.nput == seqn - 1)
+            try:
+                self.frames.put(item)
+            finally:
+                with self.turn:
+                    self.nput = seqn
+                    self.turn.notify_all()
+        except Exception as E:
+            errmsg = 'XLogBatcher.flush: %s @ %s' % (E, tblineno())
+            raise RuntimeError(errmsg)
+
+    def pending(self):
+        """Records or frames not yet sent?"""
+        return bool(self.txbacklog or self.nqueued)
+
+    def drain(self, timeout=None):
+        """Flush, then wait until everything is sent.  False if timed out."""
+        self.flush()
+        with self.sent:
+            done = self.sent.wait_for(lambda: not self.nqueued or self.error, timeout)
+        self._check()
+        return bool(done)
+
+    def disconnect(self):
+        self.stop = True
+        try:  self.drain()
+        finally:
+            self.frames.put((BULK + 1, 0, None))
+            self.sender.join()
+            try:  self.sock.close()
+            except:  pass
+
+
+class FrameDecoder():
+
+    def __init__(self):
+        self.buf = b''
+        self.z = zlib.decompressobj(-15)        # For F_STREAM frames.
+
+    def feed(self, data):
+        """Decode the whole frames so far.  Returns a list of records."""
+        recs = []
+        buf = self.buf + data
+        x = 0
+        while len(buf) - x >= FRAME.size:
+            magic, flags, count, length = FRAME.unpack_from(buf, x)
+            if magic != MAGIC:
+                raise ValueError('FrameDecoder: bad magic at %d' % x)
+            if len(buf) - x - FRAME.size < length:
+                break                   # Partial frame.
+            payload = buf[x+FRAME.size:x+FRAME.size+length]
+            if flags & F_STREAM:
+                if self.z is None:
+                    raise ValueError('decodeFrames: F_STREAM frame: use a FrameDecoder')
+                payload = self.z.decompress(payload)
+            elif flags & F_DEFLATE:
+                payload = zlib.decompress(payload, -15)
+            y = 0
+            for _ in range(count):
+                n = RLEN.unpack_from(payload, y)[0]
+                y += RLEN.size
+                recs.append(bytes(payload[y:y+n]))
+                y += n
+            x += FRAME.size + length
+        self.buf = buf[x:]
+        return recs
+
+
+def decodeFrames(buf):
+    """Decode whole frames from buf (no F_STREAM ones).  Returns (list of records, unused tail of buf)."""
+    d = FrameDecoder()
+    d.z = None                          # F_STREAM frames need a FrameDecoder of their own.
+    recs = d.feed(buf)
+    return recs, d.buf